@@ -0,0 +1,202 @@
+"""
+Delivers events from other threads and processes to the Tk thread.
+
+Events are put on a multiprocessing.Queue, so the execution process can
+send them too. A thread in the GUI process waits on the queue and wakes
+the Tk thread through a pipe only when there is something to do. The Tk
+thread then handles everything that arrived, at most once per frame:
+events of which only the last one matters (e.g. the status line) are
+coalesced, and events that can be handled together (e.g. log lines) are
+passed as one batch.
+
+How long events wait and how many pile up is written to
+GUI_METRICS_FNAME every PUMP_METRICS_INTERVAL seconds.
+"""
+import os
+import time
+import queue
+import threading
+import multiprocessing
+import tkinter as tk
+
+from schedule_metrics import percentile
+
+# handle events at most this often [ms]
+PUMP_FRAME_MS = 20
+
+# check for events this often where Tk can't watch the pipe [ms]
+PUMP_POLL_MS = 100
+
+GUI_METRICS_FNAME = "./gui_metrics.jsonl"
+PUMP_METRICS_INTERVAL = 60
+
+
+class EventPump:
+    """
+    Parameters:
+    - widget (tk.Misc): any widget of the GUI, to schedule on its Tk thread
+    - handlers (dict): {event_name: handler}, handler(**event_args), or
+      handler() if the event has no arguments
+    - coalesced (tuple): events of which only the last of a frame is handled
+    - batched (tuple): events whose handler gets the list of the event_args
+      of a frame
+    - metrics (MetricsSink): where to write the pump metrics, None to not
+      write any
+    """
+    def __init__(self, widget, handlers, coalesced=(), batched=(),
+            metrics=None):
+        self.widget = widget
+        self.handlers = handlers
+        self.coalesced = set(coalesced)
+        self.batched = set(batched)
+        self.metrics = metrics
+
+        self.queue = multiprocessing.Queue()
+
+        # filled by the reader thread, emptied by the Tk thread
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wake_pending = False
+        self.wake_w = None
+        self.drain_scheduled = False
+        self.last_drain = 0
+
+        self.reset_stats()
+
+    def put(self, event_name, event_args=None):
+        """
+        Sends an event to the Tk thread. Can be called from any thread, or
+        from a process forked from the GUI
+        """
+        self.queue.put([(event_name, event_args, time.time())])
+
+    def put_all(self, events):
+        """
+        Sends a list of (event_name, event_args) at once
+        """
+        t = time.time()
+        self.queue.put([(event_name, event_args, t)
+            for event_name, event_args in events])
+
+    def start(self):
+        """
+        Starts delivering events. Call it from the Tk thread
+        """
+        try:
+            self.wake_r, self.wake_w = os.pipe()
+            self.widget.tk.createfilehandler(self.wake_r, tk.READABLE,
+                    self.on_wake)
+        except (AttributeError, tk.TclError):
+            # no file handlers on this platform, poll instead
+            self.wake_w = None
+            self.widget.after(PUMP_POLL_MS, self.poll)
+
+        threading.Thread(target=self.read_queue, daemon=True).start()
+
+    def read_queue(self):
+        while True:
+            try:
+                events = self.queue.get()
+            except (EOFError, OSError, ValueError):
+                # queue closed, the GUI is going away
+                return
+            # take whatever else is there in one go
+            try:
+                while True:
+                    events += self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self.lock:
+                self.pending += events
+                wake = not self.wake_pending and self.wake_w is not None
+                self.wake_pending = True
+            if wake:
+                os.write(self.wake_w, b"\0")
+
+    def on_wake(self, fd, mask):
+        os.read(fd, 4096)
+        self.schedule_drain()
+
+    def poll(self):
+        if self.wake_pending:
+            self.schedule_drain()
+        self.widget.after(PUMP_POLL_MS, self.poll)
+
+    def schedule_drain(self):
+        if self.drain_scheduled:
+            return
+        self.drain_scheduled = True
+        # don't handle events more than once a frame, what arrives in
+        # between is handled together
+        since_last = (time.monotonic() - self.last_drain) * 1000
+        self.widget.after(max(0, int(PUMP_FRAME_MS - since_last)), self.drain)
+
+    def drain(self):
+        self.drain_scheduled = False
+        with self.lock:
+            events, self.pending = self.pending, []
+            self.wake_pending = False
+        if not events:
+            return
+
+        t_start = time.time()
+        self.handle(events)
+        t_end = time.time()
+        self.last_drain = time.monotonic()
+
+        self.stats["events"] += len(events)
+        self.stats["batches"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(events))
+        self.stats["latency"].append(t_start - events[0][2])
+        self.stats["drain"].append(t_end - t_start)
+        if t_end - self.stats["since"] >= PUMP_METRICS_INTERVAL:
+            self.write_stats(t_end)
+
+    def handle(self, events):
+        # only the last of the coalesced events gets handled
+        last = {event_name: idx
+                for idx, (event_name, _, _) in enumerate(events)
+                if event_name in self.coalesced}
+        batches = {}
+
+        for idx, (event_name, event_args, _) in enumerate(events):
+            if event_name in self.coalesced and last[event_name] != idx:
+                self.stats["coalesced"] += 1
+                continue
+            if event_name in self.batched:
+                batches.setdefault(event_name, []).append(event_args)
+                continue
+
+            handler = self.handlers[event_name]
+            if event_args is None:
+                handler()
+            else:
+                handler(**event_args)
+
+        for event_name, batch in batches.items():
+            self.handlers[event_name](batch)
+
+    def reset_stats(self, t=None):
+        self.stats = {"since": t or time.time(), "events": 0, "batches": 0,
+                "coalesced": 0, "max_depth": 0, "latency": [], "drain": []}
+
+    def write_stats(self, t):
+        stats = self.stats
+        self.reset_stats(t)
+        if self.metrics is None or not stats["batches"]:
+            return
+
+        record = {"kind": "gui_pump", "time": t,
+                "interval": t - stats["since"]}
+        for key in ("events", "batches", "coalesced", "max_depth"):
+            record[key] = stats[key]
+        for key in ("latency", "drain"):
+            record[key + "_p50"] = percentile(stats[key], 50)
+            record[key + "_p99"] = percentile(stats[key], 99)
+            record[key + "_max"] = max(stats[key])
+        try:
+            self.metrics.write([record])
+        except OSError:
+            # not worth bothering anyone about
+            pass
@@ -0,0 +1,153 @@
+"""
+History of the status messages shown in the log window.
+
+The last LOG_RING_SIZE messages are kept in memory, which is all the log
+window ever shows at once. Nothing is written from here: every status
+message is also logged, and the logging thread writes it to the rotating
+JSONL log file, with an index of every block of records (see
+schedule_logging). Older messages are paged back in from those files,
+and blocks without anything of the wanted level are skipped without
+being read.
+"""
+import glob
+import json
+import time
+import logging
+import datetime
+import collections
+
+from schedule_logging import LOG_FNAME, entry_time, read_index, status_level
+
+# messages kept in memory
+LOG_RING_SIZE = 5000
+
+# messages returned by LogHistory.older()
+LOG_PAGE_SIZE = 1000
+
+# time in front of the messages
+LOG_TIME_FMT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def status_text(t, text):
+    """
+    text as shown in the log window, with its time t in front
+    """
+    d = datetime.datetime.fromtimestamp(t)
+    return "[" + d.strftime(LOG_TIME_FMT)[:-3] + "]" + f": {text}"
+
+
+def log_entry(message, color, t=None):
+    return {"t": time.time() if t is None else t,
+            "level": status_level(color), "color": color, "message": message}
+
+
+def entry_matches(entry, min_level=logging.NOTSET, text=None):
+    if entry["level"] < min_level:
+        return False
+    return not text or text.lower() in entry["message"].lower()
+
+
+def log_files(fname):
+    """
+    Log file fname and its backups, oldest first
+    """
+    backups = {}
+    for name in glob.glob(glob.escape(fname) + ".*"):
+        suffix = name[len(fname) + 1:]
+        if suffix.isdigit():
+            backups[int(suffix)] = name
+    return [backups[i] for i in sorted(backups, reverse=True)] + [fname]
+
+
+def read_block(fname, block):
+    """
+    Status messages of a block of log file fname, as log window entries
+    """
+    entries = []
+    try:
+        with open(fname, "rb") as f:
+            f.seek(block["start"])
+            lines = f.read(block["end"] - block["start"]).splitlines()
+    except OSError:
+        return entries
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "color" not in record:
+            continue
+        t = entry_time(record)
+        entries.append(log_entry(status_text(t, record["message"]),
+            record["color"], t))
+    return entries
+
+
+class LogHistory:
+    """
+    Parameters:
+    - fname (str): log file the logging thread writes, see start_logging
+    """
+    def __init__(self, fname=LOG_FNAME):
+        self.fname = fname
+        self.ring = collections.deque(maxlen=LOG_RING_SIZE)
+
+    def append(self, logs):
+        """
+        Adds messages to the history
+
+        Parameters:
+        - logs (list): dicts of message, color and, optionally, t
+
+        Returns:
+        - list: the new entries
+        """
+        entries = [log_entry(log["message"], log["color"], log.get("t"))
+                for log in logs]
+        self.ring.extend(entries)
+        return entries
+
+    def recent(self, min_level=logging.NOTSET, text=None):
+        """
+        Messages in memory of at least min_level, containing text
+        """
+        return [entry for entry in self.ring
+                if entry_matches(entry, min_level, text)]
+
+    def first_time(self):
+        """
+        Time of the oldest message in memory
+        """
+        return self.ring[0]["t"] if self.ring else time.time()
+
+    def older(self, before, min_level=logging.NOTSET, text=None,
+            n=LOG_PAGE_SIZE):
+        """
+        Reads messages from the log files, going back from time before
+
+        Returns:
+        - list: up to n entries, oldest first
+        - float: time to pass as before for the next page, None if there
+          is nothing older
+        """
+        blocks = [(fname, block) for fname in log_files(self.fname)
+                for block in read_index(fname)
+                if block["t_first"] is not None
+                and block["t_first"] < before]
+
+        entries = []
+        for fname, block in reversed(blocks):
+            wanted = sum(count for level, count in block["levels"].items()
+                    if int(level) >= min_level)
+            if wanted:
+                found = [entry for entry in read_block(fname, block)
+                        if entry["t"] < before
+                        and entry_matches(entry, min_level, text)]
+                entries = found + entries
+            before = block["t_first"]
+            if len(entries) >= n:
+                break
+
+        if not blocks or before <= blocks[0][1]["t_first"]:
+            before = None
+        return entries, before
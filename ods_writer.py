@@ -0,0 +1,136 @@
+"""
+Background writer for the ODS file.
+
+The ODS file lives on a shared (NFS) mount, so it is written from a
+dedicated thread to keep slow writes off the path of the telescope
+commands. Bursts of updates are coalesced, identical updates are skipped
+and the file is replaced atomically so that readers never see a
+half-written file.
+"""
+import os
+import copy
+import json
+import time
+import tempfile
+import threading
+
+from odsutils import ods_engine
+
+ODS_DEFAULTS = "/opt/mnt/share/ods_defaults.json"
+ODS_WRITE    = "/home/sonata/ods.json"
+ODS_WRITE    = "/opt/mnt/share/ods_upload/ods.json"
+
+# wait this long after an update for more to come before writing, but
+# never hold an update back for more than ODS_COALESCE_MAX
+ODS_COALESCE = 0.5
+ODS_COALESCE_MAX = 5
+
+
+class ODSWriter:
+    """
+    Parameters:
+    - defaults_fname (str): ODS defaults file, only read once
+    - output_fname (str): ODS file to write
+    - write_status (callable): to report errors
+    """
+    def __init__(self, defaults_fname, output_fname, write_status=print):
+        self.output_fname = output_fname
+        self.write_status = write_status
+
+        # the defaults are read once, not from the shared mount (and
+        # parsed) at every write
+        with open(defaults_fname, "r") as f:
+            self.defaults = json.load(f)
+
+        self.cond = threading.Condition()
+        self.pending = None
+        self.last_written = None
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, ods_list):
+        """
+        Queue a new list of ODS entries to be written, replacing anything
+        that wasn't written yet
+        """
+        with self.cond:
+            self.pending = ods_list
+            self.cond.notify()
+
+    def close(self, timeout=10):
+        """
+        Write whatever is pending and stop the writer thread
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+
+                # let a burst of updates settle, i.e. wait until nothing
+                # new came for ODS_COALESCE, and only keep the last one
+                self.settle()
+                ods_list, self.pending = self.pending, None
+
+            try:
+                self.write(ods_list)
+            except Exception as e:
+                self.write_status(f"Could not write ODS file: {e}",
+                        fg='orange')
+
+    def settle(self):
+        """
+        Waits, with the lock held, until pending hasn't changed for
+        ODS_COALESCE seconds, or we are closing
+        """
+        t_max = time.monotonic() + ODS_COALESCE_MAX
+        while not self.closed:
+            pending = self.pending
+            deadline = min(time.monotonic() + ODS_COALESCE, t_max)
+            while not self.closed and self.pending is pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self.cond.wait(remaining)
+
+    def write(self, ods_list):
+        if not ods_list:
+            return
+
+        # skip if nothing changed since the last write
+        serialized = json.dumps(ods_list, sort_keys=True)
+        if serialized == self.last_written:
+            return
+
+        # not to be confused with obs :)
+        ods = ods_engine.ODS(output='ERROR')
+        # a copy, in case ODS changes it
+        ods.get_defaults_dict(copy.deepcopy(self.defaults))
+        ods.add_from_list(ods_list)
+
+        # write next to the output file and rename, which is atomic
+        # on the same filesystem
+        output_dir = os.path.dirname(os.path.abspath(self.output_fname))
+        fd, tmp_fname = tempfile.mkstemp(suffix=".tmp", prefix=".ods_",
+                dir=output_dir)
+        os.close(fd)
+        try:
+            ods.write_ods(tmp_fname)
+            # mkstemp files are only readable by us
+            os.chmod(tmp_fname, 0o644)
+            os.replace(tmp_fname, self.output_fname)
+        except Exception:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+            raise
+
+        self.last_written = serialized
@@ -1,20 +1,26 @@
 import os,sys
+import select
 from parse import parse
 from abc import ABC, abstractmethod
 import time
 import json
 import redis
 import datetime
-import tkinter as tk
+import math
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from ATATools import ata_control, logger_defaults, ata_if
-
-from hashpipe_keyvalues import HashpipeKeyValues
+from ATATools.ata_rest import ATARestException
 
 from SNAPobs.snap_hpguppi import snap_hpguppi_defaults as hpguppi_defaults
 from SNAPobs.snap_hpguppi import record_in as hpguppi_record_in
 from SNAPobs.snap_hpguppi import auxillary as hpguppi_auxillary
 
+from schedule_metrics import percentile
+
 WAIT_DTFMT = "%Y-%m-%dT%Hh%Mm%Ss%z"
 DAQPULSE_DTFMT = "%a %b %d %H:%M:%S %Y"
 
@@ -22,6 +28,70 @@ PROJECTID_FNAME = "./projects.json"
 BACKENDS_FNAME = "./backends.json"
 POSTPROCESSORS_FNAME = "./postprocessors.json"
 
+# hashpipe status key where I keep track of the last ansible playbook
+# that was applied to the recorders
+PLAYBOOK_KEY = "PLAYBOOK"
+
+REDIS_HOST = "redishost"
+_redis_pool = None
+
+# how long to wait for all DAQPULSEs to tick, and how often to check
+DAQPULSE_TIMEOUT = 3
+DAQPULSE_POLL = 0.1
+
+# how long to wait for the feeds to reach focus (can be overwritten with the
+# "FocusTimeout" key), how often to check, and how close (in MHz) the
+# reported focus frequency has to be to the requested one
+FOCUS_TIMEOUT = 60
+FOCUS_POLL = 1
+FOCUS_FREQ_TOL = 1
+# if there's no feedback from the focus mechanism, wait for this long
+FOCUS_BLIND_WAIT = 20
+
+# maximum number of hardware calls SetFreqTunning runs at the same time
+SETFREQ_MAX_WORKERS = 4
+
+# how many schedule lines ahead the lookahead prepares
+LOOKAHEAD_DEPTH = 3
+
+# Recording watcher: all recorders must have started this many seconds
+# after the requested start time, and are given at most RECORD_END_GRACE
+# seconds after the requested end time to finish. Polled every RECORD_POLL
+RECORD_START_GRACE = 5
+RECORD_END_GRACE = 15
+RECORD_POLL = 0.5
+RECORD_STATUS_KEYS = ["DAQSTATE", "PKTIDX", "PKTSTART", "PKTSTOP"]
+
+# On-source detection: antennas are on source when their pointing is within
+# ON_SOURCE_TOL degrees of the source, checked every ON_SOURCE_POLL seconds
+# for up to ON_SOURCE_TIMEOUT (can be overwritten with "SlewTimeout"), past
+# which the TRACK fails rather than record off source. The catalogue gives
+# J2000 positions, and the antennas may report theirs in apparent
+# coordinates of date, which are some 0.3 deg apart these days. So the
+# pointing is compared to the source in both frames: a 0.02 deg tolerance
+# can't be met in the wrong one, and is about a tenth of the beam at the
+# top of the band.
+# The recording then starts RECORD_MIN_LEAD seconds later (can be
+# overwritten with "MinLead"), or RECORD_ARM_MARGIN times the
+# RECORD_ARM_PERCENTILE of the last RECORD_ARM_SAMPLES record_in calls,
+# whichever is larger.
+# If we can't tell whether we are on source, fall back to RECORD_LEAD_DEFAULT
+ON_SOURCE_TOL = 0.02
+ON_SOURCE_POLL = 0.5
+ON_SOURCE_TIMEOUT = 120
+RECORD_MIN_LEAD = 3
+RECORD_ARM_MARGIN = 2
+RECORD_ARM_SAMPLES = 20
+RECORD_ARM_PERCENTILE = 90
+RECORD_LEAD_DEFAULT = 10
+
+# Fixed-clock mode: TRACK lines with a "StartUTC" key (isot) start recording
+# at that time. If we are late, "LatePolicy" says whether to "trim" ObsTime
+# so the scan still ends on time, or to just "flag" it and record it all
+LATE_POLICY_DEFAULT = "trim"
+
+# how often a WAITPROMPT checks whether the schedule got aborted [s]
+PROMPT_POLL = 0.5
 
 
 def most_common(lst):
@@ -33,72 +103,245 @@ def load_mapping(fname):
         mapping = json.load(json_file)
     return mapping
 
-def get_daqpulse(hp_targets):
-    redis_obj = redis.Redis(host='redishost', decode_responses=True)
-    daqpulses1 = []
-    daqpulses2 = []
+def get_redis():
+    """
+    Returns a redis client that shares a single connection pool across the
+    module, instead of opening a new connection every time
+    """
+    global _redis_pool
+    if _redis_pool is None:
+        _redis_pool = redis.ConnectionPool(host=REDIS_HOST,
+                decode_responses=True)
+    return redis.Redis(connection_pool=_redis_pool)
 
-    for node,instances in hp_targets.items():
-        for instance in instances:
-            kv = HashpipeKeyValues(node, instance, redis_obj)
-            dt_str = kv.get("DAQPULSE")
-            if not dt_str:
-                raise RuntimeError(f"Could not get a DAQPULSE from {node}.{instance}")
 
-            try:
-                dt = datetime.datetime.strptime(dt_str, DAQPULSE_DTFMT)
-            except Exception as e:
-                original_exception = e.args[0]
-                raise RuntimeError(f"Could not convert to datetime from {node}.{instance}\nOriginal exception: {original_exception}")
+def hashpipe_status_key(node, instance):
+    return f"hashpipe://{node}/{instance}/status"
+
 
-            daqpulses1.append(dt)
+def get_hashpipe_status(hp_targets, keys):
+    """
+    Reads the status keys of every hashpipe instance in one pipelined
+    round trip to redis.
 
-    #sleep to get one second in
-    time.sleep(1.5)
+    Parameters:
+    - hp_targets (dict): {node: [instances]}
+    - keys (list): status keys to read, e.g. ["DAQPULSE", "HPCONFIG"]
 
-    for node,instances in hp_targets.items():
-        for instance in instances:
-            kv = HashpipeKeyValues(node, instance, redis_obj)
-            dt_str = kv.get("DAQPULSE")
-            if not dt_str:
-                raise RuntimeError(f"Could not get a DAQPULSE from {node}.{instance}")
+    Returns:
+    - dict: {(node, instance): {key: value}}, value is None if not set
+    """
+    targets = [(node, instance) for node, instances in hp_targets.items()
+            for instance in instances]
 
-            try:
-                dt = datetime.datetime.strptime(dt_str, DAQPULSE_DTFMT)
-            except Exception as e:
-                original_exception = e.args[0]
-                raise RuntimeError(f"Could not convert to datetime from {node}.{instance}\nOriginal exception: {original_exception}")
+    pipe = get_redis().pipeline(transaction=False)
+    for node, instance in targets:
+        pipe.hmget(hashpipe_status_key(node, instance), keys)
+    values = pipe.execute()
+
+    return {target: dict(zip(keys, vals))
+            for target, vals in zip(targets, values)}
+
+
+def parse_daqpulses(status):
+    daqpulses = {}
+    for (node, instance), keyvals in status.items():
+        dt_str = keyvals["DAQPULSE"]
+        if not dt_str:
+            raise RuntimeError(f"Could not get a DAQPULSE from {node}.{instance}")
 
-            daqpulses2.append(dt)
+        try:
+            dt = datetime.datetime.strptime(dt_str, DAQPULSE_DTFMT)
+        except Exception as e:
+            original_exception = e.args[0]
+            raise RuntimeError(f"Could not convert to datetime from {node}.{instance}\nOriginal exception: {original_exception}")
 
-    i = 0
-    for node,instances in hp_targets.items():
-        for instance in instances:
-            daqpulse1 = daqpulses1[i]
-            daqpulse2 = daqpulses2[i]
-            diff = (daqpulse2 - daqpulse1).seconds
-            if diff < 1:
-                raise RuntimeError(f"No heartbeat from {node}.{instance}")
-            i += 1
+        daqpulses[(node, instance)] = dt
+    return daqpulses
 
 
+def get_daqpulse(hp_targets, timeout=DAQPULSE_TIMEOUT):
+    """
+    Checks that every hashpipe instance has a heartbeat, i.e. their DAQPULSE
+    advances. Returns as soon as all of them have ticked, and raises if any
+    didn't within timeout seconds
+    """
+    daqpulses_start = parse_daqpulses(get_hashpipe_status(hp_targets,
+        ["DAQPULSE"]))
+    waiting = dict(hp_targets)
+
+    t_unix_end = time.time() + timeout
+    while True:
+        daqpulses = parse_daqpulses(get_hashpipe_status(waiting,
+            ["DAQPULSE"]))
+
+        waiting = {}
+        for (node, instance), dt in daqpulses.items():
+            if (dt - daqpulses_start[(node, instance)]).total_seconds() < 1:
+                waiting.setdefault(node, []).append(instance)
+
+        if not waiting:
+            return
+
+        if time.time() > t_unix_end:
+            dead = [f"{node}.{instance}" for node, instances in waiting.items()
+                    for instance in instances]
+            raise RuntimeError(f"No heartbeat from {dead}")
 
-def get_current_backend(hp_targets):
-    redis_obj = redis.Redis(host='redishost', decode_responses=True)
-    kvs = []
+        time.sleep(DAQPULSE_POLL)
 
-    for node, instances in hp_targets.items():
-        for instance in instances:
-            kvs.append(HashpipeKeyValues(node, instance, redis_obj))
 
-    backend = list(set(kv.get("HPCONFIG") for kv in kvs))
+def get_current_backend(hp_targets, status=None):
+    if status is None:
+        status = get_hashpipe_status(hp_targets, ["HPCONFIG"])
+
+    backend = list(set(keyvals["HPCONFIG"] for keyvals in status.values()))
     assert len(backend) == 1, f"More than 1 backend detected for targets: {backend}"
 
     return backend[0]
 
 
+def get_current_playbook(hp_targets, status=None):
+    """
+    Returns the playbook that was last applied by the scheduler to all
+    the hashpipe targets, or None if the targets disagree or never had
+    one applied (a restart of hashpipe clears the key)
+    """
+    if status is None:
+        status = get_hashpipe_status(hp_targets, [PLAYBOOK_KEY])
+
+    playbooks = set(keyvals[PLAYBOOK_KEY] for keyvals in status.values())
+
+    if len(playbooks) != 1:
+        return None
+
+    return playbooks.pop() or None
+
+
+def run_concurrently(tasks, max_workers):
+    """
+    Runs a set of independent tasks in a bounded thread pool and waits for
+    all of them, even if some fail.
+
+    Parameters:
+    - tasks (dict): {name: callable}
+    - max_workers (int): size of the thread pool, 1 runs the tasks in order
+
+    Returns:
+    - dict: {name: duration in seconds} for every task
+
+    Raises:
+    - RuntimeError: listing every task that failed
+    """
+    def timed(task):
+        t_start = time.time()
+        task()
+        return time.time() - t_start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {name: pool.submit(timed, task)
+                for name, task in tasks.items()}
+
+    durations = {}
+    errors = []
+    for name, future in futures.items():
+        exception = future.exception()
+        if exception is not None:
+            errors.append(f"{name}: {exception}")
+        else:
+            durations[name] = future.result()
+
+    if errors:
+        raise RuntimeError("Failed: " + "; ".join(errors))
+
+    return durations
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """
+    Angular separation in degrees, ra in hours and dec in degrees
+    """
+    ra1, ra2 = math.radians(ra1 * 15), math.radians(ra2 * 15)
+    dec1, dec2 = math.radians(dec1), math.radians(dec2)
+    cos_sep = (math.sin(dec1) * math.sin(dec2) +
+            math.cos(dec1) * math.cos(dec2) * math.cos(ra1 - ra2))
+    return math.degrees(math.acos(min(1., max(-1., cos_sep))))
+
+
+def get_apparent_ra_dec(ra, dec, t_unix=None):
+    """
+    Apparent (true equator and equinox of date) position of a J2000 one,
+    ra in hours and dec in degrees
+    """
+    # only imported here, it takes a while and only TRACK needs it
+    import astropy.units as u
+    from astropy.time import Time
+    from astropy.coordinates import SkyCoord, TETE
+
+    obstime = Time(time.time() if t_unix is None else t_unix, format='unix')
+    apparent = SkyCoord(ra=ra * 15 * u.deg, dec=dec * u.deg,
+            frame='icrs').transform_to(TETE(obstime=obstime))
+    return apparent.ra.deg / 15, apparent.dec.deg
+
+
+def get_recording_states(hp_targets, pktstarts=None):
+    """
+    Returns the recording state of every hashpipe instance:
+    {(node, instance): "started" | "finished" | "idle" | None}
+    where None means the state could not be worked out from the status keys,
+    and the PKTSTART of every instance: {(node, instance): pktstart}
+
+    PKTIDX keeps counting after a recording, so until the PKTSTART and
+    PKTSTOP of a new one are in, the last one looks finished. With
+    pktstarts, {(node, instance): (pktstart, same)}, an instance is only
+    "finished" if its PKTSTART is (same) or is not (not same) pktstart
+    """
+    status = get_hashpipe_status(hp_targets, RECORD_STATUS_KEYS)
+
+    states = {}
+    starts = {}
+    for target, keyvals in status.items():
+        try:
+            pktidx   = int(keyvals["PKTIDX"])
+            pktstart = int(keyvals["PKTSTART"])
+            pktstop  = int(keyvals["PKTSTOP"])
+        except (TypeError, ValueError):
+            states[target] = None
+            continue
+        starts[target] = pktstart
+
+        daqstate = (keyvals["DAQSTATE"] or "").upper()
+
+        finished = pktstop > pktstart and pktidx >= pktstop
+        if pktstarts is not None and target in pktstarts:
+            expected, same = pktstarts[target]
+            finished = finished and (pktstart == expected) == same
+
+        if finished:
+            states[target] = "finished"
+        elif daqstate == "RECORD" or (pktstart > 0 and pktidx >= pktstart):
+            states[target] = "started"
+        else:
+            states[target] = "idle"
+    return states, starts
+
+
+def backend_family(backend):
+    """
+    The family of a backend, as reported in HPCONFIG (e.g. XGPU, BLADE)
+    """
+    return backend.split("_")[0].upper()
+
+
 class Executable(ABC):
-    def __init__(self, config, write_status):
+    # The hardware state this executor changes when executed, and the state
+    # its prepare() step depends on. Used by the Lookahead to know which
+    # lines can be prepared while earlier lines are still running.
+    # States are: "antennas", "pointing", "lo", "backend", "recording"
+    touches = set()
+    prepare_reads = set()
+
+    def __init__(self, config, write_status, interrupt_event=None):
         # configuration dictionary for each executor
         self.config = config
 
@@ -106,27 +349,97 @@ class Executable(ABC):
         self.write_status = write_status
 
         # in case schedule need to be aborted
-        # The executor can use this flag to interrupt if needed
-        self.interrupt = False
+        # The executor can wait on this event to be woken up as soon as
+        # an interrupt is requested. The event can be shared between
+        # executors so a single abort reaches all of them
+        if interrupt_event is None:
+            interrupt_event = threading.Event()
+        self.interrupt_event = interrupt_event
+
+        # results of prepare(), execute() falls back to doing the work
+        # itself for anything that is missing
+        self.prepared = {}
+
+        # how long each phase of execute() took, see timed()
+        self.timings = []
 
 
     @abstractmethod
     def execute(self):
         pass
 
+    @contextmanager
+    def timed(self, phase):
+        """
+        Times the enclosed block as a phase of this executor:
+            with self.timed("autotune"):
+                ...
+        """
+        t_start = time.time()
+        try:
+            yield
+        finally:
+            self.record_timing(phase, time.time() - t_start, t_start)
+
+    def record_timing(self, phase, duration, t_start=None, **extra):
+        """
+        Records the duration of a phase, any extra keyword arguments are
+        saved along with it
+        """
+        if t_start is None:
+            t_start = time.time() - duration
+        timing = {"phase": phase, "t_start": t_start, "duration": duration}
+        timing.update(extra)
+        self.timings.append(timing)
+
+    def prepare(self):
+        """
+        Optional work that can be done ahead of execute(), while earlier
+        schedule lines are still running. It must not change any hardware
+        state, results go in self.prepared
+        """
+        pass
+
     def check_consistency(self, needed_keys):
         for key in needed_keys:
             if key not in self.config.keys():
                 raise RuntimeError("Key: %s not in config keys" %key)
 
     def interrupt_requested(self):
-        return self.interrupt
+        return self.interrupt_event.is_set()
+
+    def request_interrupt(self):
+        self.interrupt_event.set()
+
+    def wait_interrupt(self, timeout):
+        """
+        Sleeps for up to timeout seconds, returns True straight away if
+        an interrupt is requested in the meantime
+        """
+        if timeout <= 0:
+            return self.interrupt_requested()
+        return self.interrupt_event.wait(timeout)
+
+    def sleep_until(self, t_unix_end):
+        """
+        Sleeps until the unix time t_unix_end. Returns False if we got
+        interrupted before reaching it
+        """
+        remaining = t_unix_end - time.time()
+        while remaining > 0:
+            if self.wait_interrupt(remaining):
+                return False
+            # Event.wait() can return slightly early, so check again
+            remaining = t_unix_end - time.time()
+        return not self.interrupt_requested()
 
 
 class ReserveAntennas(Executable):
     """
     Executer class that reserves antennas and checks whether their LNAs are on
     """
+    touches = {"antennas"}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -136,11 +449,13 @@ class ReserveAntennas(Executable):
     def execute(self):
         ant_list = self.config['ant_list']
         self.write_status(f"Reserving antennas: {ant_list}")
-        ata_control.reserve_antennas(ant_list)
+        with self.timed("reserve"):
+            ata_control.reserve_antennas(ant_list)
 
         # Get LNA status, and raise an exception if any is not on
         self.write_status("Getting LNA status")
-        lnas = ata_control.get_lnas(ant_list)
+        with self.timed("get_lnas"):
+            lnas = ata_control.get_lnas(ant_list)
         lnas_off = []
 
         for ant in ant_list:
@@ -153,6 +468,8 @@ class ReserveAntennas(Executable):
 
 
 class ReleaseAntennas(Executable):
+    touches = {"antennas"}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -162,10 +479,17 @@ class ReleaseAntennas(Executable):
     def execute(self):
         ant_list = self.config['ant_list']
         self.write_status(f"Releasing antennas: {ant_list}")
-        ata_control.release_antennas(ant_list, False)
+        with self.timed("release"):
+            ata_control.release_antennas(ant_list, False)
 
 
 class SetFreqTunning(Executable):
+    touches = {"lo"}
+
+    # whether ata_control.get_focus_freq() is there and works as expected,
+    # None until the first wait_focus_settled() finds out
+    focus_feedback = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -173,6 +497,9 @@ class SetFreqTunning(Executable):
                        "EQlevel", "Focus"]
         self.check_consistency(needed_keys)
 
+        # tune the LOs at the same time instead of one after the other
+        self.concurrent = True
+
     def execute(self):
         # Get all the needed LOs
         los   = []
@@ -186,41 +513,148 @@ class SetFreqTunning(Executable):
                 if f != '' and f != '0':
                     los.append(t)
                     freqs.append(float(f))
+
+        max_workers = SETFREQ_MAX_WORKERS if self.concurrent else 1
+
         if los:
             self.write_status("Setting frequencies for LOs: %s" %los)
-            max_freq = max(freqs)
-            lo_max_freq = los[freqs.index(max_freq)]
+            # only one LO sets the focus, the first one with the highest
+            # frequency
+            focus_lo = los[freqs.index(max(freqs))]
 
+            # The LOs are independent, so the non-focus LOs get tuned
+            # while the focus LO waits for the feeds to settle
+            tasks = {}
             for lo, freq in zip(los, freqs):
-                if freq == max_freq:
-                    focus_bool = bool(int(self.config['Focus']))
-                    self.write_status(f"Setting frequency {freq} for LO {lo}, setting focus: {focus_bool}")
-                    # "notfocus" is a bit confusing, but I set nofocus to True
-                    # if I don't want to set focus
-                    ata_control.set_freq(freq, self.config['ant_list'], 
-                                         lo=lo, nofocus= not focus_bool)
-                    # no feedback from focus freq mechanism
-                    # so I just wait for 20 seconds to make sure it happens
-                    if focus_bool:
-                        time.sleep(20)
-                else:
-                    ata_control.set_freq(freq, self.config['ant_list'], 
-                                         lo=lo, nofocus=True)
-                    self.write_status(f"Setting frequency {freq} for LO {lo}")
+                tasks[f"LO {lo}"] = (lambda lo=lo, freq=freq:
+                        self.set_lo_freq(lo, freq, lo == focus_lo))
+            for stage, duration in run_concurrently(tasks, max_workers).items():
+                self.record_timing(stage, duration)
 
+        # RF and IF tuning depend on the LOs (and on each other), so they
+        # run after all the LOs are set
         if bool(int(self.config['RFgain'])):
+            if self.interrupt_requested():
+                self.write_status("observation stop requested, not tuning "
+                        "RF and IF", fg='red')
+                return
             self.write_status("Tunning RF...")
-            ata_control.autotune(self.config['ant_list'])
+            with self.timed("RF autotune"):
+                ata_control.autotune(self.config['ant_list'])
             self.write_status("Done")
 
         if bool(int(self.config['IFgain'])):
+            if self.interrupt_requested():
+                self.write_status("observation stop requested, not tuning "
+                        "IF", fg='red')
+                return
             self.write_status("Tuning IF...")
-            ata_if.tune_if(self.config['ant_list'], los=los)
+            with self.timed("IF tune"):
+                ata_if.tune_if(self.config['ant_list'], los=los)
             self.write_status("Done")
 
         if bool(int(self.config['EQlevel'])):
             self.write_status("EQ level setting is not implemented yet", fg='red')
 
+        if self.timings:
+            timings = ", ".join(f"{timing['phase']}: {timing['duration']:.1f}s"
+                    for timing in self.timings)
+            self.write_status(f"Frequency setup timings: {timings}")
+
+    def set_lo_freq(self, lo, freq, is_focus_lo):
+        if is_focus_lo:
+            focus_bool = bool(int(self.config['Focus']))
+            self.write_status(f"Setting frequency {freq} for LO {lo}, setting focus: {focus_bool}")
+            # "notfocus" is a bit confusing, but I set nofocus to True
+            # if I don't want to set focus
+            ata_control.set_freq(freq, self.config['ant_list'], 
+                                 lo=lo, nofocus= not focus_bool)
+            if focus_bool:
+                self.wait_focus_settled(freq)
+        else:
+            ata_control.set_freq(freq, self.config['ant_list'], 
+                                 lo=lo, nofocus=True)
+            self.write_status(f"Setting frequency {freq} for LO {lo}")
+
+    def wait_focus_settled(self, freq):
+        """
+        Polls the focus frequency of the feeds until all antennas in ant_list
+        report the requested frequency, or until the timeout.
+        The time each antenna took is kept in self.focus_settle_times
+
+        Parameters:
+        - freq (float): the focus frequency that was requested [MHz]
+        """
+        ant_list = self.config['ant_list']
+        timeout = float(self.config.get('FocusTimeout', FOCUS_TIMEOUT))
+        self.focus_settle_times = {}
+
+        t_start = time.time()
+        t_unix_end = t_start + timeout
+        waiting = list(ant_list)
+
+        if SetFreqTunning.focus_feedback is None:
+            SetFreqTunning.focus_feedback = callable(
+                    getattr(ata_control, "get_focus_freq", None))
+        if not SetFreqTunning.focus_feedback:
+            # the ATATools we have can't tell, so I just wait for some
+            # time to make sure it happens
+            self.write_status(f"Waiting {FOCUS_BLIND_WAIT} seconds for "
+                    f"focus to settle on {freq} MHz")
+            self.sleep_until(t_start + FOCUS_BLIND_WAIT)
+            return
+
+        self.write_status(f"Waiting for focus to settle on {freq} MHz")
+        while waiting:
+            try:
+                focus_freqs = ata_control.get_focus_freq(waiting)
+                settled = [ant for ant in waiting
+                        if focus_freqs.get(ant) is not None and
+                        abs(float(focus_freqs[ant]) - freq) <= FOCUS_FREQ_TOL]
+            except (ATARestException, OSError) as e:
+                # no feedback from focus freq mechanism, so I just
+                # wait for some time to make sure it happens. Only for
+                # communication errors (requests' errors are OSErrors)
+                self.write_status(f"Could not get focus state ({e}), "
+                        f"waiting {FOCUS_BLIND_WAIT} seconds instead",
+                        fg='orange')
+                self.sleep_until(t_start + FOCUS_BLIND_WAIT)
+                return
+            except (TypeError, AttributeError, ValueError) as e:
+                # get_focus_freq() isn't what I expected, don't try it
+                # again this session
+                SetFreqTunning.focus_feedback = False
+                self.write_status(f"Unexpected focus state ({e!r}), waiting "
+                        f"{FOCUS_BLIND_WAIT} seconds for focus from now on",
+                        fg='orange')
+                self.sleep_until(t_start + FOCUS_BLIND_WAIT)
+                return
+
+            t_now = time.time()
+            for ant in settled:
+                self.focus_settle_times[ant] = round(t_now - t_start, 1)
+                waiting.remove(ant)
+
+            if not waiting:
+                break
+
+            if t_now > t_unix_end:
+                self.write_status(f"Focus did not settle after {timeout} "
+                        f"seconds for antennas: {waiting}", fg='orange')
+                break
+
+            if self.wait_interrupt(FOCUS_POLL):
+                return
+
+        self.record_timing("focus_settle", time.time() - t_start, t_start)
+
+        if self.focus_settle_times:
+            slowest = max(self.focus_settle_times,
+                    key=self.focus_settle_times.get)
+            self.write_status(f"Focus settled in {time.time() - t_start:.1f} "
+                    f"seconds, slowest antenna: {slowest} "
+                    f"({self.focus_settle_times[slowest]} s)")
+
 
 class WaitFor(Executable):
     def __init__(self, *args, **kwargs):
@@ -233,11 +667,10 @@ class WaitFor(Executable):
 
         t_unix_end = time.time() + t
 
-        while time.time() < t_unix_end:
-            if self.interrupt_requested():
-                self.write_status(f"observation stop requested", fg='red')
-                return
-            time.sleep(1)
+        with self.timed("wait"):
+            interrupted = not self.sleep_until(t_unix_end)
+        if interrupted:
+            self.write_status(f"observation stop requested", fg='red')
 
 
 class WaitUntil(Executable):
@@ -274,13 +707,13 @@ class WaitUntil(Executable):
         remaining_time = (target_time - now).total_seconds()
         self.write_status(f"Waiting for {remaining_time} seconds until {target_time}...")
 
-        # Sleep for the remaining time
-        t_unix_end = time.time() + remaining_time
-        while time.time() < t_unix_end:
-            if self.interrupt_requested():
-                self.write_status(f"observation stop requested", fg='red')
-                return
-            time.sleep(1)
+        # Sleep until the target time, using the absolute time rather than
+        # the remaining time so the status writes don't make us late
+        with self.timed("wait"):
+            interrupted = not self.sleep_until(target_time.timestamp())
+        if interrupted:
+            self.write_status(f"observation stop requested", fg='red')
+            return
         self.write_status("Reached target time!")
 
 class WaitPrompt(Executable):
@@ -288,6 +721,19 @@ class WaitPrompt(Executable):
         super().__init__(*args, **kwargs)
 
     def execute(self):
+        if not os.environ.get("DISPLAY"):
+            # headless (see schedule_runner.py), ask in the terminal
+            self.write_status("User prompt: press Enter to proceed with observing script")
+            print("Press Enter to continue observation", flush=True)
+            if self.wait_enter():
+                self.write_status("User prompt: continuing observing script")
+            else:
+                self.write_status(f"observation stop requested", fg='red')
+            return
+
+        # only imported here so that running a schedule doesn't need Tk
+        import tkinter as tk
+
         root = tk.Tk()
         root.geometry("350x150")  # Set the size of the window
         root.title("Wait prompt")
@@ -302,14 +748,45 @@ class WaitPrompt(Executable):
             command = on_click, font=("Arial", 14))
         continue_button.pack(pady=10)
 
+        # the window doesn't wait for anyone if the schedule gets aborted
+        def check_interrupt():
+            if self.interrupt_requested():
+                root.destroy()
+            else:
+                root.after(int(PROMPT_POLL * 1000), check_interrupt)
+        check_interrupt()
+
         root.mainloop()
-        self.write_status("User prompt: continuing observing script")
+        if self.interrupt_requested():
+            self.write_status(f"observation stop requested", fg='red')
+        else:
+            self.write_status("User prompt: continuing observing script")
+
+    def wait_enter(self):
+        """
+        Waits for a line on stdin, without blocking in a read so that an
+        abort gets through. Returns False if interrupted
+
+        Raises:
+        - EOFError: if stdin is closed, as there is nobody to answer
+        """
+        while not self.interrupt_requested():
+            ready, _, _ = select.select([sys.stdin], [], [], PROMPT_POLL)
+            if ready:
+                if not sys.stdin.readline():
+                    raise EOFError("stdin is closed, nobody can answer "
+                            "the prompt")
+                return True
+        return False
 
 
 
 
 
 class SetBackend(Executable):
+    touches = {"backend", "recording"}
+    prepare_reads = {"backend"}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         needed_keys = ["ProjectID", "Backend", 
@@ -318,6 +795,19 @@ class SetBackend(Executable):
 
         self.check_heartbeat = False
 
+        # skip the ansible playbook if the recorders are already running it
+        self.fast_switch = True
+
+    def prepare(self):
+        backends_mapping = load_mapping(BACKENDS_FNAME)
+        backend_config   = backends_mapping[self.config['Backend']]
+
+        # Only reads the recorder state, the lookahead makes sure no line
+        # in between changes the backend
+        if self.fast_switch:
+            self.prepared['playbook_already_applied'] = \
+                    self.playbook_already_applied(backend_config)
+
     def execute(self):
         projectid_mapping      = load_mapping(PROJECTID_FNAME)
         backends_mapping       = load_mapping(BACKENDS_FNAME)
@@ -326,17 +816,33 @@ class SetBackend(Executable):
         backend_config  = backends_mapping[self.config['Backend']]
         postproc_script = postprocessors_mapping[self.config['Postprocessor']]
 
+        hp_targets = self.config['hp_targets']
+
+        if 'playbook_already_applied' in self.prepared:
+            playbook_already_applied = self.prepared['playbook_already_applied']
+        else:
+            playbook_already_applied = self.fast_switch and \
+                    self.playbook_already_applied(backend_config)
+
         # Set backend
-        self.write_status(f"executing: ansible-playbook {backend_config}")
-        os.system(f"ansible-playbook {backend_config}")
+        if playbook_already_applied:
+            self.write_status(f"Recorders already running {backend_config}, "
+                    "skipping ansible-playbook")
+        else:
+            self.write_status(f"executing: ansible-playbook {backend_config}")
+            with self.timed("ansible"):
+                os.system(f"ansible-playbook {backend_config}")
+
+            # keep track of the playbook, so that next time we can skip it
+            hpguppi_auxillary.publish_keyval_dict_to_redis(
+                    {PLAYBOOK_KEY: backend_config},
+                    hp_targets, postproc=False)
 
         if self.config['Backend'].upper().startswith("XGPU"):
             res = parse('xGPU_{xtimeint}s{tmp}', self.config['Backend']+"tmp")
             xtimeint = float(res['xtimeint'])
             keyval_dict = {'XTIMEINT': xtimeint}
 
-            hp_targets = self.config['hp_targets']
-
             hpguppi_auxillary.publish_keyval_dict_to_redis(keyval_dict,
                             hp_targets, postproc=False)
 
@@ -344,16 +850,44 @@ class SetBackend(Executable):
 
         # Set postprocessor
         self.write_status(f"executing: {postproc_script}")
-        os.system(postproc_script)
+        with self.timed("postprocessor"):
+            os.system(postproc_script)
 
         if self.check_heartbeat:
             time.sleep(1)
             self.write_status("Checking for DAQPULSE")
-            get_daqpulse(self.config['hp_targets'])
+            with self.timed("daqpulse"):
+                get_daqpulse(self.config['hp_targets'])
             self.write_status("Done")
 
+    def playbook_already_applied(self, backend_config):
+        """
+        Returns True if all recorders report the same backend family as the
+        one requested and were last configured with the same playbook,
+        in which case only the redis keys need updating
+        """
+        hp_targets = self.config['hp_targets']
+        try:
+            status = get_hashpipe_status(hp_targets, ["HPCONFIG", PLAYBOOK_KEY])
+            current_backend = get_current_backend(hp_targets, status)
+            current_playbook = get_current_playbook(hp_targets, status)
+        except Exception as e:
+            self.write_status(f"Could not get current backend: {e}",
+                    fg='orange')
+            return False
+
+        if not current_backend:
+            return False
+
+        if backend_family(self.config['Backend']) not in current_backend.upper():
+            return False
+
+        return current_playbook == backend_config
+
 
 class SetAzEl(Executable):
+    touches = {"pointing"}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         needed_keys = ["ant_list", "Az", "El"]
@@ -363,24 +897,43 @@ class SetAzEl(Executable):
         ant_list = self.config['ant_list']
         Az, El = float(self.config['Az']), float(self.config['El'])
         self.write_status(f"Setting antennas to Az,El = ({Az}, {El})")
-        ata_control.set_az_el(ant_list, self.config['Az'], self.config['El'])
+        with self.timed("set_az_el"):
+            ata_control.set_az_el(ant_list, self.config['Az'], self.config['El'])
 
 
         
 class TrackAndObserve(Executable):
+    touches = {"pointing", "recording"}
+
+    # how long the last record_in calls took, to know how early
+    # recordings need to be armed
+    arm_latencies = collections.deque(maxlen=RECORD_ARM_SAMPLES)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         needed_keys = ["ant_list", "hp_targets", "Source",
                 "ObsTime"]
         self.check_consistency(needed_keys)
 
+    def prepare(self):
+        # Resolve the source coordinates from the catalogue ahead of time,
+        # they are needed to point the beams if we are beamforming
+        source = self.config['Source']
+        if source.upper() != "NONE":
+            self.prepared['ra_dec'] = ata_control.get_source_ra_dec(source)
+
     def execute(self):
         ant_list = self.config['ant_list']
         source   = self.config['Source']
 
         if source.upper() != "NONE":
             self.write_status(f"Tracking source {source}")
+            # how far the antennas have to go, to calibrate the slew model
+            slew_deg = self.get_slew_distance(source)
+            t_track = time.time()
             ata_control.make_and_track_ephems(source, ant_list)
+            self.record_timing("track", time.time() - t_track, t_track,
+                    slew_deg=slew_deg)
         else: 
             # we got a "none" source to track, so let's get the source the 
             # antennas are currently observing
@@ -408,7 +961,10 @@ class TrackAndObserve(Executable):
             # If beamformer, let's configure the beams
             if 'BLADE' in current_backend.upper():
                 try:
-                    ra, dec = ata_control.get_source_ra_dec(source)
+                    if 'ra_dec' in self.prepared:
+                        ra, dec = self.prepared['ra_dec']
+                    else:
+                        ra, dec = ata_control.get_source_ra_dec(source)
                 except ATARestException as e:
                     # source not in database...?
                     # just get the ra, dec from first antenna
@@ -445,55 +1001,377 @@ class TrackAndObserve(Executable):
                     hpguppi_auxillary.publish_keyval_dict_to_redis(keyval_dict,
                             hp_targets, postproc=False)
 
-            obs_start_in = 10
+            with self.timed("on_source"):
+                on_source = self.wait_on_source(source)
+
+            if on_source:
+                obs_start_in = self.get_min_lead()
+            else:
+                obs_start_in = RECORD_LEAD_DEFAULT
+
+            if self.interrupt_requested():
+                self.write_status(f"observation stop requested", fg='red')
+                return
+
+            # the deliberate wait for StartUTC is not overhead, keep it
+            # apart for the calibration
+            extra = {}
+            if 'StartUTC' in self.config:
+                min_lead = obs_start_in
+                obs_start_in, obstime = self.fixed_clock_start(obs_start_in,
+                        obstime)
+                extra['fixed_clock_wait'] = obs_start_in - min_lead
+                if obstime <= 0:
+                    self.write_status(f"Too late to observe {source}, "
+                            "skipping scan", fg='red')
+                    return
+
+            t_arm = time.time()
+            t_record_start = t_arm + obs_start_in
             hpguppi_record_in.record_in(obs_start_in, obstime,
                     hashpipe_targets = hp_targets)
-            self.write_status(f"Recording for {obstime}")
-
-            t_unix_end = time.time() + obstime + obs_start_in + 5
-            
-            while time.time() < t_unix_end:
-                if self.interrupt_requested():
-                    hpguppi_record_in.record_in(reset=True,
-                            hashpipe_targets = hp_targets)
-                    return
-                time.sleep(1)
+            TrackAndObserve.arm_latencies.append(time.time() - t_arm)
+            self.record_timing("record_in", time.time() - t_arm, t_arm,
+                    record_start=t_record_start, **extra)
+
+            t_start_utc = datetime.datetime.fromtimestamp(t_record_start,
+                    datetime.timezone.utc)
+            self.write_status(f"Recording for {obstime}, starting at "
+                    f"{t_start_utc.strftime('%H:%M:%S.%f')[:-3]} UTC")
+
+            try:
+                with self.timed("recording"):
+                    finished = self.wait_recording_done(t_record_start,
+                            obstime)
+            except Exception:
+                hpguppi_record_in.record_in(reset=True,
+                        hashpipe_targets = hp_targets)
+                raise
+
+            if not finished:
+                hpguppi_record_in.record_in(reset=True,
+                        hashpipe_targets = hp_targets)
+                return
+
+    def fixed_clock_start(self, min_lead, obstime):
+        """
+        Works out when to start recording to hit the planned StartUTC
+
+        Parameters:
+        - min_lead (float): smallest delay we can give to record_in
+        - obstime (float): requested recording length
+
+        Returns:
+        - (float, float): delay to give record_in, and recording length
+        """
+        t_planned = datetime.datetime.fromisoformat(self.config['StartUTC'])
+        t_planned = t_planned.replace(tzinfo=datetime.timezone.utc)
+        start_in = t_planned.timestamp() - time.time()
+
+        if start_in >= min_lead:
+            return start_in, obstime
+
+        late = min_lead - start_in
+        policy = self.config.get('LatePolicy', LATE_POLICY_DEFAULT).lower()
+        if policy == "trim":
+            self.write_status(f"Running {late:.1f} s behind the planned start "
+                    f"{self.config['StartUTC']}, trimming ObsTime to "
+                    f"{obstime - late:.1f} s", fg='orange')
+            return min_lead, obstime - late
+
+        self.write_status(f"Scan is {late:.1f} s late compared to the planned "
+                f"start {self.config['StartUTC']}", fg='orange')
+        return min_lead, obstime
+
+    def get_slew_distance(self, source):
+        """
+        Largest angle in degrees between the antennas and the source,
+        None if it can't be worked out
+        """
+        ant_list = self.config['ant_list']
+        try:
+            if 'ra_dec' in self.prepared:
+                src_ra, src_dec = self.prepared['ra_dec']
+            else:
+                src_ra, src_dec = ata_control.get_source_ra_dec(source)
+            ant_ra_dec = ata_control.get_ra_dec(ant_list)
+            return max(angular_separation(*ant_ra_dec[ant], src_ra, src_dec)
+                    for ant in ant_list)
+        except Exception:
+            return None
+
+    def get_min_lead(self):
+        """
+        Smallest delay that is safe to give to record_in
+        """
+        min_lead = float(self.config.get('MinLead', RECORD_MIN_LEAD))
+        if TrackAndObserve.arm_latencies:
+            # a single slow call shouldn't push every later recording back
+            min_lead = max(min_lead, RECORD_ARM_MARGIN * percentile(
+                list(TrackAndObserve.arm_latencies), RECORD_ARM_PERCENTILE))
+        return min_lead
+
+    def wait_on_source(self, source):
+        """
+        Polls the pointing of the antennas until all of them are within
+        ON_SOURCE_TOL of the source, in J2000 or apparent coordinates.
+
+        Returns:
+        - bool: True if all antennas are on source, False if interrupted
+          or there is no pointing feedback
+
+        Raises:
+        - RuntimeError: if the antennas are not on source after the timeout
+        """
+        ant_list = self.config['ant_list']
+        timeout = float(self.config.get('SlewTimeout', ON_SOURCE_TIMEOUT))
+
+        try:
+            if 'ra_dec' in self.prepared:
+                src_ra, src_dec = self.prepared['ra_dec']
+            else:
+                src_ra, src_dec = ata_control.get_source_ra_dec(source)
+        except Exception as e:
+            self.write_status(f"Could not get position of {source}, "
+                    f"can't check if on source: {e}", fg='orange')
+            return False
+
+        positions = [(src_ra, src_dec),
+                get_apparent_ra_dec(src_ra, src_dec)]
+
+        t_start = time.time()
+        t_unix_end = t_start + timeout
+        while True:
+            try:
+                ant_ra_dec = ata_control.get_ra_dec(ant_list)
+            except Exception as e:
+                self.write_status(f"Could not get antenna positions, "
+                        f"can't check if on source: {e}", fg='orange')
+                return False
+
+            off_source = [ant for ant in ant_list
+                    if min(angular_separation(*ant_ra_dec[ant], ra, dec)
+                        for ra, dec in positions) > ON_SOURCE_TOL]
+
+            if not off_source:
+                self.write_status(f"Antennas on source after "
+                        f"{time.time() - t_start:.1f} s")
+                return True
+
+            if time.time() > t_unix_end:
+                raise RuntimeError(f"Antennas {off_source} not on "
+                        f"{source} after {timeout} s")
+
+            if self.wait_interrupt(ON_SOURCE_POLL):
+                return False
+
+    def wait_recording_done(self, t_record_start, obstime):
+        """
+        Watches the hashpipe status of all recorders, and returns as soon
+        as all of them are done recording.
+
+        Parameters:
+        - t_record_start (float): unix time the recording was armed for
+        - obstime (float): length of the recording [s]
+
+        Returns:
+        - bool: False if interrupted
+
+        Raises:
+        - RuntimeError: if any recorder didn't start recording
+        """
+        hp_targets = self.config['hp_targets']
+        t_record_end = t_record_start + obstime
+
+        def unknown_state():
+            # Can't tell what the recorders are doing from their keys,
+            # so just wait like we used to
+            self.write_status("Could not get recording state, waiting "
+                    "for the full recording time", fg='orange')
+            return self.sleep_until(t_record_end + RECORD_END_GRACE)
+
+        # Fail fast if a recorder never started
+        if not self.sleep_until(t_record_start +
+                min(RECORD_START_GRACE, obstime)):
+            return False
+
+        states, starts = get_recording_states(hp_targets)
+        if None in states.values():
+            return unknown_state()
+
+        not_started = [f"{node}.{instance}"
+                for (node, instance), state in states.items()
+                if state == "idle"]
+        if not_started:
+            raise RuntimeError(f"Recording did not start on {not_started}")
+
+        # Only the recording seen started counts as finished. One that
+        # already looks finished still has the keys of the last one,
+        # unless this recording is short enough to be over already
+        pktstarts = {target: (starts[target], state == "started" or
+                obstime <= RECORD_START_GRACE)
+                for target, state in states.items()}
+
+        # Then check on them once the recording should be done
+        if not self.sleep_until(t_record_end):
+            return False
+
+        t_unix_end = t_record_end + RECORD_END_GRACE
+        while True:
+            states, _ = get_recording_states(hp_targets, pktstarts)
+            if None in states.values():
+                return unknown_state()
+
+            if all(state == "finished" for state in states.values()):
+                self.write_status(f"Recording done, "
+                        f"{time.time() - t_record_end:.1f} s after requested end")
+                return True
+
+            if time.time() > t_unix_end:
+                still_recording = [f"{node}.{instance}"
+                        for (node, instance), state in states.items()
+                        if state != "finished"]
+                self.write_status(f"Recorders still not done after "
+                        f"{RECORD_END_GRACE} s: {still_recording}", fg='orange')
+                return True
+
+            if self.wait_interrupt(RECORD_POLL):
+                return False
 
 
 
 
 class ScheduleExecutor:
-    def __init__(self, action_type, config, write_status=print):
-        self.executor = self._get_executor(action_type, config, write_status)
+    def __init__(self, action_type, config, write_status=print,
+            interrupt_event=None):
+        self.executor = self._get_executor(action_type, config, write_status,
+                interrupt_event)
         self.action_type = action_type
         self.config = config
 
-    def _get_executor(self, action_type, config, write_status):
+        # prepare() and execute() can be called from different threads
+        self._prepare_lock = threading.Lock()
+        self._prepare_done = False
+
+        # where to send the timings, and what to tag them with,
+        # see set_metrics()
+        self.metrics = None
+        self.metrics_tags = {}
+
+    def set_metrics(self, metrics, schedule_id, line):
+        """
+        Makes execute() write its phase timings to a MetricsSink
+        """
+        self.metrics = metrics
+        self.metrics_tags = {"schedule_id": schedule_id, "line": line}
+
+    @property
+    def touches(self):
+        return self.executor.touches
+
+    @property
+    def prepare_reads(self):
+        return self.executor.prepare_reads
+
+    def _get_executor(self, action_type, config, write_status,
+            interrupt_event=None):
+        args = (config, write_status, interrupt_event)
         if action_type == "SETFREQ":
-            return SetFreqTunning(config, write_status)
+            return SetFreqTunning(*args)
         elif action_type == "BACKEND":
-            return SetBackend(config, write_status)
+            return SetBackend(*args)
         elif action_type == "TRACK":
-            return TrackAndObserve(config, write_status)
+            return TrackAndObserve(*args)
         elif action_type == "WAITPROMPT":
-            return WaitPrompt(config, write_status)
+            return WaitPrompt(*args)
         elif action_type == "WAITUNTIL":
-            return WaitUntil(config, write_status)
+            return WaitUntil(*args)
         elif action_type == "WAITFOR":
-            return WaitFor(config, write_status)
+            return WaitFor(*args)
         elif action_type == "SETAZEL":
-            return SetAzEl(config, write_status)
+            return SetAzEl(*args)
         elif action_type == "RESERVEANTENNAS":
-            return ReserveAntennas(config, write_status)
+            return ReserveAntennas(*args)
         elif action_type == "RELEASEANTENNAS":
-            return ReleaseAntennas(config, write_status)
+            return ReleaseAntennas(*args)
         else:
             raise RuntimeError(f"No known executor for action: {action_type}")
 
+    # this can be ran in a thread, ahead of execute()
+    def prepare(self):
+        with self._prepare_lock:
+            if self._prepare_done:
+                return
+            self._prepare_done = True
+            try:
+                self.executor.prepare()
+            except Exception as e:
+                # not a problem, execute() will do the work itself
+                self.executor.prepared = {}
+                self.executor.write_status(f"Could not prepare "
+                        f"{self.action_type} ahead of time: {e}", fg='orange')
+
     # this can be ran in a thread
     def execute(self):
-        self.executor.execute()
+        # wait for a prepare() that could still be running, and make sure
+        # none starts after this point
+        with self._prepare_lock:
+            self._prepare_done = True
+
+        t_start = time.time()
+        try:
+            self.executor.execute()
+        finally:
+            self.executor.record_timing("total", time.time() - t_start,
+                    t_start)
+            if self.metrics:
+                self.write_metrics()
+
+    def write_metrics(self):
+        records = []
+        for timing in self.executor.timings:
+            record = dict(self.metrics_tags)
+            record.update({"cmd_type": self.action_type,
+                "config": self.config})
+            record.update(timing)
+            records.append(record)
+        try:
+            self.metrics.write(records)
+        except Exception as e:
+            self.executor.write_status(f"Could not write metrics: {e}",
+                    fg='orange')
 
     # Call to interrupt execution
     def interrupt(self):
-        self.executor.interrupt = True
+        self.executor.request_interrupt()
+
+
+class Lookahead:
+    """
+    Prepares upcoming schedule lines in a background thread while the
+    current line (typically a long TRACK or WAITUNTIL) is running.
+
+    A line is only prepared if none of the lines before it, starting from
+    the current one, touch the state its prepare() depends on.
+    """
+    def __init__(self, schs, depth=LOOKAHEAD_DEPTH):
+        self.schs = schs
+        self.depth = depth
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.submitted = set()
+
+    def prestage(self, idx):
+        """
+        Call before executing line idx
+        """
+        touched = set()
+        for j in range(idx, min(idx + self.depth + 1, len(self.schs))):
+            sch = self.schs[j]
+            if j > idx and j not in self.submitted and \
+                    not (sch.prepare_reads & touched):
+                self.submitted.add(j)
+                self.pool.submit(sch.prepare)
+            touched |= sch.touches
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
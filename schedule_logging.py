@@ -0,0 +1,267 @@
+"""
+Logging of the scheduler status messages.
+
+Status messages come with a color (see write_status), which also says
+how bad things are.
+
+Logging never waits for a file or the console: every record is put on a
+queue, and a single thread (see start_logging) writes it to the console
+and, as a JSON line, to a rotating log file. The queue is a
+multiprocessing one, so records of the execution process forked from
+the GUI end up in the same file.
+
+Next to every log file there is a small index (see IndexedFileHandler),
+so the log window can page older status messages back in from the file
+without reading all of it.
+"""
+import os
+import json
+import logging
+import datetime
+import multiprocessing
+import logging.handlers
+from datetime import timezone
+
+LOGGING_INFO_COLOR = ["green"]
+LOGGING_WARNING_COLOR = ["orange", "dark orange"]
+LOGGING_ERROR_COLOR = ["red", "dark red"]
+
+LOGGER_NAME = "ATAObsSchedulerLogger"
+
+LOG_FNAME = "./app.jsonl"
+# rotate the log file when it gets this big [bytes], and keep this many
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 10
+
+# records per index entry
+LOG_INDEX_BLOCK = 1000
+
+# format of the console
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def status_level(fg):
+    """
+    Logging level of a status message of color fg
+    """
+    if fg.lower() in LOGGING_ERROR_COLOR:
+        return logging.ERROR
+    if fg.lower() in LOGGING_WARNING_COLOR:
+        return logging.WARNING
+    return logging.INFO
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time (UTC), level, logger, process,
+    thread, message and, for status messages, their color
+    """
+    def format(self, record):
+        entry = {"time": datetime.datetime.fromtimestamp(record.created,
+                    timezone.utc).isoformat(),
+                "level": record.levelname,
+                "logger": record.name,
+                "process": record.processName,
+                "thread": record.threadName,
+                "message": record.getMessage()}
+        if hasattr(record, "color"):
+            entry["color"] = record.color
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def index_fname(fname):
+    return fname + ".idx"
+
+
+def entry_time(entry):
+    """
+    Time of a record of the log file, as a timestamp
+    """
+    return datetime.datetime.fromisoformat(entry["time"]).timestamp()
+
+
+def new_block(offset):
+    return {"n": 0, "start": offset, "end": offset, "t_first": None,
+            "t_last": None, "levels": {}}
+
+
+def add_to_block(block, t, color, end):
+    block["n"] += 1
+    block["end"] = end
+    if block["t_first"] is None:
+        block["t_first"] = t
+    block["t_last"] = t
+    # only status messages are counted, they are what the log window shows
+    if color is not None:
+        level = str(status_level(color))
+        block["levels"][level] = block["levels"].get(level, 0) + 1
+
+
+def index_file(fname, offset=0):
+    """
+    Index blocks of the records of log file fname, from offset on
+    """
+    blocks = []
+    try:
+        with open(fname, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                start, offset = offset, offset + len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # cut short, or being written right now
+                    continue
+                if not blocks or blocks[-1]["n"] >= LOG_INDEX_BLOCK:
+                    blocks.append(new_block(start))
+                add_to_block(blocks[-1], entry_time(entry),
+                        entry.get("color"), offset)
+    except OSError:
+        pass
+    return blocks
+
+
+def load_index(fname):
+    """
+    Index blocks in the index file of log file fname
+    """
+    blocks = []
+    try:
+        with open(index_fname(fname), "r") as f:
+            for line in f:
+                try:
+                    blocks.append(json.loads(line))
+                except ValueError:
+                    pass
+    except OSError:
+        pass
+    return blocks
+
+
+def read_index(fname):
+    """
+    Index blocks of log file fname: the ones in its index file, and the
+    records written after the last of them
+
+    Returns:
+    - list: dicts of start and end in the file, n records, t_first and
+      t_last, and levels, the number of status messages of each level
+    """
+    blocks = load_index(fname)
+    return blocks + index_file(fname, blocks[-1]["end"] if blocks else 0)
+
+
+class IndexedFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that also writes the index of every log file: one
+    line for every block of LOG_INDEX_BLOCK records. The index files are
+    rotated along with their log files
+    """
+    def __init__(self, fname, **kwargs):
+        super().__init__(fname, **kwargs)
+        self.block = None
+
+        # records after the last full block were never indexed, the last
+        # session may have been cut short. I index them now, so new
+        # blocks carry on from there
+        blocks = load_index(self.baseFilename)
+        blocks = index_file(self.baseFilename,
+                blocks[-1]["end"] if blocks else 0)
+        if blocks:
+            with open(index_fname(self.baseFilename), "a") as f:
+                for block in blocks:
+                    f.write(json.dumps(block) + "\n")
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            start = self.stream.tell()
+            logging.FileHandler.emit(self, record)
+            if self.block is None:
+                self.block = new_block(start)
+            add_to_block(self.block, record.created,
+                    getattr(record, "color", None), self.stream.tell())
+            if self.block["n"] >= LOG_INDEX_BLOCK:
+                self.close_block()
+        except Exception:
+            self.handleError(record)
+
+    def close_block(self):
+        if self.block is None:
+            return
+        with open(index_fname(self.baseFilename), "a") as f:
+            f.write(json.dumps(self.block) + "\n")
+        self.block = None
+
+    def doRollover(self):
+        self.close_block()
+        super().doRollover()
+        if self.backupCount <= 0:
+            return
+
+        # the same renames as the log files, an index without its log
+        # file would point into the wrong one
+        for i in range(self.backupCount, 0, -1):
+            src = index_fname(self.baseFilename if i == 1
+                    else f"{self.baseFilename}.{i - 1}")
+            dst = index_fname(f"{self.baseFilename}.{i}")
+            if os.path.exists(src):
+                os.replace(src, dst)
+            elif os.path.exists(dst):
+                os.remove(dst)
+
+    def close(self):
+        with self.lock:
+            self.close_block()
+        super().close()
+
+
+def start_logging(fname=LOG_FNAME, level=logging.INFO, console=True):
+    """
+    Sends all logging through a queue to a thread that writes the records
+
+    Parameters:
+    - fname (str): JSON lines log file, rotated every LOG_MAX_BYTES,
+      with its index
+    - level (int): minimum level that is logged
+    - console (bool): also print records to stderr
+
+    Returns:
+    - logging.handlers.QueueListener: stop() it before exiting, to write
+      what is still queued
+    """
+    file_handler = IndexedFileHandler(fname,
+            maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(console_handler)
+
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    return listener
+
+
+def log_status(logger):
+    """
+    write_status() that sends everything to the logger, with the level
+    given by the color
+    """
+    def write_status(text, fg='green'):
+        logger.log(status_level(fg), text, extra={"color": fg})
+    return write_status
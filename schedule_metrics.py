@@ -0,0 +1,290 @@
+"""
+Timing metrics for schedule execution.
+
+Every executed schedule line appends one JSON line per timed phase to a
+metrics file, along with the plan that was predicted when the schedule
+started. These can be summarised, compared and used to recalibrate the
+overheads of the observation plan with:
+
+    python schedule_metrics.py [metrics.jsonl]
+    python schedule_metrics.py -r -s <schedule_id>
+    python schedule_metrics.py -c
+"""
+import sys
+import json
+import math
+import threading
+import argparse
+import datetime
+
+METRICS_FNAME = "./metrics.jsonl"
+CALIBRATION_FNAME = "./overheads.json"
+
+# commands whose whole duration is overhead in the observation plan
+OVERHEAD_COMMANDS = ["SETFREQ", "BACKEND"]
+
+# don't calibrate from fewer measurements than this
+CALIBRATION_MIN_SAMPLES = 3
+
+
+class MetricsSink:
+    """
+    Append-only JSONL file of timing records. Safe to use from several
+    threads
+    """
+    def __init__(self, fname=METRICS_FNAME):
+        self.fname = fname
+        self.lock = threading.Lock()
+
+    def write(self, records):
+        lines = "".join(json.dumps(record, default=str) + "\n"
+                for record in records)
+        with self.lock:
+            with open(self.fname, "a") as f:
+                f.write(lines)
+
+
+def plan_records(schedule_id, cmds_cfgs, obs):
+    """
+    Records of what the ObsPlan predicts for each TRACK line, to be
+    compared to what actually happened. Blocks are added to the plan in
+    the same order as the TRACK lines
+    """
+    track_lines = [line for line, (cmd_type, config) in enumerate(cmds_cfgs)
+            if cmd_type == "TRACK"]
+
+    records = []
+    for line, obs_entry in zip(track_lines, obs.obs_plan):
+        records.append({"schedule_id": schedule_id, "line": line,
+            "cmd_type": "TRACK", "kind": "plan",
+            "predicted_start": obs_entry['start_time'].unix,
+            "predicted_end": obs_entry['end_time'].unix})
+    return records
+
+
+def read_metrics(fname=METRICS_FNAME):
+    records = []
+    with open(fname, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a list of values
+    """
+    values = sorted(values)
+    rank = max(1, math.ceil(p / 100. * len(values)))
+    return values[rank - 1]
+
+
+def summarize(records):
+    """
+    Aggregates the durations per command type and phase
+
+    Returns:
+    - dict: {(cmd_type, phase): {"n", "p50", "p90", "p99", "max"}}
+    """
+    durations = {}
+    for record in records:
+        if record.get('kind') == "plan":
+            continue
+        key = (record['cmd_type'], record['phase'])
+        durations.setdefault(key, []).append(record['duration'])
+
+    summary = {}
+    for key, values in durations.items():
+        summary[key] = {"n": len(values),
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "max": max(values)}
+    return summary
+
+
+def plan_vs_actual(records, schedule_id):
+    """
+    Compares the predicted and the actual start of every recording of
+    a schedule
+
+    Returns:
+    - list of dict: line, predicted_start, actual_start, slip [s]
+    """
+    records = [r for r in records if r['schedule_id'] == schedule_id]
+
+    predicted = {r['line']: r['predicted_start'] for r in records
+            if r.get('kind') == "plan"}
+    actual = {r['line']: r['record_start'] for r in records
+            if r.get('phase') == "record_in"}
+
+    report = []
+    for line in sorted(predicted):
+        entry = {"line": line, "predicted_start": predicted[line],
+                "actual_start": actual.get(line), "slip": None}
+        if entry['actual_start'] is not None:
+            entry['slip'] = entry['actual_start'] - entry['predicted_start']
+        report.append(entry)
+    return report
+
+
+def fit_slew(samples):
+    """
+    Least-squares fit of slew_time = offset + distance / rate
+
+    Parameters:
+    - samples (list): [(distance [deg], slew time [s])]
+
+    Returns:
+    - dict: rate [deg/s], offset [s] and n, or None if it can't be fitted
+    """
+    n = len(samples)
+    if n < CALIBRATION_MIN_SAMPLES:
+        return None
+
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    sxx = sum((x - mean_x)**2 for x, _ in samples)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in samples)
+
+    if sxx == 0 or sxy <= 0:
+        return None
+
+    slope = sxy / sxx
+    return {"rate": 1. / slope, "offset": mean_y - slope * mean_x, "n": n}
+
+
+def fit_overheads(records):
+    """
+    Works out the overhead of each command type from the recorded history
+
+    Returns:
+    - dict: {"SETFREQ": {...}, "BACKEND": {...}, "TRACK": {...},
+      "slew": {...}}, where each command has the n, median and p90 of its
+      overhead in seconds. TRACK overhead excludes the slew, the
+      recording itself and the wait for StartUTC in fixed-clock mode
+    """
+    overheads = {}
+    track = {}
+    for record in records:
+        if record.get('kind') == "plan":
+            continue
+        cmd_type, phase = record['cmd_type'], record['phase']
+
+        if cmd_type in OVERHEAD_COMMANDS and phase == "total":
+            overheads.setdefault(cmd_type, []).append(record['duration'])
+        elif cmd_type == "TRACK":
+            key = (record['schedule_id'], record['line'])
+            track.setdefault(key, {})[phase] = record
+
+    slew_samples = []
+    for phases in track.values():
+        if "total" not in phases or "record_in" not in phases:
+            continue
+
+        # anything between the start of the line and the recording start,
+        # minus the slew itself and, in fixed-clock mode, the wait for the
+        # planned start
+        t_line_start = phases["total"]['t_start']
+        lead_time = phases["record_in"]['record_start'] - t_line_start
+        slew_time = sum(phases[phase]['duration']
+                for phase in ("track", "on_source") if phase in phases)
+        fixed_clock_wait = phases["record_in"].get('fixed_clock_wait', 0)
+        overheads.setdefault("TRACK", []).append(lead_time - slew_time
+                - fixed_clock_wait)
+
+        slew_deg = phases.get("track", {}).get("slew_deg")
+        if slew_deg is not None:
+            slew_samples.append((slew_deg, slew_time))
+
+    calibration = {}
+    for cmd_type, values in overheads.items():
+        if len(values) < CALIBRATION_MIN_SAMPLES:
+            continue
+        calibration[cmd_type] = {"n": len(values),
+                "median": percentile(values, 50),
+                "p90": percentile(values, 90)}
+
+    slew = fit_slew(slew_samples)
+    if slew:
+        calibration["slew"] = slew
+
+    return calibration
+
+
+def save_calibration(calibration, fname=CALIBRATION_FNAME):
+    with open(fname, "w") as f:
+        json.dump(calibration, f, indent=4)
+
+
+def load_calibration(fname=CALIBRATION_FNAME):
+    """
+    Returns the calibrated overheads, or an empty dict if there are none
+    """
+    try:
+        with open(fname, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def print_summary(records):
+    summary = summarize(records)
+
+    print(f"{'command':<16}{'phase':<24}{'n':>6}"
+            f"{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for (cmd_type, phase), stats in sorted(summary.items()):
+        print(f"{cmd_type:<16}{phase:<24}{stats['n']:>6}"
+                f"{stats['p50']:>10.2f}{stats['p90']:>10.2f}"
+                f"{stats['p99']:>10.2f}{stats['max']:>10.2f}")
+
+
+def print_plan_vs_actual(records, schedule_id):
+    print(f"{'line':>6}{'predicted start':>28}{'actual start':>28}{'slip':>10}")
+    for entry in plan_vs_actual(records, schedule_id):
+        predicted = datetime.datetime.fromtimestamp(entry['predicted_start'],
+                datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        if entry['actual_start'] is None:
+            print(f"{entry['line']:>6}{predicted:>28}{'-':>28}{'-':>10}")
+            continue
+        actual = datetime.datetime.fromtimestamp(entry['actual_start'],
+                datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{entry['line']:>6}{predicted:>28}{actual:>28}"
+                f"{entry['slip']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Summarise schedule execution timings')
+    parser.add_argument('fname', nargs='?', default=METRICS_FNAME,
+            help='metrics file (default: %(default)s)')
+    parser.add_argument('-s', '--schedule-id',
+            help='only use the records of this schedule')
+    parser.add_argument('-r', '--report', action='store_true',
+            help='compare predicted and actual recording starts of the '
+            'schedule given with -s')
+    parser.add_argument('-c', '--calibrate', action='store_true',
+            help='fit the command overheads and slew rate, and save them '
+            'to %s' %CALIBRATION_FNAME)
+    args = parser.parse_args()
+
+    records = read_metrics(args.fname)
+    if args.schedule_id:
+        records = [r for r in records if r['schedule_id'] == args.schedule_id]
+
+    if args.report:
+        if not args.schedule_id:
+            parser.error("--report needs a --schedule-id")
+        print_plan_vs_actual(records, args.schedule_id)
+    elif args.calibrate:
+        calibration = fit_overheads(records)
+        save_calibration(calibration)
+        print(json.dumps(calibration, indent=4))
+    else:
+        print_summary(records)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+In-memory model of a schedule.
+
+Every schedule line is a small record of its command type, built and
+validated once when the line is added or loaded. The listbox of the GUI
+only displays the lines, so saving, checking and executing a schedule
+don't have to parse its text back.
+"""
+import datetime
+
+WAIT_DTFMT = "%Y-%m-%dT%Hh%Mm%Ss%z"
+
+# width of the command type column in the listbox
+CMD_TYPE_WIDTH = 12
+
+
+def hashpipe_targets_to_list(hp_targets):
+    hp_list = []
+    for key in hp_targets.keys():
+        hp_list += [key + "." + str(i) for i in hp_targets[key]]
+    return hp_list
+
+def list_to_hashpipe_targets(hp_list):
+    hp_targets = {}
+    for i in hp_list:
+        seti_node, instance = i.split(".")
+        if seti_node in hp_targets.keys():
+            hp_targets[seti_node].append(int(instance))
+        else:
+            hp_targets[seti_node] = [int(instance)]
+
+    return hp_targets
+
+
+def is_positive_number(s):
+    try:
+        return float(s) >= 0
+    except (TypeError, ValueError):
+        return False
+
+
+class ScheduleLine:
+    """
+    A line of the schedule. Subclasses list the (attribute, config key) of
+    their fields, in display order. Keys that are not fields (e.g.
+    "StartUTC" or "RA_OFF1" added by hand to a schedule file) are kept in
+    extra. All values are kept as strings, as they were when lines were
+    parsed from the listbox, whatever JSON type the schedule file has
+
+    Raises:
+    - ValueError: if a field is missing or invalid
+    """
+    __slots__ = ("extra",)
+    cmd_type = None
+    fields = ()
+    # what the executor needs on top of the line: ant_list, hp_targets
+    supplement = ()
+
+    def __init__(self, *values, extra=None):
+        if len(values) != len(self.fields):
+            raise ValueError(f"{self.cmd_type} needs "
+                    f"{', '.join(key for _, key in self.fields)}")
+        for (attr, _), value in zip(self.fields, values):
+            setattr(self, attr, str(value))
+        # I leave lists alone, if somebody put one in the file by hand
+        self.extra = {key: str(value) if isinstance(value, (int, float))
+                else value for key, value in (extra or {}).items()}
+        self.validate()
+
+    def validate(self):
+        pass
+
+    @classmethod
+    def from_config(cls, config):
+        config = dict(config)
+        try:
+            values = [config.pop(key) for _, key in cls.fields]
+        except KeyError as e:
+            raise ValueError(f"{cls.cmd_type} line is missing {e.args[0]}")
+        return cls(*values, extra=config)
+
+    def to_config(self):
+        config = {key: getattr(self, attr) for attr, key in self.fields}
+        config.update(self.extra)
+        return config
+
+    def to_entry(self):
+        """
+        Text of the line in the listbox
+        """
+        cfg_str = ", ".join(f"{key}: {val}"
+                for key, val in self.to_config().items())
+        return self.cmd_type.ljust(CMD_TYPE_WIDTH) + "-- " + cfg_str
+
+    def key(self):
+        return (self.cmd_type, tuple(self.to_config().items()))
+
+    def __eq__(self, other):
+        return isinstance(other, ScheduleLine) and self.key() == other.key()
+
+    def __repr__(self):
+        return f"<{self.to_entry()}>"
+
+
+class Backend(ScheduleLine):
+    __slots__ = ("project_id", "backend", "postprocessor")
+    cmd_type = "BACKEND"
+    fields = (("project_id", "ProjectID"), ("backend", "Backend"),
+            ("postprocessor", "Postprocessor"))
+    supplement = ("hp_targets",)
+
+
+class Digitizer(ScheduleLine):
+    __slots__ = ("mode",)
+    cmd_type = "DIGITIZER"
+    fields = (("mode", "Mode"),)
+
+
+class SetFreq(ScheduleLine):
+    __slots__ = ("tuning_a", "tuning_b", "rf_gain", "if_gain", "eq_level",
+            "focus")
+    cmd_type = "SETFREQ"
+    fields = (("tuning_a", "TuningA"), ("tuning_b", "TuningB"),
+            ("rf_gain", "RFgain"), ("if_gain", "IFgain"),
+            ("eq_level", "EQlevel"), ("focus", "Focus"))
+    supplement = ("ant_list",)
+
+
+class Track(ScheduleLine):
+    __slots__ = ("source", "obs_time")
+    cmd_type = "TRACK"
+    fields = (("source", "Source"), ("obs_time", "ObsTime"))
+    supplement = ("ant_list", "hp_targets")
+
+    def validate(self):
+        if not self.source:
+            raise ValueError("TRACK needs a source")
+        if not is_positive_number(self.obs_time):
+            raise ValueError(f"ObsTime of {self.source} is not a positive "
+                    f"number: {self.obs_time}")
+
+
+class SetAzEl(ScheduleLine):
+    __slots__ = ("az", "el")
+    cmd_type = "SETAZEL"
+    fields = (("az", "Az"), ("el", "El"))
+    supplement = ("ant_list",)
+
+    def validate(self):
+        try:
+            float(self.az), float(self.el)
+        except (TypeError, ValueError):
+            raise ValueError(f"SETAZEL needs numbers, got Az: {self.az}, "
+                    f"El: {self.el}")
+
+
+class WaitUntil(ScheduleLine):
+    __slots__ = ("dt",)
+    cmd_type = "WAITUNTIL"
+    fields = (("dt", "dt"),)
+
+    def validate(self):
+        try:
+            datetime.datetime.strptime(self.dt, WAIT_DTFMT)
+        except (TypeError, ValueError):
+            raise ValueError(f"WAITUNTIL time is not in {WAIT_DTFMT} "
+                    f"format: {self.dt}")
+
+
+class WaitPrompt(ScheduleLine):
+    __slots__ = ("method",)
+    cmd_type = "WAITPROMPT"
+    fields = (("method", "Method"),)
+
+
+class WaitFor(ScheduleLine):
+    __slots__ = ("twait",)
+    cmd_type = "WAITFOR"
+    fields = (("twait", "twait"),)
+
+    def validate(self):
+        if not is_positive_number(self.twait):
+            raise ValueError(f"WAITFOR time is not a positive number: "
+                    f"{self.twait}")
+
+
+LINE_TYPES = {cls.cmd_type: cls for cls in (Backend, Digitizer, SetFreq,
+    Track, SetAzEl, WaitUntil, WaitPrompt, WaitFor)}
+
+
+def line_from_config(cmd_type, config):
+    if cmd_type not in LINE_TYPES:
+        raise ValueError(f"Unknown schedule command: {cmd_type}")
+    return LINE_TYPES[cmd_type].from_config(config)
+
+
+class Schedule:
+    """
+    Ordered list of ScheduleLines
+    """
+    def __init__(self, lines=None):
+        self.lines = list(lines) if lines else []
+        self.saved = ()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __getitem__(self, index):
+        return self.lines[index]
+
+    def insert(self, index, line):
+        self.lines.insert(index, line)
+
+    def append(self, line):
+        self.lines.append(line)
+
+    def delete(self, index):
+        del self.lines[index]
+
+    def move(self, index, new_index):
+        self.lines.insert(new_index, self.lines.pop(index))
+
+    def clear(self):
+        self.lines = []
+        self.saved = ()
+
+    def keys(self):
+        return tuple(line.key() for line in self.lines)
+
+    def mark_saved(self):
+        self.saved = self.keys()
+
+    def is_modified(self):
+        return self.keys() != self.saved
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Parameters:
+        - data (dict): content of a schedule file, {"commands":
+          [{cmd_type: config}, ...]}
+
+        Raises:
+        - ValueError: with the number of the line that is not valid
+        """
+        lines = []
+        for idx, cmd in enumerate(data['commands']):
+            cmd_type, config = next(iter(cmd.items()))
+            try:
+                lines.append(line_from_config(cmd_type, config))
+            except ValueError as e:
+                raise ValueError(f"Line {idx}: {e}")
+        schedule = cls(lines)
+        schedule.mark_saved()
+        return schedule
+
+    def to_json(self):
+        return {"commands": [{line.cmd_type: line.to_config()}
+            for line in self.lines]}
+
+    def to_cmds_cfgs(self, ant_list=None, hp_targets=None):
+        """
+        [cmd_type, config] of every line, as the executors take them, with
+        the antennas and recorders added to the lines that need them
+        """
+        supplement = {"ant_list": ant_list, "hp_targets": hp_targets}
+        cmds_cfgs = []
+        for line in self.lines:
+            config = line.to_config()
+            for key in line.supplement:
+                if supplement[key] is not None:
+                    config[key] = supplement[key]
+            cmds_cfgs.append([line.cmd_type, config])
+        return cmds_cfgs
@@ -0,0 +1,446 @@
+"""
+Observation plan of a schedule that is being executed.
+
+The ObsPlan is computed once when the schedule starts. As lines get
+executed, the remaining entries are time-shifted by how late (or early)
+we are compared to the plan, instead of rebuilding the whole ObsPlan
+before every line. Only the lines after a WAITPROMPT, or after a slip
+that is too large to just shift, are computed again.
+
+When checking a schedule, the blocks planned after every line are kept
+around so that after an edit only the lines from the first changed one
+are added to an ObsPlan again, see PlanCache.
+"""
+import json
+import time
+import datetime
+
+from astropy.time import Time, TimeDelta
+
+from ata_obs_plan import ObsPlan #from ATATools.ata_obs_plan import ObsPlan
+
+WAIT_DTFMT = "%Y-%m-%dT%Hh%Mm%Ss%z"
+
+WAIT_FOR_PROMPT_DEFAULT = 600 # assume 10 minutes
+
+# if we are this many seconds off the plan, the slews and source
+# positions could be quite different, so recompute the rest of the plan
+RECOMPUTE_SLIP = 300
+
+
+def new_obs_plan(calibration, t_start=None):
+    """
+    Empty ObsPlan starting at t_start (astropy Time), or now
+    """
+    if t_start is None:
+        t_start = Time(datetime.datetime.now(datetime.timezone.utc))
+
+    # Use the overheads measured in previous schedules where we have
+    # them (see schedule_metrics.py -c), and the ObsPlan defaults
+    # otherwise. The TRACK overhead replaces the one from ObsPlan,
+    # the slew model is still ObsPlan's
+    track_overhead = calibration.get("TRACK", {}).get("median")
+
+    return ObsPlan(t_start, slew_time=True,
+            obs_overhead=track_overhead is None)
+
+
+def add_to_obs_plan(obs, cmd_type, config, calibration, write_status=print):
+    """
+    Adds a single schedule line to the ObsPlan
+    """
+    track_overhead = calibration.get("TRACK", {}).get("median")
+
+    if cmd_type == "SETFREQ":
+        if "SETFREQ" in calibration:
+            obs.add_wait_time(round(calibration["SETFREQ"]["median"]))
+        else:
+            obs.add_rf_if_overhead()
+    elif cmd_type == "BACKEND":
+        if "BACKEND" in calibration:
+            obs.add_wait_time(round(calibration["BACKEND"]["median"]))
+        else:
+            obs.add_backend_overhead()
+    elif cmd_type == "TRACK":
+        if track_overhead is not None:
+            obs.add_wait_time(round(track_overhead))
+        try:
+            obs.add_obs_block(config['Source'], int(config['ObsTime'])) #this need try/except
+        except Exception as e:
+            source = config['Source']
+            write_status(f"adding source {source} failed...", fg='red')
+            write_status(e.args[0], fg='red')
+            raise e
+
+    elif cmd_type == "WAITPROMPT":
+        # I will assume the user will wait for 
+        # WAIT_FOR_PROMPT_DEFAULT
+        obs.add_wait_time(WAIT_FOR_PROMPT_DEFAULT)
+    elif cmd_type == "WAITFOR":
+        obs.add_wait_time(int(config['twait']))
+    elif cmd_type == "WAITUNTIL":
+        dt_until = datetime.datetime.strptime(config['dt'],
+                WAIT_DTFMT)
+        obs.add_wait_until_dt(Time(dt_until))
+
+
+def generate_obs_plan(cmds_cfgs, calibration, write_status=print,
+        cache=None):
+    """
+    ObsPlan of a whole schedule, starting now. With a PlanCache, only the
+    lines that changed since it last planned are added to the ObsPlan
+    """
+    if cache is not None:
+        return cache.get_plan(cmds_cfgs)
+
+    obs = new_obs_plan(calibration)
+    init_position_set = False
+
+    for cmd_type, config in cmds_cfgs:
+        if not init_position_set:
+            if 'ant_list' in config:
+                ant_list = config['ant_list']
+                obs.set_current_position(ant_list)
+                init_position_set = True
+
+        add_to_obs_plan(obs, cmd_type, config, calibration, write_status)
+
+    return obs
+
+
+def obs_plan_to_ods_list(obs):
+    ods_list = []
+
+    for obs_entry in obs.obs_plan:
+        entry = {}
+        entry['src_id'] = obs_entry['object']
+        entry['src_ra_j2000_deg'] = obs_entry['ra'] * 360 / 24.
+        entry['src_dec_j2000_deg'] = obs_entry['dec']
+        entry['src_start_utc'] = obs_entry['start_time'].isot
+        entry['src_end_utc'] = obs_entry['end_time'].isot
+
+        ods_list.append(entry)
+
+    return ods_list
+
+
+class IncrementalPlan:
+    """
+    Parameters:
+    - cmds_cfgs (list): [cmd_type, config] of every schedule line
+    - obs (ObsPlan): plan of the whole schedule
+    - generate_obs_plan (callable): builds an ObsPlan starting now from a
+      list of [cmd_type, config], used to recompute the end of the plan
+    """
+    def __init__(self, cmds_cfgs, obs, generate_obs_plan):
+        self.cmds_cfgs = cmds_cfgs
+        self.generate_obs_plan = generate_obs_plan
+
+        # one entry per TRACK line: line, anchor, object, ra, dec,
+        # start_time, end_time
+        self.entries = []
+
+        # slip in seconds of each segment of the plan. A segment starts
+        # at an anchor (a WAITUNTIL or WAITPROMPT line, or the first line
+        # that was planned) and everything in it moves together
+        self.slips = {}
+
+        self.set_plan(0, obs)
+
+    def set_plan(self, first_line, obs):
+        """
+        Replaces the entries of the lines from first_line onward with the
+        ones of obs, an ObsPlan of cmds_cfgs[first_line:]
+        """
+        track_lines = [line for line in range(first_line, len(self.cmds_cfgs))
+                if self.cmds_cfgs[line][0] == "TRACK"]
+
+        if len(track_lines) != len(obs.obs_plan):
+            raise RuntimeError(f"Plan has {len(obs.obs_plan)} blocks for "
+                    f"{len(track_lines)} TRACK lines")
+
+        entries = []
+        for line, obs_entry in zip(track_lines, obs.obs_plan):
+            entries.append({"line": line,
+                "anchor": self.get_anchor(line, first_line),
+                "object": obs_entry['object'],
+                "ra": obs_entry['ra'],
+                "dec": obs_entry['dec'],
+                "start_time": obs_entry['start_time'],
+                "end_time": obs_entry['end_time']})
+
+        self.entries = [entry for entry in self.entries
+                if entry['line'] < first_line] + entries
+
+        for anchor in list(self.slips):
+            if anchor >= first_line:
+                del self.slips[anchor]
+        for entry in entries:
+            self.slips[entry['anchor']] = 0
+
+    def get_anchor(self, line, first_line):
+        for anchor in range(line - 1, first_line - 1, -1):
+            if self.cmds_cfgs[anchor][0] in ("WAITUNTIL", "WAITPROMPT"):
+                return anchor
+        return first_line
+
+    def recompute(self, first_line):
+        remaining = self.cmds_cfgs[first_line:]
+        self.set_plan(first_line, self.generate_obs_plan(remaining))
+
+    def line_starting(self, idx):
+        """
+        Call before executing line idx. If we are already past the start of
+        the next recording, its segment is late by at least that much
+        """
+        now = time.time()
+        for entry in self.entries:
+            if entry['line'] < idx:
+                continue
+            late = now - self.shifted(entry)[0].unix
+            if late > 0:
+                self.set_slip(entry['anchor'],
+                        self.slips.get(entry['anchor'], 0) + late, idx)
+            break
+
+    def line_done(self, idx, timings):
+        """
+        Call after line idx is done, with the timings of its executor
+        """
+        cmd_type, config = self.cmds_cfgs[idx]
+
+        if cmd_type == "TRACK":
+            # we know exactly when the recording started
+            for timing in timings:
+                if timing['phase'] == "record_in":
+                    entry = self.get_entry(idx)
+                    if entry is not None:
+                        self.set_slip(entry['anchor'],
+                                timing['record_start'] - entry['start_time'].unix,
+                                idx + 1)
+                    break
+
+        elif cmd_type == "WAITUNTIL":
+            # the rest of the plan is pinned to the wait, unless we
+            # only got there after the target time
+            dt_until = datetime.datetime.strptime(config['dt'], WAIT_DTFMT)
+            late = time.time() - dt_until.timestamp()
+            self.set_slip(idx, max(0, late), idx + 1)
+
+        elif cmd_type == "WAITPROMPT":
+            # the plan assumed a default wait, we now know how long it was
+            self.recompute(idx + 1)
+
+    def set_slip(self, anchor, slip, next_line):
+        if anchor not in self.slips:
+            return
+        if abs(slip) > RECOMPUTE_SLIP:
+            self.recompute(next_line)
+        else:
+            self.slips[anchor] = slip
+
+    def get_entry(self, line):
+        for entry in self.entries:
+            if entry['line'] == line:
+                return entry
+        return None
+
+    def shifted(self, entry):
+        slip = TimeDelta(self.slips.get(entry['anchor'], 0), format='sec')
+        return entry['start_time'] + slip, entry['end_time'] + slip
+
+    def ods_list(self, idx):
+        """
+        ODS entries of the recordings from line idx onward
+        """
+        ods_list = []
+        for entry in self.entries:
+            if entry['line'] < idx:
+                continue
+            start_time, end_time = self.shifted(entry)
+            ods_list.append({'src_id': entry['object'],
+                'src_ra_j2000_deg': entry['ra'] * 360 / 24.,
+                'src_dec_j2000_deg': entry['dec'],
+                'src_start_utc': start_time.isot,
+                'src_end_utc': end_time.isot})
+        return ods_list
+
+
+def line_key(cmd_type, config):
+    return cmd_type, json.dumps(config, sort_keys=True, default=str)
+
+
+def blocks_differ(blocks1, blocks2):
+    """
+    Whether two lists of PlanCache blocks differ by more than rounding
+    """
+    if len(blocks1) != len(blocks2):
+        return True
+    for block1, block2 in zip(blocks1, blocks2):
+        for key in block1.keys() | block2.keys():
+            value1, value2 = block1.get(key), block2.get(key)
+            if key in ("start", "end"):
+                if value1 is None or value2 is None or \
+                        abs(value1 - value2) > 1:
+                    return True
+            elif value1 != value2:
+                return True
+    return False
+
+
+class PlanCache:
+    """
+    Plan of a schedule being edited. Instead of the ObsPlan, only what is
+    needed to carry on planning is kept for every line: the blocks planned
+    so far, in seconds from the start of the plan, the end of the last
+    TRACK block and the antennas the plan started from. Every check
+    starts now: the blocks that didn't change are moved to now, and the
+    plan is computed again from the end of the last TRACK block before
+    the first changed line. The lines from a WAITUNTIL onward depend on
+    when the plan starts, so they are always computed again.
+
+    ObsPlan can only be pointed at a source by planning a block on it, so
+    to carry on after a TRACK that TRACK is planned again, ending where
+    it did, and its block is dropped. The blocks after it then slew from
+    its source, as they do when the whole plan is computed.
+
+    Parameters:
+    - new_obs_plan (callable): returns an empty ObsPlan starting at the
+      given astropy Time
+    - add_to_obs_plan (callable): adds (obs, cmd_type, config) to an ObsPlan
+    """
+    def __init__(self, new_obs_plan, add_to_obs_plan):
+        self.new_obs_plan = new_obs_plan
+        self.add_to_obs_plan = add_to_obs_plan
+
+        self.clear()
+
+    def clear(self):
+        # key of every line, and after each line: number of blocks, line
+        # after the last TRACK, end of its block and antennas the plan
+        # started from, see get_plan() and resume_obs_plan()
+        self.keys = []
+        self.checkpoints = []
+        # every block of the plan, with start and end in seconds from the
+        # start of the plan instead of start_time and end_time
+        self.blocks = []
+        # visibility of the plan blocks, see get_visibility()
+        self.visibility = {}
+        # when the last plan starts, unix time
+        self.t_plan = None
+        # number of lines that were reused the last time, and whether the
+        # blocks changed
+        self.n_reused = 0
+        self.changed = True
+
+    def get_plan(self, cmds_cfgs):
+        """
+        ObsPlan of cmds_cfgs starting now, only adding the lines from the
+        last TRACK before the first line that changed since the last call.
+        The returned ObsPlan isn't used by the cache and can be modified
+        """
+        now = time.time()
+        keys = [line_key(cmd_type, config) for cmd_type, config in cmds_cfgs]
+
+        # the plan of a line depends on all the lines before it, so
+        # everything after the first change has to be added again
+        n_same = 0
+        for (cmd_type, _), old_key, new_key in zip(cmds_cfgs, self.keys, keys):
+            if old_key != new_key or cmd_type == "WAITUNTIL":
+                break
+            n_same += 1
+
+        if n_same:
+            checkpoint = self.checkpoints[n_same - 1]
+        else:
+            checkpoint = {"n_blocks": 0, "resume": 0, "t_resume": 0,
+                    "ant_list": None}
+        resume, ant_list = checkpoint["resume"], checkpoint["ant_list"]
+
+        old_blocks = self.blocks
+        self.blocks = self.blocks[:checkpoint["n_blocks"]]
+        del self.keys[resume:]
+        del self.checkpoints[resume:]
+
+        obs = self.resume_obs_plan(cmds_cfgs, checkpoint, now)
+
+        t_resume = checkpoint["t_resume"]
+        for line in range(resume, len(cmds_cfgs)):
+            cmd_type, config = cmds_cfgs[line]
+            if ant_list is None and 'ant_list' in config:
+                ant_list = config['ant_list']
+                obs.set_current_position(ant_list)
+
+            n_obs = len(obs.obs_plan)
+            self.add_to_obs_plan(obs, cmd_type, config)
+            for obs_entry in obs.obs_plan[n_obs:]:
+                block = {key: value for key, value in obs_entry.items()
+                        if key not in ("start_time", "end_time")}
+                block["start"] = obs_entry["start_time"].unix - now
+                block["end"] = obs_entry["end_time"].unix - now
+                self.blocks.append(block)
+
+            if cmd_type == "TRACK":
+                resume, t_resume = line + 1, self.blocks[-1]["end"]
+
+            self.keys.append(keys[line])
+            self.checkpoints.append({"n_blocks": len(self.blocks),
+                "resume": resume, "t_resume": t_resume,
+                "ant_list": ant_list})
+
+        # the blocks that weren't computed again, moved to now
+        obs.obs_plan[:0] = [self.get_obs_entry(block, now)
+                for block in self.blocks[:checkpoint["n_blocks"]]]
+
+        self.n_reused = checkpoint["resume"]
+        self.changed = blocks_differ(self.blocks, old_blocks)
+        self.t_plan = now
+        return obs
+
+    def resume_obs_plan(self, cmds_cfgs, checkpoint, now):
+        """
+        Empty ObsPlan at the end of the last TRACK of checkpoint, pointing
+        at its source
+        """
+        t_resume = now + checkpoint["t_resume"]
+        if not checkpoint["resume"]:
+            obs = self.new_obs_plan(Time(t_resume, format='unix'))
+            if checkpoint["ant_list"] is not None:
+                obs.set_current_position(checkpoint["ant_list"])
+            return obs
+
+        # Plan the TRACK on its own once to see how long it takes, and
+        # again so that it ends at t_resume. Without a current position
+        # there is no slew, so it takes the same time both times
+        cmd_type, config = cmds_cfgs[checkpoint["resume"] - 1]
+        probe = self.new_obs_plan(Time(t_resume, format='unix'))
+        self.add_to_obs_plan(probe, cmd_type, config)
+        duration = probe.obs_plan[-1]["end_time"].unix - t_resume
+
+        obs = self.new_obs_plan(Time(t_resume - duration, format='unix'))
+        self.add_to_obs_plan(obs, cmd_type, config)
+        del obs.obs_plan[:]
+        return obs
+
+    def get_visibility(self, obs):
+        """
+        compute_visibility() of the ObsPlan of the last get_plan(). What
+        was computed for the same block of a plan starting within the
+        same GRID_STEP is reused, and blocks no longer in the plan are
+        dropped from the cache
+        """
+        from schedule_visibility import compute_visibility, GRID_STEP
+
+        epoch = round(self.t_plan / GRID_STEP)
+        keys = [(epoch, block["object"], block["ra"], block["dec"],
+            round(block["start"]), round(block["end"]))
+            for block in self.blocks]
+        return compute_visibility(obs.obs_plan, cache=self.visibility,
+                keys=keys)
+
+    def get_obs_entry(self, block, t_start):
+        obs_entry = {key: value for key, value in block.items()
+                if key not in ("start", "end")}
+        obs_entry["start_time"] = Time(t_start + block["start"], format='unix')
+        obs_entry["end_time"] = Time(t_start + block["end"], format='unix')
+        return obs_entry
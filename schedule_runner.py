@@ -0,0 +1,502 @@
+"""
+Runs a schedule, without any GUI.
+
+This is what the scheduler GUI runs in its execution process, and it
+can also be run on its own, e.g. from cron or a remote shell:
+
+    python schedule_runner.py my_schedule.sch -a 1a 1c 2h -r seti-node1.0
+
+Nothing here imports tkinter, so no display is needed unless the
+schedule has a WAITPROMPT line.
+
+The exit status is 0 when the schedule finished, EXIT_ABORTED when it was
+interrupted and EXIT_FAILED when it could not be run or a line failed.
+"""
+import os
+import sys
+import json
+import signal
+import logging
+import argparse
+import datetime
+import threading
+from datetime import timezone
+
+from schedule_executor import ScheduleExecutor, Lookahead
+from schedule_metrics import MetricsSink, plan_records, load_calibration
+from schedule_plan import IncrementalPlan, generate_obs_plan, \
+        obs_plan_to_ods_list
+from schedule_model import Schedule, list_to_hashpipe_targets
+from schedule_logging import LOGGER_NAME, start_logging, log_status
+from ods_writer import ODSWriter, ODS_DEFAULTS, ODS_WRITE
+from status_stream import StatusPublisher, STATUS_SOCKET_FNAME
+
+# exit status of a schedule that failed, and of one that was interrupted
+# (128 + SIGINT, like the shell gives)
+EXIT_FAILED = 1
+EXIT_ABORTED = 130
+
+
+def set_track_start_times(cmds_cfgs, obs):
+    """
+    Sets the "StartUTC" of every TRACK line to the start time of its block
+    in the ObsPlan. Blocks are added to the plan in the same order as the
+    TRACK lines
+    """
+    tracks = [config for cmd_type, config in cmds_cfgs if cmd_type == "TRACK"]
+    if len(tracks) != len(obs.obs_plan):
+        raise RuntimeError(f"Plan has {len(obs.obs_plan)} blocks for "
+                f"{len(tracks)} TRACK lines")
+
+    for config, obs_entry in zip(tracks, obs.obs_plan):
+        config['StartUTC'] = obs_entry['start_time'].isot
+
+
+def watch_abort_pipe(recv_conn, interrupt_event):
+    """
+    Blocks until something comes through the abort pipe, then sets the
+    interrupt event shared by the schedule executors
+    """
+    try:
+        recv_conn.recv()
+    except (EOFError, OSError):
+        # pipe closed, nobody can abort anymore
+        return
+    interrupt_event.set()
+
+
+class ExceptionThread(threading.Thread):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exception = None
+
+    def run(self):
+        try:
+            if self._target:
+                self._target(*self._args, **self._kwargs)
+        except Exception as e:
+            self.exception = e
+
+
+class ODSPlan:
+    """
+    Keeps the ODS file up to date with the plan of a running schedule.
+
+    The plan is either given (fixed-clock mode needs it before starting)
+    or computed in a background thread, so the first line doesn't wait
+    for it. The ODS is written as soon as there is a plan, and updated
+    before every line
+
+    Parameters:
+    - cmds_cfgs (list): [cmd_type, config] of every line
+    - obs_plan (callable): builds an ObsPlan starting now from a list of
+      [cmd_type, config]
+    - ods_writer (ODSWriter): where the ODS entries go
+    - on_plan (callable): called with the ObsPlan of the whole schedule
+    - write_status (callable): write_status(text, fg=color)
+    """
+    def __init__(self, cmds_cfgs, obs_plan, ods_writer, on_plan,
+            write_status=print):
+        self.cmds_cfgs = cmds_cfgs
+        self.obs_plan = obs_plan
+        self.ods_writer = ods_writer
+        self.on_plan = on_plan
+        self.write_status = write_status
+
+        self.lock = threading.Lock()
+        self.plan = None
+        # no plan could be made, recompute one for every line
+        self.failed = False
+        self.idx = 0
+        self.stopped = False
+
+    def start(self, obs=None):
+        if obs is not None:
+            self.set_obs(obs)
+        else:
+            threading.Thread(target=self.compute, daemon=True).start()
+
+    def compute(self):
+        try:
+            obs = self.obs_plan(self.cmds_cfgs)
+        except Exception as e:
+            self.write_status(f"Could not compute the plan, will recompute "
+                    f"it for every line: {e}", fg='orange')
+            with self.lock:
+                self.failed = True
+                self.update()
+            return
+        self.set_obs(obs)
+
+    def set_obs(self, obs):
+        self.on_plan(obs)
+        # The plan is only computed once, and then updated as we go
+        # to regenerate the ODS file
+        try:
+            plan = IncrementalPlan(self.cmds_cfgs, obs, self.obs_plan)
+        except Exception as e:
+            self.write_status(f"Could not set up the plan, will "
+                    f"recompute it for every line: {e}", fg='orange')
+            plan = None
+
+        with self.lock:
+            self.plan = plan
+            self.failed = plan is None
+            self.update()
+
+    def line_starting(self, idx):
+        with self.lock:
+            self.idx = idx
+            self.update()
+
+    def line_done(self, idx, timings):
+        with self.lock:
+            if self.plan is not None:
+                try:
+                    self.plan.line_done(idx, timings)
+                except Exception as e:
+                    self.write_status(f"Could not update the plan: {e}",
+                            fg='orange')
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+
+    def update(self):
+        if self.stopped:
+            return
+        try:
+            if self.plan is not None:
+                # also catches up with the lines that ran while the plan
+                # was computed
+                self.plan.line_starting(self.idx)
+                self.ods_writer.submit(self.plan.ods_list(self.idx))
+            elif self.failed:
+                self.ods_writer.submit(obs_plan_to_ods_list(
+                    self.obs_plan(self.cmds_cfgs[self.idx:])))
+            # otherwise the plan is still being computed, the ODS gets
+            # written when it's done
+        except Exception as e:
+            self.write_status(f"Could not update the ODS: {e}",
+                    fg='orange')
+
+
+def execute_schedule(cmds_cfgs, ant_list, write_status=print,
+        interrupt_event=None, fixed_clock=False, calibration=None,
+        line_started=None, notifier=None, status_stream=None,
+        plan_cache=None):
+    """
+    Reserves the antennas, executes every line of the schedule and
+    releases the antennas
+
+    Parameters:
+    - cmds_cfgs (list): [cmd_type, config] of every line, with ant_list
+      and hp_targets already in the configs that need them
+    - ant_list (list): antennas to reserve
+    - write_status (callable): write_status(text, fg=color)
+    - interrupt_event (threading.Event): set it to abort the schedule
+    - fixed_clock (bool): start every TRACK at the time of the plan
+    - calibration (dict): measured overheads, see load_calibration()
+    - line_started (callable): called with the index of every line before
+      it is executed, and with len(cmds_cfgs) when done
+    - notifier (SlackNotifier): to post when the schedule starts, fails,
+      is aborted or finishes
+    - status_stream (StatusPublisher): to publish the progress of every line
+    - plan_cache (PlanCache): plan made when the schedule was checked,
+      only the lines that changed since are added to the ObsPlan again
+
+    Raises:
+    - the exception of the line that failed, once antennas are released
+    """
+    if interrupt_event is None:
+        interrupt_event = threading.Event()
+    if calibration is None:
+        calibration = load_calibration()
+
+    def obs_plan(cmds_cfgs):
+        return generate_obs_plan(cmds_cfgs, calibration, write_status,
+                plan_cache)
+
+    # timings of every schedule line go in the metrics file,
+    # the reserve/release steps are tagged as lines -1 and -2
+    metrics = MetricsSink()
+    schedule_id = datetime.datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+    def notify(emoji, text):
+        if notifier:
+            notifier.send(f"{emoji} Schedule `{schedule_id}` {text}")
+
+    def publish(event_type, **fields):
+        if status_stream:
+            status_stream.publish(event_type, schedule_id=schedule_id,
+                    **fields)
+
+    # Reserve antennas first
+    try:
+        config = {'ant_list': ant_list}
+        cmd_type = "RESERVEANTENNAS"
+        reserve_antennas = ScheduleExecutor(cmd_type, config, write_status)
+        reserve_antennas.set_metrics(metrics, schedule_id, -1)
+        reserve_antennas.execute()
+    except Exception as e:
+        write_status(e.args, fg='red')
+        write_status("Maybe antennas already reserved? Try running 'atareleaseants' command",
+                fg='red')
+        notify(":x:", f"could not reserve antennas: {e}")
+        publish("schedule_failed", error=f"Could not reserve antennas: {e}")
+        raise e
+
+
+    # make sure I can release antennas
+    cmd_type = "RELEASEANTENNAS"
+    release_antennas = ScheduleExecutor(cmd_type, config, write_status)
+    release_antennas.set_metrics(metrics, schedule_id, -2)
+
+    # the ODS file gets written in the background
+    try:
+        ods_writer = ODSWriter(ODS_DEFAULTS, ODS_WRITE, write_status)
+    except Exception as e:
+        release_antennas.execute()
+        write_status(f"Could not start the ODS writer: {e}", fg='red')
+        publish("schedule_failed", error=f"Could not start the ODS "
+                f"writer: {e}")
+        raise e
+
+    def record_plan(obs):
+        # Save what the plan predicts now, to compare it with what
+        # actually happens
+        try:
+            metrics.write(plan_records(schedule_id, cmds_cfgs, obs))
+        except Exception as e:
+            write_status(f"Could not record the predicted plan: {e}",
+                    fg='orange')
+
+    ods_plan = ODSPlan(cmds_cfgs, obs_plan, ods_writer, record_plan,
+            write_status)
+
+    obs = None
+    if fixed_clock:
+        # Pin every TRACK to the start time predicted by the plan, so
+        # that latency from earlier lines doesn't accumulate
+        try:
+            obs = obs_plan(cmds_cfgs)
+            set_track_start_times(cmds_cfgs, obs)
+        except Exception as e:
+            ods_writer.close()
+            release_antennas.execute()
+            write_status("Could not generate the plan for fixed-clock "
+                    "execution", fg='red')
+            notify(":x:", f"has no plan for fixed-clock execution: {e}")
+            publish("schedule_failed", error=f"No plan for fixed-clock "
+                    f"execution: {e}")
+            raise e
+        write_status("Executing in fixed-clock mode")
+
+    # I will initialize all sch lines to make sure
+    # all of them are compliant. They all share the same interrupt
+    # event, so waiting executors wake up as soon as it is set
+    schs = []
+    for cmd_cfg in cmds_cfgs:
+        cmd_type, config = cmd_cfg
+        try:
+            sch = ScheduleExecutor(cmd_type, config, write_status,
+                    interrupt_event)
+        except Exception as e:
+            err_txt = f"Initializing schedule line {cmd_type} with "\
+                    f"config: {config} failed with exception:"
+            ods_writer.close()
+            release_antennas.execute()
+            write_status(err_txt, fg='red')
+            write_status(e.args[0], fg='red')
+            notify(":x:", f"line {len(schs)} ({cmd_type}) is not valid: {e}")
+            publish("schedule_failed", line=len(schs), cmd_type=cmd_type,
+                    error=str(e))
+            raise e
+        sch.set_metrics(metrics, schedule_id, len(schs))
+        schs.append(sch)
+
+    lookahead = Lookahead(schs)
+
+    # without fixed-clock, the plan is only for the ODS and the metrics,
+    # so the first lines don't wait for it
+    ods_plan.start(obs)
+
+    notify(":arrow_forward:", f"started: {len(cmds_cfgs)} lines on "
+            f"{len(ant_list)} antennas")
+    publish("schedule_started", n_lines=len(cmds_cfgs), ant_list=ant_list,
+            fixed_clock=fixed_clock)
+
+    # Let's start executing the schedule
+    for idx in range(len(cmds_cfgs)):
+        # I'll keep regenerate the ODS file
+        ods_plan.line_starting(idx)
+
+        if interrupt_event.is_set():
+            # User requested interrupt
+            # Should be fine to return here because nothing is
+            # being executed
+            lookahead.shutdown()
+            ods_plan.stop()
+            ods_writer.close()
+            release_antennas.execute()
+            notify(":octagonal_sign:", f"aborted before line {idx}")
+            publish("schedule_aborted", line=idx)
+            return
+
+        # current schedule line
+        sch      = schs[idx]
+        cmd_type = sch.action_type
+        config   = sch.config
+
+        write_status(text=cmd_type)
+        write_status(text=config)
+        if line_started:
+            line_started(idx)
+        publish("line_started", line=idx, cmd_type=cmd_type,
+                source=config.get("Source"), config=config)
+
+        # prepare what can be done for the next lines while this one runs
+        lookahead.prestage(idx)
+
+        # now let's execute the schedule line in a thread
+        task_thread = ExceptionThread(target=sch.execute)
+        task_thread.start()
+        # the executor gets the interrupt through interrupt_event,
+        # so just wait for it to finish
+        task_thread.join()
+
+        if task_thread.exception:
+            lookahead.shutdown()
+            ods_plan.stop()
+            ods_writer.close()
+            release_antennas.execute()
+            write_status(task_thread.exception.args[0], fg='red')
+            notify(":x:", f"failed at line {idx} ({cmd_type}): "
+                    f"{task_thread.exception}")
+            publish("line_failed", line=idx, cmd_type=cmd_type,
+                    error=str(task_thread.exception),
+                    timings=sch.executor.timings)
+            publish("schedule_failed", line=idx, cmd_type=cmd_type,
+                    error=str(task_thread.exception))
+            raise task_thread.exception
+
+        timings = sch.executor.timings
+        publish("line_finished", line=idx, cmd_type=cmd_type,
+                source=config.get("Source"),
+                duration=next((timing["duration"] for timing in timings
+                    if timing["phase"] == "total"), None),
+                timings=timings)
+
+        ods_plan.line_done(idx, timings)
+
+    if line_started:
+        line_started(len(cmds_cfgs))
+    lookahead.shutdown()
+    ods_plan.stop()
+    ods_writer.close()
+    release_antennas.execute()
+    write_status("Finished Schedule!")
+    notify(":white_check_mark:", "finished")
+    publish("schedule_finished", n_lines=len(cmds_cfgs))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Run an ATA schedule file without the GUI')
+    parser.add_argument('fname', help='schedule file (.sch)')
+    parser.add_argument('-a', '--antennas', nargs='+', required=True,
+            help='antennas to use, e.g. 1a 1c 2h')
+    parser.add_argument('-r', '--recorders', nargs='+', default=[],
+            help='recorders to use, as node.instance, e.g. seti-node1.0')
+    parser.add_argument('-f', '--fixed-clock',
+            help='Start every TRACK at the time predicted by the plan, '
+            'instead of as soon as the previous line is done',
+            action='store_true')
+    parser.add_argument('-s', '--slack',
+            help='Post to slack (ATATOKEN and ATACHANNEL) when the schedule '
+            'starts, fails, is aborted or finishes',
+            action='store_true')
+    parser.add_argument('-p', '--publish', nargs='?',
+            const=STATUS_SOCKET_FNAME, metavar='SOCKET',
+            help='Publish the progress on a Unix socket (default: '
+            f'{STATUS_SOCKET_FNAME}), follow it with status_stream.py')
+    args = parser.parse_args()
+
+    log_listener = start_logging()
+    try:
+        return run(args, log_status(logging.getLogger(LOGGER_NAME)))
+    finally:
+        # write what is still queued
+        log_listener.stop()
+
+
+def run(args, write_status):
+    try:
+        with open(args.fname, 'r') as json_file:
+            data = json.load(json_file)
+        schedule = Schedule.from_json(data)
+    except (OSError, ValueError) as e:
+        write_status(f"Could not open {args.fname}: {e}", fg='red')
+        return EXIT_FAILED
+
+    hp_targets = list_to_hashpipe_targets(args.recorders)
+    cmds_cfgs = schedule.to_cmds_cfgs(args.antennas, hp_targets)
+
+    # without a terminal, nobody can answer a WAITPROMPT
+    has_prompt = any(cmd_type == "WAITPROMPT" for cmd_type, _ in cmds_cfgs)
+    if has_prompt and not os.environ.get("DISPLAY") and not sys.stdin.isatty():
+        write_status("Schedule has a WAITPROMPT, but there is no display "
+                "or terminal to answer it", fg='red')
+        return EXIT_FAILED
+
+    # first Ctrl-C (or kill) aborts the schedule cleanly, the second one
+    # stops right away
+    interrupt_event = threading.Event()
+    def on_signal(signum, frame):
+        if interrupt_event.is_set():
+            raise KeyboardInterrupt
+        write_status("Interrupt requested!", fg='red')
+        interrupt_event.set()
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    notifier = None
+    if args.slack:
+        from slack_notifier import SlackNotifier
+        notifier = SlackNotifier.from_env(write_status)
+
+    status_stream = None
+    if args.publish:
+        status_stream = StatusPublisher(args.publish, write_status)
+        try:
+            status_stream.start()
+        except OSError as e:
+            write_status(f"Could not publish the progress: {e}", fg='red')
+            return EXIT_FAILED
+
+    write_status(f"Executing {args.fname}")
+    try:
+        execute_schedule(cmds_cfgs, args.antennas, write_status,
+                interrupt_event, args.fixed_clock, notifier=notifier,
+                status_stream=status_stream)
+    except KeyboardInterrupt:
+        # second interrupt, nothing was cleaned up
+        write_status("Stopped right away, the antennas may still be "
+                "reserved", fg='red')
+        return EXIT_ABORTED
+    except Exception as e:
+        # execute_schedule() already said which line failed, this keeps
+        # the traceback in the log
+        logging.getLogger(LOGGER_NAME).error(f"Schedule failed: {e}",
+                exc_info=True)
+        return EXIT_ABORTED if interrupt_event.is_set() else EXIT_FAILED
+    finally:
+        if notifier:
+            notifier.close()
+        if status_stream:
+            status_stream.close()
+    return EXIT_ABORTED if interrupt_event.is_set() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
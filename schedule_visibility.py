@@ -0,0 +1,134 @@
+"""
+Visibility of all the sources of a schedule, computed in one go.
+
+Instead of checking every block on its own, the alt/az of every source
+in the plan is computed on a time grid shared by the whole schedule,
+with a single vectorized coordinate transform, and each TRACK block is
+then looked up in the result.
+"""
+import numpy as np
+
+import astropy.units as u
+from astropy.time import Time
+from astropy.coordinates import SkyCoord, AltAz, EarthLocation
+
+# Allen Telescope Array
+ATA_LOCATION = EarthLocation(lat=40.817431*u.deg, lon=-121.470736*u.deg,
+        height=1019.222*u.m)
+
+# below ELEVATION_LIMIT the antennas can't point, below ELEVATION_WARNING
+# they can but it's getting close. Only used to report the blocks, whether
+# the schedule can be executed is up to the checks of ObsPlotApp
+ELEVATION_LIMIT = 16.8
+ELEVATION_WARNING = 20
+
+# spacing of the time grid [s]
+GRID_STEP = 60
+
+
+def get_time_grid(blocks, step=GRID_STEP):
+    """
+    Regular grid covering all blocks, with the start and end of each block
+    added so that those are evaluated exactly. In unix time
+    """
+    t_first = min(block['start_time'].unix for block in blocks)
+    t_last = max(block['end_time'].unix for block in blocks)
+
+    grid = np.arange(t_first, t_last + step, step)
+    edges = [block['start_time'].unix for block in blocks] + \
+            [block['end_time'].unix for block in blocks]
+    return np.unique(np.concatenate([grid, edges]))
+
+
+def get_intervals(t_grid, mask):
+    """
+    [(start, end)] of the runs where mask is True
+    """
+    intervals = []
+    start = None
+    for t, m in zip(t_grid, mask):
+        if m and start is None:
+            start = t
+        elif not m and start is not None:
+            intervals.append((start, t))
+            start = None
+    if start is not None:
+        intervals.append((start, t_grid[-1]))
+    return intervals
+
+
+def block_key(block):
+    return (block['object'], block['ra'], block['dec'],
+            block['start_time'].unix, block['end_time'].unix)
+
+
+def compute_visibility(blocks, step=GRID_STEP, cache=None, keys=None):
+    """
+    Works out the visibility of every block of a plan
+
+    Parameters:
+    - blocks (list): entries of ObsPlan.obs_plan, i.e. dicts with object,
+      ra [h], dec [deg], start_time and end_time (astropy Time)
+    - cache (dict): results of previous calls. Blocks already in there
+      are not computed again, the new ones are added to it and the ones
+      not in blocks are dropped
+    - keys (list): key in cache of every block, block_key() by default
+
+    Returns:
+    - list of dict, one per block: object, min_el, warnings (intervals
+      below ELEVATION_WARNING during the block) and status ("ok",
+      "warning" or "error")
+    """
+    if cache is not None:
+        if keys is None:
+            keys = [block_key(block) for block in blocks]
+        missing = {}
+        for key, block in zip(keys, blocks):
+            if key not in cache:
+                missing.setdefault(key, block)
+        results = compute_visibility(list(missing.values()), step)
+        cache.update(zip(missing, results))
+        for key in set(cache) - set(keys):
+            del cache[key]
+        return [cache[key] for key in keys]
+
+    if not blocks:
+        return []
+
+    t_grid = get_time_grid(blocks, step)
+
+    # one row per source, shared by the blocks that observe it
+    sources = {}
+    for block in blocks:
+        sources.setdefault(block['object'], (block['ra'], block['dec']))
+    names = list(sources)
+    ra = np.array([sources[name][0] for name in names]) * 15
+    dec = np.array([sources[name][1] for name in names])
+
+    coords = SkyCoord(ra=ra[:, None]*u.deg, dec=dec[:, None]*u.deg)
+    frame = AltAz(obstime=Time(t_grid, format='unix')[None, :],
+            location=ATA_LOCATION)
+    alt = coords.transform_to(frame).alt.deg
+
+    rows = {name: i for i, name in enumerate(names)}
+    report = []
+    for block in blocks:
+        src_alt = alt[rows[block['object']]]
+        t_start, t_end = block['start_time'].unix, block['end_time'].unix
+        in_block = (t_grid >= t_start) & (t_grid <= t_end)
+
+        min_el = float(src_alt[in_block].min())
+        warnings = get_intervals(t_grid[in_block],
+                src_alt[in_block] < ELEVATION_WARNING)
+
+        if min_el < ELEVATION_LIMIT:
+            status = "error"
+        elif warnings:
+            status = "warning"
+        else:
+            status = "ok"
+
+        report.append({"object": block['object'], "min_el": min_el,
+            "warnings": warnings,
+            "status": status})
+    return report
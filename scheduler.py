@@ -5,47 +5,42 @@ from tkinter import filedialog, messagebox, font
 from tkinter.scrolledtext import ScrolledText
 
 from tkcalendar import DateEntry
-from PIL import Image, ImageTk
+#from PIL import Image, ImageTk # only for the logo below
 import json
 import time
 import threading, multiprocessing, traceback
 import queue
+import collections
 import gc
 
 import argparse
 import logging
 
-from schedule_executor import ScheduleExecutor
-from ata_obs_plan import ObsPlan #from ATATools.ata_obs_plan import ObsPlan
-from ata_obs_plot_app import ObsPlotApp #from ATATools.ata_obs_plot_app import ObsPlotApp
-import ATATools.ata_sources as check
-
-from odsutils import ods_engine
-
-from astropy.time import Time, TimeDelta
+# Anything heavy (astropy, ATATools, SNAPobs, slack_sdk, the executors)
+# is only imported where it is first needed, to bring the window up
+# quickly. See startup_benchmark.py
+from schedule_metrics import MetricsSink, load_calibration
+from schedule_model import Schedule, Backend, Digitizer, SetFreq, Track, \
+        SetAzEl, WaitUntil, WaitPrompt, WaitFor, is_positive_number, \
+        list_to_hashpipe_targets
+from schedule_logging import LOGGER_NAME, start_logging, status_level
+from topology import discover_topology, load_topology, save_topology
+from gui_event_pump import EventPump, GUI_METRICS_FNAME
+from log_history import LogHistory, entry_matches, status_text, LOG_RING_SIZE
+from status_stream import StatusPublisher
 
 import datetime
-from datetime import timezone
 import pytz
-from parse import parse
-
-from SNAPobs import snap_config
-from SNAPobs.snap_hpguppi import snap_hpguppi_defaults as hpguppi_defaults
 
 import os
 import tempfile
 
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
-
 
 DEFAULT_TZ = "US/Pacific"
 PROJECTID_FNAME = "./projects.json"
 BACKENDS_FNAME = "./backends.json"
 POSTPROCESSORS_FNAME = "./postprocessors.json"
 
-WAIT_FOR_PROMPT_DEFAULT = 600 # assume 10 minutes
-
 
 TITLE_FONT = ("Helvetica", 18)
 NORMAL_FONT = ("Helvetica", 14)
@@ -53,79 +48,47 @@ TEXTBOX_FONT = ("Monospace", 12, "bold")
 FILL_FONT = ("Helvetica", 12)
 
 LOGGING_DTFMT = "%Y-%m-%d %H:%M:%S.%f"
-LOGGING_INFO_COLOR = ["green"]
-LOGGING_WARNING_COLOR = ["orange", "dark orange"]
-LOGGING_ERROR_COLOR = ["red", "dark red"]
-
-WAIT_DTFMT = "%Y-%m-%dT%Hh%Mm%Ss%z"
-
-ODS_DEFAULTS = "/opt/mnt/share/ods_defaults.json"
-ODS_WRITE    = "/home/sonata/ods.json"
-ODS_WRITE    = "/opt/mnt/share/ods_upload/ods.json"
-
-def is_positive_number(s):
-    try:
-        ss = float(s)
-        if ss < 0:
-            return False
-        return True
-    except ValueError:
-        return False
-
-def hashpipe_targets_to_list(hp_targets):
-    hp_list = []
-    for key in hp_targets.keys():
-        hp_list += [key + "." + str(i) for i in hp_targets[key]]
-    return hp_list
-
-def list_to_hashpipe_targets(hp_list):
-    hp_targets = {}
-    for i in hp_list:
-        seti_node, instance = i.split(".")
-        if seti_node in hp_targets.keys():
-            hp_targets[seti_node].append(int(instance))
-        else:
-            hp_targets[seti_node] = [int(instance)]
 
-    return hp_targets
+# levels that can be shown in the log window
+LOG_LEVELS = {"All": logging.NOTSET, "Warnings and errors": logging.WARNING,
+        "Errors": logging.ERROR}
 
+WAIT_DTFMT = "%Y-%m-%dT%Hh%Mm%Ss%z"
 
-def send_slack_message(token, channel, text):
+class ObsPlotAppSecondary(tk.Toplevel):
     """
-    Function to send a text message to a slack channel using an auth token
+    Plot of an ObsPlan, and what the plot makes of it in verdict: "error",
+    "warning", "ok" or None. With the visibility of its blocks (see
+    compute_visibility()), the title says how many are too low
     """
-    client = WebClient(token=token)
-
-    try:
-        response = client.chat_postMessage(
-            channel=channel,
-            text=text
-        )
-    except SlackApiError as e:
-        # Handle the exception if there was an error
-        raise e
-
-class ObsPlotAppSecondary(tk.Toplevel):
-    def __init__(self, parent, obs):
+    def __init__(self, parent, obs, visibility=None):
         super().__init__(parent)
 
+        from ata_obs_plot_app import ObsPlotApp #from ATATools.ata_obs_plot_app import ObsPlotApp
+
         self.geometry("1550x900")
         self.app = ObsPlotApp(self)
         self.app.load_from_obsplan(obs)
+        self.set_visibility(visibility)
+
+        if self.app.plan_has_error():
+            self.verdict = "error"
+        elif self.app.plan_has_warning():
+            self.verdict = "warning"
+        elif self.app.plan_is_ok():
+            self.verdict = "ok"
+        else:
+            self.verdict = None
 
+    def set_visibility(self, visibility):
+        if visibility is None:
+            return
+        statuses = [vis['status'] for vis in visibility]
+        self.title(f"Observing plan: {len(statuses)} blocks, "
+                f"{statuses.count('error')} too low, "
+                f"{statuses.count('warning')} close to the limit")
 
 
-class ExceptionThread(threading.Thread):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.exception = None
-
-    def run(self):
-        try:
-            if self._target:
-                self._target(*self._args, **self._kwargs)
-        except Exception as e:
-            self.exception = e
 
 class ExceptionProcess(multiprocessing.Process):
     def __init__(self, *args, **kwargs):
@@ -201,7 +164,13 @@ class DropdownWithCheckboxes(tk.Frame):
         # Populate checkboxes
         self.update_options(self.options)
 
-    def update_options(self, options):
+    def update_options(self, options, keep_selection=False):
+        # options that were unchecked stay unchecked if keep_selection
+        unchecked = set()
+        if keep_selection:
+            unchecked = {option for option, var in self.vars.items()
+                    if not var.get()}
+
         # Clear existing checkboxes and variables
         for widget in self.inner_frame.winfo_children():
             widget.destroy()
@@ -210,7 +179,7 @@ class DropdownWithCheckboxes(tk.Frame):
         # Add new options and their checkboxes
         self.options = options
         for option in self.options:
-            var = tk.BooleanVar(value=True)
+            var = tk.BooleanVar(value=option not in unchecked)
             self.vars[option] = var
             chk = tk.Checkbutton(self.inner_frame, text=option, variable=var,
                     font=NORMAL_FONT)
@@ -261,35 +230,339 @@ class DropdownWithCheckboxes(tk.Frame):
         return [option for option, var in self.vars.items() if var.get()]
 
 
+class ScheduleView(tk.Frame):
+    """
+    Listbox that only holds the rows of the schedule that are on screen.
+    The selection and the state of each line (done, running) are kept
+    here and only applied to the visible rows, so long schedules don't
+    need thousands of listbox items and itemconfig() calls.
+
+    It has the same selection methods as a tk.Listbox with MULTIPLE
+    selection, in schedule indices
+    """
+    def __init__(self, parent, schedule, list_font=NORMAL_FONT, width=75,
+            **kwargs):
+        super().__init__(parent)
+
+        self.schedule = schedule
+        self.first = 0        # index of the top row
+        self.rows = 1         # number of rows on screen
+        self.selected = set()
+        self.current = None   # line being executed
+
+        self.listbox = tk.Listbox(self, width=width, height=1, font=list_font,
+                selectmode=tk.MULTIPLE, exportselection=False,
+                activestyle="none", **kwargs)
+        self.scrollbar = tk.Scrollbar(self, orient="vertical",
+                command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.default_bg = self.listbox.cget("bg")
+        self.row_height = font.Font(font=list_font).metrics("linespace") + 1
+
+        self.listbox.bind("<Configure>", self.on_resize)
+        self.listbox.bind("<Button-1>", self.on_click)
+        self.listbox.bind("<B1-Motion>", lambda e: "break")
+        self.listbox.bind("<MouseWheel>", self.on_wheel)
+        self.listbox.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll(3))
+
+    def set_schedule(self, schedule):
+        self.schedule = schedule
+        self.first = 0
+        self.selected.clear()
+        self.current = None
+        self.render()
+
+    # Listbox-like selection
+    def size(self):
+        return len(self.schedule)
+
+    def curselection(self):
+        return tuple(sorted(self.selected))
+
+    def selection_set(self, index):
+        self.selected.add(index)
+        self.render_row(index)
+
+    def selection_clear(self, first=0, last=None):
+        self.selected.clear()
+        self.render()
+
+    def nearest(self, y):
+        return min(self.first + self.listbox.nearest(y), self.size() - 1)
+
+    # to be called after the schedule is changed
+    def inserted(self, index):
+        """
+        A line was inserted at index, shift the selection like a listbox
+        """
+        self.selected = {i + 1 if i >= index else i for i in self.selected}
+        self.render()
+
+    def deleted(self, index):
+        self.selected = {i - 1 if i > index else i for i in self.selected
+                if i != index}
+        self.render()
+
+    def set_current(self, index):
+        """
+        Lines before index are done, index is running. Only the rows
+        whose state changed are updated
+        """
+        previous, self.current = self.current, index
+        if previous is None:
+            previous = 0
+
+        if not self.first <= index < self.first + self.rows:
+            # scroll so that the running line is on screen
+            self.first = index
+            self.render()
+            return
+
+        for i in range(min(previous, index), max(previous, index) + 1):
+            self.render_row(i)
+
+    # drawing
+    def row_bg(self, index):
+        if self.current is None or index > self.current:
+            return self.default_bg
+        if index == self.current:
+            return "lightgreen"
+        return "grey"
+
+    def render_row(self, index):
+        row = index - self.first
+        if not 0 <= row < self.listbox.size():
+            return
+        # To keep in mind:
+        # Linux (some platforms): In some environments, 
+        # itemconfig() may not function as expected due 
+        # to theme-related constraints.
+        self.listbox.itemconfig(row, {'bg': self.row_bg(index)})
+        if index in self.selected:
+            self.listbox.selection_set(row)
+        else:
+            self.listbox.selection_clear(row)
+
+    def render(self):
+        n = self.size()
+        self.first = max(0, min(self.first, n - self.rows))
+        last = min(n, self.first + self.rows)
+
+        self.listbox.delete(0, tk.END)
+        if last > self.first:
+            self.listbox.insert(tk.END, *[self.schedule[i].to_entry()
+                for i in range(self.first, last)])
+        for index in range(self.first, last):
+            if index in self.selected or self.row_bg(index) != self.default_bg:
+                self.render_row(index)
+
+        if n:
+            self.scrollbar.set(self.first / n, last / n)
+        else:
+            self.scrollbar.set(0, 1)
+
+    # events
+    def on_resize(self, event):
+        rows = max(1, event.height // self.row_height)
+        if rows != self.rows:
+            self.rows = rows
+            self.render()
+
+    def on_click(self, event):
+        if not self.size():
+            return "break"
+        index = self.nearest(event.y)
+        if index in self.selected:
+            self.selected.discard(index)
+        else:
+            self.selected.add(index)
+        self.render_row(index)
+        return "break"
+
+    def on_wheel(self, event):
+        self.scroll(-1 if event.delta > 0 else 1)
+        return "break"
+
+    def scroll(self, n):
+        self.first += n
+        self.render()
+        return "break"
+
+    def yview(self, *args):
+        """
+        Scrollbar command
+        """
+        if args[0] == "moveto":
+            self.first = int(float(args[1]) * self.size())
+        elif args[0] == "scroll":
+            n = int(args[1])
+            self.first += n * self.rows if args[2] == "pages" else n
+        self.render()
+
+
 class LogWindow(tk.Toplevel):
-    def __init__(self, parent):
+    """
+    Shows the messages of a LogHistory: the ones in memory, and older ones
+    read back from the log files with the "Older" button. Only messages of the
+    selected level and containing the search text are shown
+    """
+    def __init__(self, parent, history):
         super().__init__(parent)
         self.title("Log Window")
         self.geometry("1000x900")
+        self.history = history
+
+        # what is shown
+        self.min_level = logging.NOTSET
+        self.search_text = ""
+        # [time, number of text lines] of every message shown, oldest
+        # first, and how many messages can be shown
+        self.shown = collections.deque()
+        self.max_shown = LOG_RING_SIZE
+        # time of the oldest message shown, None if there is nothing
+        # older, and how many of the ones shown were read from disk
+        self.older_before = self.history.first_time()
+        self.n_older = 0
+
+        toolbar = tk.Frame(self)
+        toolbar.pack(fill="x", padx=10, pady=(10, 0))
+
+        tk.Label(toolbar, text="Show:", font=FILL_FONT).pack(side="left")
+        self.level_dropdown = ttk.Combobox(toolbar, state="readonly",
+                values=list(LOG_LEVELS), width=18, font=FILL_FONT)
+        self.level_dropdown.current(0)
+        self.level_dropdown.bind("<<ComboboxSelected>>",
+                lambda event: self.apply_filter())
+        self.level_dropdown.pack(side="left", padx=5)
+
+        tk.Label(toolbar, text="Search:", font=FILL_FONT).pack(side="left",
+                padx=(15, 0))
+        self.search_entry = tk.Entry(toolbar, font=FILL_FONT, width=30)
+        self.search_entry.bind("<Return>", lambda event: self.apply_filter())
+        self.search_entry.pack(side="left", padx=5)
+        tk.Button(toolbar, text="Search", font=FILL_FONT,
+                command=self.apply_filter).pack(side="left")
+        tk.Button(toolbar, text="Clear", font=FILL_FONT,
+                command=self.clear_filter).pack(side="left", padx=5)
+
+        self.older_button = tk.Button(toolbar, text="Older", font=FILL_FONT,
+                command=self.load_older)
+        self.older_button.pack(side="right")
+        self.older_label = tk.Label(toolbar, text="", font=FILL_FONT)
+        self.older_label.pack(side="right", padx=5)
 
         # Add a scrolled text widget to display logs
         self.log_text = ScrolledText(self, state="disabled", wrap="word", 
                 font=TEXTBOX_FONT)
         self.log_text.pack(expand=True, fill="both", padx=10, pady=10)
 
-    def add_log(self, message, color="green"):
+        self.apply_filter()
+
+    def log_chunks(self, entries):
+        """
+        text, tag, text, tag... of the entries, for Text.insert
         """
-        Add a log message with a specified color.
+        chunks = []
+        for entry in entries:
+            # Create a unique tag for the color
+            tag_name = f"tag_{entry['color']}"
+            if not tag_name in self.log_text.tag_names():
+                self.log_text.tag_configure(tag_name,
+                        foreground=entry['color'])
+            chunks += [entry['message'] + "\n", tag_name]
+        return chunks
+
+    def shown_entries(self, entries):
+        return [[entry['t'], entry['message'].count("\n") + 1]
+                for entry in entries]
+
+    def add_logs(self, entries):
+        """
+        Add new log messages with a single insert
 
         Args:
-            message (str): The log message to add.
-            color (str): The color of the log message (e.g., "red", "blue", "#RRGGBB").
+            entries (list): entries from LogHistory.append()
         """
-        # Create a unique tag for the color
-        tag_name = f"tag_{color}"
-        if not tag_name in self.log_text.tag_names():
-            self.log_text.tag_configure(tag_name, foreground=color)
+        entries = [entry for entry in entries if entry_matches(entry,
+            self.min_level, self.search_text)]
+        if not entries:
+            return
+
+        # only follow new messages if we are looking at the end
+        at_end = self.log_text.yview()[1] >= 1.0
 
-        # Insert the log message with the color tag
+        # Insert the log messages with their color tags
         self.log_text.configure(state="normal")
-        self.log_text.insert("end", message + "\n", tag_name)
+        self.log_text.insert("end", *self.log_chunks(entries))
+
+        # never show more than what is in memory, plus what was read
+        # from disk, the oldest messages go first
+        self.shown.extend(self.shown_entries(entries))
+        n_trimmed = 0
+        while len(self.shown) > self.max_shown:
+            _, n_text_lines = self.shown.popleft()
+            n_trimmed += n_text_lines
+            self.n_older = max(0, self.n_older - 1)
+        if n_trimmed:
+            self.log_text.delete("1.0", f"{n_trimmed + 1}.0")
+            # Older carries on from what is shown now
+            self.older_before = self.shown[0][0]
+            self.update_older()
         self.log_text.configure(state="disabled")
-        self.log_text.see("end")  # Automatically scroll to the end
+
+        if at_end:
+            self.log_text.see("end")  # Automatically scroll to the end
+
+    def apply_filter(self):
+        self.min_level = LOG_LEVELS[self.level_dropdown.get()]
+        self.search_text = self.search_entry.get().strip()
+
+        entries = self.history.recent(self.min_level, self.search_text)
+        self.shown = collections.deque(self.shown_entries(entries))
+        self.max_shown = LOG_RING_SIZE
+        self.n_older = 0
+        self.older_before = self.history.first_time()
+
+        self.log_text.configure(state="normal")
+        self.log_text.delete("1.0", "end")
+        if entries:
+            self.log_text.insert("end", *self.log_chunks(entries))
+        self.log_text.configure(state="disabled")
+        self.log_text.see("end")
+        self.update_older()
+
+    def clear_filter(self):
+        self.level_dropdown.current(0)
+        self.search_entry.delete(0, tk.END)
+        self.apply_filter()
+
+    def load_older(self):
+        if self.older_before is None:
+            return
+        entries, self.older_before = self.history.older(self.older_before,
+                self.min_level, self.search_text)
+
+        if entries:
+            self.log_text.configure(state="normal")
+            self.log_text.insert("1.0", *self.log_chunks(entries))
+            self.log_text.configure(state="disabled")
+            self.log_text.see("1.0")
+            self.shown.extendleft(reversed(self.shown_entries(entries)))
+            self.max_shown += len(entries)
+            self.n_older += len(entries)
+            self.older_label.config(text="From " + datetime.datetime.fromtimestamp(
+                entries[0]['t']).strftime(LOGGING_DTFMT)[:-7])
+        self.update_older()
+
+    def update_older(self):
+        if self.older_before is None:
+            self.older_button.config(state=tk.DISABLED)
+            self.older_label.config(text="No older messages")
+        else:
+            self.older_button.config(state=tk.NORMAL)
 
 class SourceWidget(tk.Toplevel):
     def __init__(self, parent):
@@ -326,6 +599,7 @@ class SourceWidget(tk.Toplevel):
         dt = datetime.datetime.now(
                 tz=pytz.timezone(DEFAULT_TZ))
         try:
+            import ATATools.ata_sources as check
             source_info = check.check_source_str(dt, sourcename=source_name)
             source_info = source_info.replace("\n", "\n ")
             self.output_text.insert("1.0", source_info)
@@ -361,21 +635,37 @@ class TelescopeSchedulerApp(tk.Tk):
         self.to_enable_disable = [] #list of everything to enable and disable
         self.to_readonly_disable = [] # same as above, but return to readonly
 
-        self.original_listbox = ()
+        # the schedule itself, the listbox only displays it
+        self.schedule = Schedule()
 
         # load project IDs
         self.load_project_id_json()
         self.load_backends_json()
         self.load_postprocessors_json()
+        self.calibration = load_calibration()
+
+        # plan of the last checked schedule, to only recompute what
+        # changed. Made on the first check, see get_plan_cache()
+        self.plan_cache = None
+        # plot of the last checked plan, see show_plot()
+        self.obs_plot = None
 
         self.debug = args.debug
         self.ignore_check_schedule = args.ignore_check
+        self.fixed_clock = args.fixed_clock
 
         if self.debug:
             self.enable_slack = False
         else:
             self.enable_slack = True
 
+        # slack messages go out from a background thread, so a slow
+        # slack never freezes the GUI
+        self.notifier = None
+        if self.enable_slack:
+            from slack_notifier import SlackNotifier
+            self.notifier = SlackNotifier.from_env(self.write_status)
+
         # Configure the root grid layout to have two columns
         #self.root.grid_columnconfigure(0, weight=1)  # Left frame
         #self.root.grid_columnconfigure(1, weight=1)  # Right frame
@@ -411,8 +701,8 @@ class TelescopeSchedulerApp(tk.Tk):
         #self.image_label = tk.Label(self.frame_left, image=self.tk_image)
         #self.image_label.grid(row=0, column=1, sticky="nsew", padx=0, pady=0)
 
-        # Left-hand side (listbox)
-        self.listbox = tk.Listbox(self.frame_left, width=75, selectmode=tk.MULTIPLE,
+        # Left-hand side (listbox), only draws the lines that are on screen
+        self.listbox = ScheduleView(self.frame_left, self.schedule, width=75,
                                   bd=2, relief=tk.RAISED, font=("Helvetica", 14))
         self.listbox.grid(row=0, column=1, sticky="nsew", padx=5, pady=9)
 
@@ -534,25 +824,42 @@ class TelescopeSchedulerApp(tk.Tk):
 
         # check if schedule is modified before exiting
         self.protocol("WM_DELETE_WINDOW", self.check_if_modified_and_quit)
-        # Add log
-        self.log_window = LogWindow(self)
-
-        logging.basicConfig(
-            level=logging.INFO,  # Set the minimum logging level
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Log format
-            handlers=[
-                logging.FileHandler("app.log"),  # Log to a file
-                logging.StreamHandler()         # Log to the console
-            ]
-        )
-
-        self.logger = logging.getLogger("ATAObsSchedulerLogger")
-
-        # Create a queue for thread communication to the main GUI update method
-        self.task_queue = multiprocessing.Queue() #queue.Queue()
+        # Add log, the last messages are kept in memory and the
+        # rest on disk
+        self.log_history = LogHistory()
+        self.log_window = LogWindow(self, self.log_history)
+
+        # Log to a file and the console, from a thread of its own so that
+        # write_status never waits for them
+        self.log_listener = start_logging()
+
+        self.logger = logging.getLogger(LOGGER_NAME)
+
+        # Events for the GUI from other threads and the execution process.
+        # Only the last status line of a burst is shown, and log lines
+        # are added to the log window together
+        self.events = EventPump(self, {
+                "log_message": self.log_messages,
+                "obs_status": self.obs_status.config,
+                "update_topology": self._update_topology,
+                "change_color_of_entry": self._change_color_of_selected_entry,
+                "enable_everything": self._enable_everything,
+                "disable_everything": self._disable_everything},
+                coalesced=("obs_status", "change_color_of_entry"),
+                batched=("log_message",),
+                metrics=MetricsSink(GUI_METRICS_FNAME))
 
         # Now start it
-        self.after(100, self.gui_process_queue)
+        self.events.start()
+
+        # execution progress, for anyone who wants to follow it
+        self.status_stream = StatusPublisher(write_status=self.write_status)
+        try:
+            self.status_stream.start()
+        except OSError as e:
+            self.write_status(f"Could not publish the execution progress: "
+                    f"{e}", fg='orange')
+            self.status_stream = None
 
         if self.debug:
             self.write_status("Running scheduler in debug mode")
@@ -611,13 +918,17 @@ class TelescopeSchedulerApp(tk.Tk):
         self.to_enable_disable.append(self.deregister_oic_button)
 
 
-        options = ["tmp1", "tmp2"]
-        self.antenna_dropdown = DropdownWithCheckboxes(antenna_inner_frame, options,
+        # start with what was there last time, the refresh below
+        # updates it in the background
+        topology = load_topology() or {"antennas": [], "recorders": []}
+        self.antenna_dropdown = DropdownWithCheckboxes(antenna_inner_frame,
+                                          topology["antennas"],
                                           text="Antennas", bg="lightblue")
         self.antenna_dropdown.pack(side=tk.LEFT, padx=5, pady=5)
         self.to_enable_disable.append(self.antenna_dropdown.button)
 
-        self.targets_dropdown = DropdownWithCheckboxes(antenna_inner_frame, options,
+        self.targets_dropdown = DropdownWithCheckboxes(antenna_inner_frame,
+                                          topology["recorders"],
                                           text="Recorders", bg="lightblue", width=150)
         self.targets_dropdown.pack(side=tk.LEFT, padx=5, pady=5)
         self.to_enable_disable.append(self.targets_dropdown.button)
@@ -625,7 +936,13 @@ class TelescopeSchedulerApp(tk.Tk):
         self.antenna_button = tk.Button(antenna_inner_frame, 
                 text="Refresh", font=NORMAL_FONT, bg="lightblue",
                 command=self.refresh_ant_targets)
-        self.refresh_ant_targets()
+        self.discovery_thread = None
+        self.discovery_started = None
+        # a Refresh that came while getting them, see refresh_ant_targets()
+        self.discovery_reset_pending = False
+        # only once the window is up, and without touching what the
+        # user already unchecked
+        self.after_idle(self.refresh_ant_targets, False)
 
         self.antenna_button.pack(padx=5, pady=5)
         self.to_enable_disable.append(self.antenna_button)
@@ -938,17 +1255,59 @@ class TelescopeSchedulerApp(tk.Tk):
         self.to_enable_disable.append(self.eq_level_checkbox)
         self.to_enable_disable.append(self.focus_freq)
 
-    def refresh_ant_targets(self):
-        # get antenna list
-        ant_list = sorted(snap_config.get_rfsoc_active_antlist())
-        self.antenna_dropdown.update_options(ant_list)
+    def refresh_ant_targets(self, reset=True):
+        """
+        Gets the antennas and recorders in a thread, the dropdowns get
+        updated through the queue once they are there. With reset, every
+        option ends up checked
+        """
+        if self.discovery_thread and self.discovery_thread.is_alive():
+            # the reset is done with whatever the running one gets
+            self.discovery_reset_pending |= reset
+            t = time.time() - self.discovery_started
+            self.write_status(f"Already getting the antennas and recorders "
+                    f"(for {t:.0f} s), please wait", fg='orange')
+            return
+        self.discovery_started = time.time()
+        self.discovery_thread = threading.Thread(
+                target=self._refresh_ant_targets, args=(reset,), daemon=True)
+        self.discovery_thread.start()
 
-        # get hashpipe recorders
-        d = hpguppi_defaults.hashpipe_targets_LoA.copy()
-        d.update(hpguppi_defaults.hashpipe_targets_LoB)
+    def _refresh_ant_targets(self, reset):
+        try:
+            topology = discover_topology()
+        except Exception as e:
+            self.write_status(f"Could not get antennas and recorders, using "
+                    f"the last known ones: {e}", fg='orange')
+            topology = None
+
+        # also when it failed, for a reset that is still pending
+        self.events.put("update_topology",
+                {"topology": topology, "reset": reset})
+        if topology is None:
+            return
+
+        try:
+            save_topology(topology)
+        except Exception as e:
+            self.write_status(f"Could not save antennas and recorders: {e}",
+                    fg='orange')
+
+    def _update_topology(self, topology, reset):
+        reset = reset or self.discovery_reset_pending
+        self.discovery_reset_pending = False
+        if topology is None:
+            if not reset:
+                return
+            topology = {"antennas": self.antenna_dropdown.options,
+                    "recorders": self.targets_dropdown.options}
 
-        d_list = hashpipe_targets_to_list(d)
-        self.targets_dropdown.update_options(d_list)
+        if self.antenna_dropdown.options != topology["antennas"] or reset:
+            self.antenna_dropdown.update_options(topology["antennas"],
+                    keep_selection=not reset)
+        if self.targets_dropdown.options != topology["recorders"] or reset:
+            self.targets_dropdown.update_options(topology["recorders"],
+                    keep_selection=not reset)
 
 
     def register_oic(self):
@@ -960,21 +1319,13 @@ class TelescopeSchedulerApp(tk.Tk):
 
             self.write_status(f'Observer {oic} registered as Observer in Charge')
 
-            # Get slack token and channel_id
-            slack_token = os.environ.get("ATATOKEN", "")
-            channel_id = os.environ.get("ATACHANNEL", "")
             emoji = ":large_green_circle:"
             message_text = f'{emoji} Observer *`{oic}`* registered as Observer In Charge {emoji}'
 
             if self.enable_slack:
-                try:
-                    send_slack_message(slack_token, channel_id, message_text)
-                    self.write_status(f'Observer {oic} registered as OIC',
-                            fg='green')
-                except Exception as e:
-                    self.write_status(f'Could not send OIC message to slack',
-                            fg='red')
-                    print(e)
+                self.notifier.send(message_text)
+                self.write_status(f'Observer {oic} registered as OIC',
+                        fg='green')
 
 
     def deregister_oic(self):
@@ -984,20 +1335,12 @@ class TelescopeSchedulerApp(tk.Tk):
         oic = self.registered_observer
 
         if oic and self.enable_slack:
-            # Get slack token and channel_id
-            slack_token = os.environ.get("ATATOKEN", "")
-            channel_id = os.environ.get("ATACHANNEL", "")
             emoji = ":large_red_square:"
             message_text = f'{emoji} Observer *`{oic}`* de-registered as Observer In Charge {emoji}'
 
-            try:
-                self.write_status(f'Observer {oic} de-registered as OIC',
-                        fg='green')
-                send_slack_message(slack_token, channel_id, message_text)
-            except Exception as e:
-                self.write_status(f'Could not send deregister OIC message to slack',
-                        fg='green')
-                print(e)
+            self.write_status(f'Observer {oic} de-registered as OIC',
+                    fg='green')
+            self.notifier.send(message_text)
 
         self.registered_observer = ""
 
@@ -1009,12 +1352,7 @@ class TelescopeSchedulerApp(tk.Tk):
 
         # Check if all selections have values
         if project_id and backend and postprocessor:
-            # Format the entry to be added to the listbox
-            cmd_type = "BACKEND"
-            entry = cmd_type + (12 - len(cmd_type))*" "
-            entry += f"-- ProjectID: {project_id}, Backend: {backend}, Postprocessor: {postprocessor}"
-            self.listbox.insert(tk.END, entry)
-            self.disable_execute()
+            self.append_line(Backend(project_id, backend, postprocessor))
         else:
             self.write_status("Please select all fields.", fg='orange')
 
@@ -1022,11 +1360,7 @@ class TelescopeSchedulerApp(tk.Tk):
         digitizer_mode = self.digitizer_mode_dropdown.get()
 
         if digitizer_mode:
-            cmd_type = "DIGITIZER"
-            entry = cmd_type + (12 - len(cmd_type))*" "
-            entry += f"-- Mode: {digitizer_mode}"
-            self.listbox.insert(tk.END, entry)
-            self.disable_execute()
+            self.append_line(Digitizer(digitizer_mode))
         else:
             self.write_status("Please select digitizer mode.", fg='orange')
 
@@ -1051,12 +1385,9 @@ class TelescopeSchedulerApp(tk.Tk):
         eq_level = self.eq_level_var.get()
         focus_freq = self.focus_freq_var.get() 
 
-        # Format the entry for the frequency setup
-        cmd_type = "SETFREQ"
-        entry = cmd_type + (12 - len(cmd_type)) * " "
-        entry += f"-- TuningA: {tuning_a}, TuningB: {tuning_b}, RFgain: {rf_gain}, IFgain: {if_gain}, EQlevel: {eq_level}, Focus: {focus_freq}"
-        self.listbox.insert(tk.END, entry)
-        self.disable_execute()
+        # Values are kept as text, like when they are read from the listbox
+        self.append_line(SetFreq(tuning_a, tuning_b, str(rf_gain),
+            str(if_gain), str(eq_level), str(focus_freq)))
 
     def add_source_entry(self):
         # Get values from the source name and observation time entries
@@ -1069,12 +1400,7 @@ class TelescopeSchedulerApp(tk.Tk):
 
         # Check if both fields are filled
         if source_name and obs_time:
-            # Format the entry and insert it into the listbox
-            cmd_type = "TRACK"
-            entry = cmd_type + (12 - len(cmd_type)) * " "
-            entry += f"-- Source: {source_name}, ObsTime: {obs_time}"
-            self.listbox.insert(tk.END, entry)
-            self.disable_execute()
+            self.append_line(Track(source_name, obs_time))
 
             # Clear the input fields after adding
             self.source_name_entry.delete(0, tk.END)
@@ -1096,20 +1422,14 @@ class TelescopeSchedulerApp(tk.Tk):
         self.seconds_spin.insert(0, f'{ss_now:02}')
 
     def add_park_command(self):
-        cmd_type = "SETAZEL"
-        entry = cmd_type + (12 - len(cmd_type)) * " "
-        entry += f"-- Az: 0, El: 18 "
-        self.listbox.insert(tk.END, entry)
-        self.disable_execute()
+        self.append_line(SetAzEl("0", "18"))
 
     def duplicate_entry(self):
         # Get the selected entries
         selected = self.listbox.curselection()
         if selected:
             for index in selected: #selected[::-1]:  # Reverse order to keep the positions consistent while duplicating
-                entry = self.listbox.get(index)
-                self.listbox.insert(tk.END, entry)
-                self.disable_execute()
+                self.append_line(self.schedule[index])
         else:
             self.write_status("Please select entried to duplicate", fg='orange')
 
@@ -1118,8 +1438,7 @@ class TelescopeSchedulerApp(tk.Tk):
         selected = self.listbox.curselection()
         if selected:
             for index in selected[::-1]:  # Reverse order to avoid index shifting issues while deleting
-                self.listbox.delete(index)
-                self.disable_execute()
+                self.delete_line(index)
 
     def reset_selection(self, event=None):
         """Reset the selection of the listbox."""
@@ -1136,9 +1455,7 @@ class TelescopeSchedulerApp(tk.Tk):
             current_index = self.listbox.nearest(event.y)  # Get the index of the item currently under the mouse
             if current_index != self.dragged_index:
                 # Move the item if the indices are different
-                item_text = self.listbox.get(self.dragged_index)
-                self.listbox.delete(self.dragged_index)
-                self.listbox.insert(current_index, item_text)
+                self.move_line(self.dragged_index, current_index)
                 self.dragged_index = current_index  # Update the index of the dragged item
 
     def on_release(self, event):
@@ -1154,10 +1471,8 @@ class TelescopeSchedulerApp(tk.Tk):
         for index in selected:
             if index == 0:  # If it's already at the top, do nothing
                 continue
-            # Get the text of the selected entry and swap it with the one above
-            text = self.listbox.get(index)
-            self.listbox.delete(index)
-            self.listbox.insert(index - 1, text)
+            # swap the selected entry with the one above
+            self.move_line(index, index - 1)
             self.listbox.selection_set(index - 1)  # Keep the moved item selected
 
     def move_entry_down(self):
@@ -1169,10 +1484,8 @@ class TelescopeSchedulerApp(tk.Tk):
         for index in reversed(selected):  # Reverse to avoid index shifting issues
             if index == max_index:  # If it's already at the bottom, do nothing
                 continue
-            # Get the text of the selected entry and swap it with the one below
-            text = self.listbox.get(index)
-            self.listbox.delete(index)
-            self.listbox.insert(index + 1, text)
+            # swap the selected entry with the one below
+            self.move_line(index, index + 1)
             self.listbox.selection_set(index + 1)  # Keep the moved item selected
 
     def move_selection_up(self):
@@ -1209,16 +1522,18 @@ class TelescopeSchedulerApp(tk.Tk):
     def open_log_window(self):
         # Check if the log window is already open
         if self.log_window is None or not self.log_window.winfo_exists():
-            self.log_window = LogWindow(self)
+            self.log_window = LogWindow(self, self.log_history)
         else:
             self.log_window.focus()
 
     def log_message(self, message, color):
-        # Log a message to the log window if it's open
+        self.log_messages([{"message": message, "color": color}])
+
+    def log_messages(self, logs):
+        # Keep the messages, and show them in the log window if it's open
+        entries = self.log_history.append(logs)
         if self.log_window and self.log_window.winfo_exists():
-            self.log_window.add_log(message, color)
-        else:
-            print("Log window is not open.")
+            self.log_window.add_logs(entries)
 
     def open_check_source(self):
         app = SourceWidget(self)
@@ -1243,7 +1558,7 @@ class TelescopeSchedulerApp(tk.Tk):
         ok_button.pack()
 
     def new_schedule(self):
-        if self.listbox.get(0, tk.END) != self.original_listbox:
+        if self.schedule.is_modified():
             response = messagebox.askyesnocancel(title="", 
                         message="Current schedule is mofified, want to save it?")
             if response == None:
@@ -1268,6 +1583,9 @@ class TelescopeSchedulerApp(tk.Tk):
         self.load_project_id_json()
         self.load_backends_json()
         self.load_postprocessors_json()
+        self.calibration = load_calibration()
+        if self.plan_cache is not None:
+            self.plan_cache.clear()
 
         self.projectid_dropdown.set("")
         self.projectid_dropdown['values'] = list(self.projectid_mapping.keys())
@@ -1290,13 +1608,13 @@ class TelescopeSchedulerApp(tk.Tk):
         self.source_name_entry.delete(0, tk.END)
         self.obs_time_entry.delete(0, tk.END)
 
-        self.listbox.delete(0, tk.END)
-        self.original_listbox = ()
+        self.schedule.clear()
+        self.show_schedule()
         self.title(f"Allen Telescope Array Scheduler")
         self.write_status(text="")
 
     def check_if_modified_and_quit(self):
-        if self.listbox.get(0, tk.END) != self.original_listbox:
+        if self.schedule.is_modified():
             response = messagebox.askyesnocancel(title="",
                         message="Current schedule is mofified, want to save it?")
             if response == None:
@@ -1311,11 +1629,24 @@ class TelescopeSchedulerApp(tk.Tk):
                 # user didn't want to save, disregarding
                 pass
 
+        self.shutdown()
+
+    def shutdown(self):
+        """
+        Closes everything that runs in the background, and the window
+        """
+        if self.notifier:
+            # give the last messages a chance to go out
+            self.notifier.close()
+        if self.status_stream:
+            self.status_stream.close()
+        self.log_listener.stop()
+
         self.quit()
         self.destroy()
 
     def open_schedule(self):
-        if self.listbox.get(0, tk.END) != self.original_listbox:
+        if self.schedule.is_modified():
             response = messagebox.askyesnocancel(title="", 
                         message="Current schedule is mofified, want to save it?")
             if response == None:
@@ -1342,25 +1673,20 @@ class TelescopeSchedulerApp(tk.Tk):
             with open(filename, 'r') as json_file:
                 data = json.load(json_file)
 
-            self.listbox.delete(0, tk.END)
-            #for entry in data['commands']:
-            #    self.listbox.insert(tk.END, entry)
-            for cmd in data['commands']:
-                cmd_type = list(cmd.keys())[0]
-                cmd_dict = cmd[cmd_type]
-                #cmd_type, cmd_dict
-                entry = str(cmd_type) + (12 - len(cmd_type))*" " + "--"
-                for elem,val in cmd_dict.items():
-                    entry += f" {elem}: {val},"
-                entry = entry[:-1] #remove last ,
-                self.listbox.insert(tk.END, entry)
+            try:
+                schedule = Schedule.from_json(data)
+            except ValueError as e:
+                self.write_status(f"Could not open {filename}: {e}", fg='red')
+                return
+
+            self.schedule = schedule
+            self.show_schedule()
 
         except Exception as e:
             raise e
 
         self.refresh_ant_targets()
 
-        self.original_listbox = self.listbox.get(0, tk.END)
         fname = os.path.basename(filename)
         self.title(f"Allen Telescope Array Scheduler - {fname}")
         self.write_status(text="")
@@ -1376,40 +1702,55 @@ class TelescopeSchedulerApp(tk.Tk):
                 return # User cancelled the file selection
 
             self.write_status(f"Trying to save to file: {filename}")
-            data = self.sch_listbox_to_json()
+            data = self.schedule.to_json()
 
             with open(filename, "w") as json_file:
                 json.dump(data, json_file, indent=4)
         except Exception as e:
             raise e
-        self.original_listbox = self.listbox.get(0, tk.END)
+        self.schedule.mark_saved()
         fname = os.path.basename(filename)
         self.title(f"Allen Telescope Array Scheduler - {fname}")
 
 
     def sch_listbox_to_list(self):
-        cmd_config = []
-        for idx, cmd in enumerate(self.listbox.get(0, tk.END)):
-            cmd_type, config = self.parse_command(cmd)
-            cmd_config.append([cmd_type, config])
+        """
+        [cmd_type, config] of every line, with the selected antennas and
+        recorders
+        """
+        ant_list   = self.antenna_dropdown.get_selected_options()
+        hp_targets = list_to_hashpipe_targets(self.targets_dropdown.get_selected_options())
+
+        return self.schedule.to_cmds_cfgs(ant_list, hp_targets)
 
-        return cmd_config
 
+    def append_line(self, line):
+        self.insert_line(len(self.schedule), line)
 
-    def sch_listbox_to_json(self):
-        commands_str = self.listbox.get(0, tk.END)
-        data = {
-                "commands": []
-                }
+    def insert_line(self, index, line):
+        """
+        Adds a ScheduleLine to the schedule, and to the listbox
+        """
+        self.schedule.insert(index, line)
+        self.listbox.inserted(index)
+        self.disable_execute()
 
-        cmd_list = []
-        for cmd in commands_str:
-            cmd_type, config = self.parse_command(cmd, supplement=False)
-            cmd_list.append({cmd_type: config})
+    def delete_line(self, index):
+        self.schedule.delete(index)
+        self.listbox.deleted(index)
+        self.disable_execute()
 
-        data["commands"] = cmd_list
+    def move_line(self, index, new_index):
+        self.schedule.move(index, new_index)
+        self.listbox.deleted(index)
+        self.listbox.inserted(new_index)
+        self.disable_execute()
 
-        return data
+    def show_schedule(self):
+        """
+        Shows the (new) schedule in the listbox
+        """
+        self.listbox.set_schedule(self.schedule)
 
 
     def check_schedule(self):
@@ -1417,32 +1758,89 @@ class TelescopeSchedulerApp(tk.Tk):
         self.disable_everything()
         cmds_cfgs = self.sch_listbox_to_list()
         try:
-            obs = self.generate_obs_plan(cmds_cfgs)
+            obs = self.get_plan_cache().get_plan(cmds_cfgs)
         except:
             self.write_status("Check schedule failed", fg='red')
             self.enable_everything()
             raise
 
+        n_reused = self.plan_cache.n_reused
+        if n_reused:
+            self.write_status(f"Reused the plan of {n_reused} unchanged "
+                    f"lines out of {len(cmds_cfgs)}")
+
+        from schedule_plan import WAIT_FOR_PROMPT_DEFAULT
         for cmd_type, config in cmds_cfgs:
             if cmd_type == "WAITPROMPT":
                 t = f"WARNING: can't predict accurate observing schedule past WAITPROMPT, I will assume {WAIT_FOR_PROMPT_DEFAULT}"
                 self.write_status(t, fg='dark orange')
 
-        # Spawn a secondary plot for the obsplanner and wait until exit
-        obs_plot = ObsPlotAppSecondary(self, obs)
-        self.wait_window(obs_plot)
+        # the vectorized visibility only says which blocks are low, the
+        # checks of the plot decide whether the schedule can be executed
+        visibility = self.report_visibility(obs)
+        verdict = self.show_plot(obs, visibility)
 
-        if obs_plot.app.plan_has_error():
+        if verdict == "error":
             self.write_status("Schedule has an error, please fix and check again", fg='red')
-        elif obs_plot.app.plan_has_warning():
+        elif verdict == "warning":
             self.write_status("Source might set during observing, please proceed with caution", fg='orange')
             self.enable_execute()
-        elif obs_plot.app.plan_is_ok():
+        elif verdict == "ok":
             self.write_status("No error in plan, it is safe to execute schedule")
             self.enable_execute()
 
         self.enable_everything()
 
+    def show_plot(self, obs, visibility):
+        """
+        Shows the plan next to the main window, and returns the verdict
+        of the plot (see ObsPlotAppSecondary). The plot is only made
+        again if the blocks changed since the last check
+        """
+        if self.obs_plot is not None and self.obs_plot.winfo_exists():
+            if not self.plan_cache.changed:
+                self.obs_plot.set_visibility(visibility)
+                self.obs_plot.lift()
+                return self.obs_plot.verdict
+            self.obs_plot.destroy()
+        self.obs_plot = ObsPlotAppSecondary(self, obs, visibility)
+        return self.obs_plot.verdict
+
+    def report_visibility(self, obs):
+        """
+        Works out the elevation of all the blocks of the plan at once, and
+        reports the ones that get low. Only informative, see check_schedule()
+
+        Returns:
+        - list: visibility of every block, see compute_visibility(), or
+          None if it could not be computed
+        """
+        from astropy.time import Time
+        from schedule_visibility import ELEVATION_LIMIT, ELEVATION_WARNING
+
+        try:
+            visibility = self.plan_cache.get_visibility(obs)
+        except Exception as e:
+            self.write_status(f"Could not compute visibility: {e}",
+                    fg='orange')
+            return None
+
+        def hhmm(t_unix):
+            return Time(t_unix, format='unix').datetime.strftime("%H:%M")
+
+        for vis in visibility:
+            source, min_el = vis['object'], vis['min_el']
+            if vis['status'] == "error":
+                self.write_status(f"{source} goes below {ELEVATION_LIMIT} deg "
+                        f"during its block (min el: {min_el:.1f})", fg='red')
+            elif vis['status'] == "warning":
+                intervals = ", ".join(f"{hhmm(t0)}-{hhmm(t1)}"
+                        for t0, t1 in vis['warnings'])
+                self.write_status(f"{source} is below {ELEVATION_WARNING} deg "
+                        f"during {intervals} UTC (min el: {min_el:.1f})",
+                        fg='orange')
+        return visibility
+
     def enable_execute(self):
         #self.execute_button.config(state=tk.NORMAL)
         self.execute_button_enabled = True
@@ -1460,60 +1858,20 @@ class TelescopeSchedulerApp(tk.Tk):
         return self.execute_button_enabled
 
 
-    def gui_process_queue(self):
-        """
-        Method to process GUI application wide events that are feed back from
-        other threads.
-        This method should run in an infinite (.after(100)) loop
-        """
-        while not self.task_queue.empty():
-            params = self.task_queue.get()
-            event_name = params['event_name']
-            event_args = params['event_args']
-
-            if event_name == "log_message":
-                self.log_message(**event_args)
-
-            elif event_name == "obs_status":
-                self.obs_status.config(**event_args)
-
-            elif event_name == "change_color_of_entry":
-                self._change_color_of_selected_entry(**event_args)
-
-            elif event_name == "enable_everything":
-                self._enable_everything()
-
-            elif event_name == "disable_everything":
-                self._disable_everything()
-
-        # Schedule the next queue check
-        self.after(100, self.gui_process_queue)
-
-
     def write_status(self, text, fg='green'):
         #self.obs_status.config(text=text, fg=fg, font=NORMAL_FONT)
-        event = {"event_name": "obs_status",
-                "event_args": {"text": text, "fg": fg, "font": NORMAL_FONT}}
-        self.task_queue.put(event)
+        events = [("obs_status", {"text": text, "fg": fg, "font": NORMAL_FONT})]
 
         if text:
             d = datetime.datetime.now()
-            log_text = "[" + d.strftime(LOGGING_DTFMT)[:-3] + "]"
-            log_text += f": {text}"
+            log_text = status_text(d.timestamp(), text)
             #self.log_message(message=log_text, color=fg)
-            event = {"event_name": "log_message",
-                    "event_args": {"message": log_text, "color": fg}}
-            self.task_queue.put(event)
-
-        # logger() is thread-safe, so this can stay here (and not put in queue)
-        if fg.lower() in LOGGING_INFO_COLOR:
-            self.logger.info(text)
-
-        if fg.lower() in LOGGING_WARNING_COLOR:
-            self.logger.warning(text)
+            events.append(("log_message", {"message": log_text, "color": fg,
+                "t": d.timestamp()}))
+        self.events.put_all(events)
 
-        if fg.lower() in LOGGING_ERROR_COLOR:
-            self.logger.error(text)
+        # the logger only queues the record, so this can stay here
+        self.logger.log(status_level(fg), text, extra={"color": fg})
 
 
     def execute_schedule(self):
@@ -1534,6 +1892,7 @@ class TelescopeSchedulerApp(tk.Tk):
                 "write_status": self.write_status,
                 "ant_list": self.antenna_dropdown.get_selected_options(),
                 "cmds_cfgs": self.sch_listbox_to_list(),
+                "fixed_clock": self.fixed_clock,
                 "recv_conn": recv_conn}
 
         _ = gc.collect()
@@ -1555,6 +1914,7 @@ class TelescopeSchedulerApp(tk.Tk):
         ant_list            = context['ant_list']
         cmds_cfgs           = context['cmds_cfgs']
         recv_conn           = context['recv_conn']
+        fixed_clock         = context['fixed_clock']
 
 
         if registered_observer == "":
@@ -1567,163 +1927,50 @@ class TelescopeSchedulerApp(tk.Tk):
             self.write_status("Please run 'Check Schedule' first", fg='red')
             return
 
+        from schedule_runner import execute_schedule, watch_abort_pipe
+
         #self.interrupt_flag = False
         self.disable_everything()
 
-        # Reserve antennas first
-        try:
-            #ant_list   = self.antenna_dropdown.get_selected_options()
-            config = {'ant_list': ant_list}
-            cmd_type = "RESERVEANTENNAS"
-            reserve_antennas = ScheduleExecutor(cmd_type, config, self.write_status)
-            reserve_antennas.execute()
-        except Exception as e:
-            self.enable_everything()
-            self.write_status(e.args, fg='red')
-            self.write_status("Maybe antennas already reserved? Try running 'atareleaseants' command",
-                    fg='red')
-            raise e
-
+        # All schedule lines share the same interrupt event, which a
+        # watcher thread sets as soon as an abort comes through the pipe,
+        # so waiting executors wake up straight away
+        interrupt_event = threading.Event()
+        threading.Thread(target=watch_abort_pipe,
+                args=(recv_conn, interrupt_event), daemon=True).start()
 
-        # make sure I can release antennas
-        cmd_type = "RELEASEANTENNAS"
-        release_antennas = ScheduleExecutor(cmd_type, config, self.write_status)
+        # the notifier of the GUI was forked along with us, without its
+        # thread, so this process gets its own
+        notifier = None
+        if self.enable_slack:
+            from slack_notifier import SlackNotifier
+            notifier = SlackNotifier.from_env(self.write_status)
 
-        #cmds_cfgs = self.sch_listbox_to_list()
-
-        # I will initialize all sch lines to make sure
-        # all of them are compliant
-        schs = []
-        for cmd_cfg in cmds_cfgs:
-            cmd_type, config = cmd_cfg
-            try:
-                sch = ScheduleExecutor(cmd_type, config, self.write_status)
-            except Exception as e:
-                err_txt = f"Initializing schedule line {cmd_type} with "\
-                        f"config: {config} failed with exception:"
-                self.enable_everything()
-                release_antennas.execute()
-                self.write_status(err_txt, fg='red')
-                self.write_status(e.args[0], fg='red')
-                raise e
-            schs.append(sch)
-
-        # Let's start executing the schedule
-        for idx in range(len(cmds_cfgs)):
-            # I'll keep regenerate the ODS file 
-            self.generate_ods(cmds_cfgs[idx:])
-
-            #if self.interrupt_flag:
-            if recv_conn.poll():
-                # User requested interrupt
-                # Should be fine to return here because nothing is 
-                # being executed
-                self.enable_everything()
-                release_antennas.execute()
-                return
-
-            # current schedule line
-            sch      = schs[idx]
-            cmd_type = sch.action_type 
-            config   = sch.config
-
-            self.write_status(text=cmd_type)
-            self.write_status(text=config)
-            self.change_color_of_selected_entry(idx)
-
-            # now let's execute the schedule line in a thread
-            task_thread = ExceptionThread(target=sch.execute) #ExceptionThread(target=sch.execute)
-            task_thread.start()
-            while task_thread.is_alive():
-            #    if self.interrupt_flag:
-                if recv_conn.poll(): # received a stop
-                    # try to gracefully interrupt the process 
-                    # by passing the interrupt flag
-                    sch.interrupt()
-                time.sleep(0.2)
-
-            if task_thread.exception:
-                self.enable_everything()
-                release_antennas.execute()
-                self.write_status(task_thread.exception.args[0], fg='red')
-                task_thread.join()
-                raise task_thread.exception
-
-            # make sure to join 
-            task_thread.join()
-
-        self.change_color_of_selected_entry(idx+1)
-        idx = 0
-        self.enable_everything()
-        release_antennas.execute()
-        self.write_status("Finished Schedule!")
-
-    def generate_obs_plan(self, cmds_cfgs):
-        dt_now = datetime.datetime.now(timezone.utc)
-
-        obs = ObsPlan(Time(dt_now), slew_time=True, obs_overhead=True)
+        try:
+            execute_schedule(cmds_cfgs, ant_list, self.write_status,
+                    interrupt_event, fixed_clock, self.calibration,
+                    self.change_color_of_selected_entry, notifier,
+                    self.status_stream, self.plan_cache)
+        finally:
+            self.enable_everything()
+            if notifier:
+                notifier.close()
 
-        init_position_set = False
+    def get_plan_cache(self):
+        if self.plan_cache is None:
+            from schedule_plan import PlanCache
+            self.plan_cache = PlanCache(self.new_obs_plan,
+                    self.add_to_obs_plan)
+        return self.plan_cache
 
-        for cmd_type, config in cmds_cfgs:
-            if not init_position_set:
-                if 'ant_list' in config:
-                    ant_list = config['ant_list']
-                    obs.set_current_position(ant_list)
-                    #print("setting antenna positions")
-                    #print(obs.current_position)
-                    init_position_set = True
-
-            if cmd_type == "SETFREQ":
-                obs.add_rf_if_overhead()
-            elif cmd_type == "BACKEND":
-                obs.add_backend_overhead()
-            elif cmd_type == "TRACK":
-                try:
-                    obs.add_obs_block(config['Source'], int(config['ObsTime'])) #this need try/except
-                except Exception as e:
-                    source = config['Source']
-                    self.write_status(f"adding source {source} failed...", fg='red')
-                    self.write_status(e.args[0], fg='red')
-                    raise e
-
-            elif cmd_type == "WAITPROMPT":
-                # I will assume the user will wait for 
-                # WAIT_FOR_PROMPT_DEFAULT
-                obs.add_wait_time(WAIT_FOR_PROMPT_DEFAULT)
-            elif cmd_type == "WAITFOR":
-                obs.add_wait_time(int(config['twait']))
-            elif cmd_type == "WAITUNTIL":
-                dt_until = datetime.datetime.strptime(config['dt'],
-                        WAIT_DTFMT)
-                obs.add_wait_until_dt(Time(dt_until))
-
-        return obs
-
-    def generate_ods(self, cmds_cfgs):
-        obs = self.generate_obs_plan(cmds_cfgs)
-
-        # not to be confused with obs :)
-        ods = ods_engine.ODS(output='ERROR')
-        ods.get_defaults_dict(ODS_DEFAULTS)
-        ods_list = []
-
-        for obs_entry in obs.obs_plan:
-            entry = {}
-            entry['src_id'] = obs_entry['object']
-            entry['src_ra_j2000_deg'] = obs_entry['ra'] * 360 / 24.
-            entry['src_dec_j2000_deg'] = obs_entry['dec']
-            entry['src_start_utc'] = obs_entry['start_time'].isot
-            entry['src_end_utc'] = obs_entry['end_time'].isot
-
-            ods_list.append(entry)
-
-        if ods_list:
-            ods.add_from_list(ods_list)
-            ods.write_ods(ODS_WRITE)
-            #tstamp = str(round(time.time(), 2))
-            #ods.write_ods(f"/home/sonata/ods_files/ods_{tstamp}.json")
+    def new_obs_plan(self, t_start=None):
+        from schedule_plan import new_obs_plan
+        return new_obs_plan(self.calibration, t_start)
 
+    def add_to_obs_plan(self, obs, cmd_type, config):
+        from schedule_plan import add_to_obs_plan
+        add_to_obs_plan(obs, cmd_type, config, self.calibration,
+                self.write_status)
 
     
     def abort_schedule(self):
@@ -1738,81 +1985,23 @@ class TelescopeSchedulerApp(tk.Tk):
                 pass
         #self.interrupt_flag = True
 
-    def parse_command(self, command, supplement=True):
-        res = parse("{cmd_type} -- {cfg_str}", command)
-        cmd_type, cfg_str = res['cmd_type'], res['cfg_str']
-
-        cmd_type = cmd_type.strip().replace(" ", "_")
-        cfg = self.str_to_dict(res['cfg_str'])
-        
-        # supplement the configuration
-        ant_list   = self.antenna_dropdown.get_selected_options()
-        hp_targets = list_to_hashpipe_targets(self.targets_dropdown.get_selected_options())
-
-        if supplement:
-            if cmd_type == "SETFREQ":
-                cfg['ant_list'] = ant_list
-            if cmd_type == "BACKEND":
-                cfg['hp_targets'] = hp_targets
-            if cmd_type == "TRACK":
-                cfg['ant_list'] = ant_list
-                cfg['hp_targets'] = hp_targets
-            if cmd_type == "SETAZEL":
-                cfg['ant_list'] = ant_list
-
-        return cmd_type, cfg
-
-
-    def str_to_dict(self, cfg_str):
-        splt = cfg_str.split(",")
-        
-        cfg = {}
-        for keyval in splt:
-            key, val = keyval.split(":")
-            key = key.strip().replace(" ", "_")
-
-            cfg[key] = val.strip()
-
-        return cfg
-
     def change_color_of_selected_entry(self, selected_index):
         """
         Run this in the "queue" system
         """
-        event = {"event_name": "change_color_of_entry",
-                "event_args": {"selected_index": selected_index}}
-        self.task_queue.put(event)
+        self.events.put("change_color_of_entry",
+                {"selected_index": selected_index})
 
 
     def _change_color_of_selected_entry(self, selected_index):
-        # Get all current entries
-        current_items = self.listbox.get(0, tk.END)
-        
-        # Clear the listbox
-        self.listbox.delete(0, tk.END)
-        
-        # Reinsert all entries, and change the background color for the selected entry
-        for i, item in enumerate(current_items):
-            self.listbox.insert(tk.END, item)
-            # To keep in mind:
-            # Linux (some platforms): In some environments, 
-            # itemconfig() may not function as expected due 
-            # to theme-related constraints.
-            if i < selected_index:
-                self.listbox.itemconfig(i, {'bg': 'grey'})
-            elif i == selected_index:
-                self.listbox.itemconfig(i, {'bg': 'lightgreen'})  # Change color of selected entry
-            else:
-                self.listbox.itemconfig(i, {'bg': self.listbox.cget("bg")})  # Default color for other entries
-        #self.update()
+        # only the rows that changed state get redrawn
+        self.listbox.set_current(selected_index)
 
     def disable_everything(self):
         """
         Run this in the "queue" system
         """
-        event = {"event_name": "disable_everything",
-                "event_args": None}
-        self.task_queue.put(event)
+        self.events.put("disable_everything")
 
     def _disable_everything(self):
         for button in self.to_enable_disable + self.to_readonly_disable:
@@ -1826,9 +2015,7 @@ class TelescopeSchedulerApp(tk.Tk):
         """
         Run this in the "queue" system
         """
-        event = {"event_name": "enable_everything",
-                "event_args": None}
-        self.task_queue.put(event)
+        self.events.put("enable_everything")
 
 
     def _enable_everything(self):
@@ -1909,10 +2096,7 @@ class TelescopeSchedulerApp(tk.Tk):
         localized_time_str = localized_time.strftime(WAIT_DTFMT)
 
         #entry = f"--  WAITUNTIL  -- {localized_time}"
-        cmd_type = "WAITUNTIL"
-        entry = cmd_type + (12 - len(cmd_type))*" " + f"-- dt: {localized_time_str}"
-        self.listbox.insert(tk.END, entry)
-        self.disable_execute()
+        self.append_line(WaitUntil(localized_time_str))
 
         # to parse back
         # Parse the string including the timezone
@@ -1921,20 +2105,13 @@ class TelescopeSchedulerApp(tk.Tk):
 
 
     def wait_for_prompt(self, event=None):
-        cmd_type = "WAITPROMPT"
-        entry = cmd_type + (12 - len(cmd_type))*" " + f"-- Method: prompt"
-        self.listbox.insert(tk.END, entry)
-        self.disable_execute()
+        self.append_line(WaitPrompt("prompt"))
 
 
     def wait_for_seconds(self, event=None):
         wait_time = self.wait_for_entry.get()
         if is_positive_number(wait_time):
-            cmd_type = "WAITFOR"
-            entry = cmd_type + (12 - len(cmd_type))*" " 
-            entry += f"-- twait: {wait_time}"
-            self.listbox.insert(tk.END, entry)
-            self.disable_execute()
+            self.append_line(WaitFor(wait_time))
 
 
     def start_progress_bar_indefinite(self):
@@ -1970,6 +2147,10 @@ if __name__ == "__main__":
     parser.add_argument('-i', '--ignore-check', 
             help='Make schedule file always executable; ignore check_schedule',
             action='store_true')
+    parser.add_argument('-f', '--fixed-clock',
+            help='Start every TRACK at the time predicted by the plan, '
+            'instead of as soon as the previous line is done',
+            action='store_true')
 
     args = parser.parse_args()
 
@@ -0,0 +1,182 @@
+"""
+Slack messages, sent from a background thread.
+
+Posting to slack can be slow or fail, so messages are queued and sent
+by a single thread with one WebClient, retried with backoff, and bursts
+of messages are sent as one. Nothing here ever blocks the caller.
+
+For testing, ATASLACKURL points the client to a local stand-in of the
+slack API instead of https://slack.com/api/.
+"""
+import os
+import time
+import threading
+import collections
+
+# keep at most this many messages waiting, the oldest get dropped
+SLACK_QUEUE_SIZE = 100
+
+# messages that come within SLACK_COALESCE seconds of each other are
+# sent as one, of at most SLACK_MAX_LINES lines, waiting no more than
+# SLACK_COALESCE_MAX seconds for the burst to end
+SLACK_COALESCE = 2
+SLACK_COALESCE_MAX = 10
+SLACK_MAX_LINES = 20
+
+# how many times to try a message, and the backoff between tries [s]
+SLACK_RETRIES = 5
+SLACK_BACKOFF = 1
+SLACK_BACKOFF_MAX = 60
+
+# how long close() waits for the queue to be sent
+SLACK_CLOSE_TIMEOUT = 10
+
+
+class SlackNotifier:
+    """
+    Parameters:
+    - token (str): slack auth token
+    - channel (str): channel ID
+    - write_status (callable): to report messages that could not be sent
+    - base_url (str): slack API url, for testing
+    """
+    def __init__(self, token, channel, write_status=print, base_url=None):
+        self.token = token
+        self.channel = channel
+        self.write_status = write_status
+        self.base_url = base_url
+
+        self.client = None
+        self.messages = collections.deque(maxlen=SLACK_QUEUE_SIZE)
+        self.n_dropped = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = None
+
+    @classmethod
+    def from_env(cls, write_status=print):
+        """
+        Notifier for the ATATOKEN and ATACHANNEL of the environment
+        """
+        return cls(os.environ.get("ATATOKEN", ""),
+                os.environ.get("ATACHANNEL", ""), write_status,
+                os.environ.get("ATASLACKURL"))
+
+    def send(self, text):
+        """
+        Queues a message, returns straight away
+        """
+        with self.cond:
+            if self.closed:
+                return
+            if len(self.messages) == self.messages.maxlen:
+                self.n_dropped += 1
+            self.messages.append(text)
+            # started on first use, so that a notifier made before a
+            # fork doesn't end up without its thread
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def close(self, timeout=SLACK_CLOSE_TIMEOUT):
+        """
+        Sends whatever is queued, for up to timeout seconds
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.messages and not self.closed:
+                    self.cond.wait()
+                if not self.messages:
+                    return
+
+                # let a burst of messages come in, and send it as one
+                self.settle()
+                lines = []
+                while self.messages and len(lines) < SLACK_MAX_LINES:
+                    lines.append(self.messages.popleft())
+                n_dropped, self.n_dropped = self.n_dropped, 0
+
+            if n_dropped:
+                lines.append(f"({n_dropped} older messages were dropped)")
+            self.post("\n".join(lines))
+
+    def settle(self):
+        """
+        Waits, with self.cond held, until no message came in for
+        SLACK_COALESCE seconds, there are enough for a full post, or we
+        are closing
+        """
+        t_max = time.monotonic() + SLACK_COALESCE_MAX
+        while not self.closed and len(self.messages) < SLACK_MAX_LINES:
+            n_messages = len(self.messages) + self.n_dropped
+            deadline = min(time.monotonic() + SLACK_COALESCE, t_max)
+            while not self.closed and \
+                    len(self.messages) + self.n_dropped == n_messages:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self.cond.wait(remaining)
+
+    def post(self, text):
+        from slack_sdk.errors import SlackApiError
+
+        backoff = SLACK_BACKOFF
+        for i in range(SLACK_RETRIES):
+            try:
+                self.get_client().chat_postMessage(channel=self.channel,
+                        text=text)
+                return
+            except SlackApiError as e:
+                status = e.response.status_code
+                if status != 429 and status < 500:
+                    # not going to get better by trying again
+                    self.write_status(f"Could not send slack message: "
+                            f"{e.response.get('error', status)}", fg='orange')
+                    return
+                wait = backoff
+                if status == 429:
+                    wait = float(e.response.headers.get("Retry-After", backoff))
+                error = e
+            except Exception as e:
+                # slack unreachable
+                wait = backoff
+                error = e
+
+            if i < SLACK_RETRIES - 1:
+                if self.wait_closing(wait):
+                    # closing, don't hold everything up for too long
+                    backoff = SLACK_BACKOFF
+                else:
+                    backoff = min(2 * backoff, SLACK_BACKOFF_MAX)
+
+        self.write_status(f"Could not send slack message after "
+                f"{SLACK_RETRIES} tries: {error}", fg='orange')
+
+    def wait_closing(self, timeout):
+        """
+        Sleeps for timeout, or less once close() is called. Returns whether
+        we are closing
+        """
+        with self.cond:
+            if not self.closed:
+                self.cond.wait(min(timeout, SLACK_BACKOFF_MAX))
+            return self.closed
+
+    def get_client(self):
+        if self.client is None:
+            from slack_sdk import WebClient
+
+            kwargs = {"token": self.token}
+            if self.base_url:
+                kwargs["base_url"] = self.base_url
+            self.client = WebClient(**kwargs)
+        return self.client
@@ -0,0 +1,127 @@
+"""
+Measures how long the scheduler GUI takes to come up.
+
+Reports the time from starting python to the first window being shown,
+and what importing scheduler.py costs, per top-level module:
+
+    python startup_benchmark.py [-n 5]
+
+Needs a display, like the GUI itself. Every run is a fresh python
+process, so nothing is cached between runs. The GUI runs in a temporary
+directory with a copy of its configuration, so that its logs and status
+socket don't get mixed up with the ones of a real scheduler.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# configuration the GUI reads from its working directory
+CONFIG_FNAMES = ["projects.json", "backends.json", "postprocessors.json",
+        "overheads.json", "topology.json"]
+
+# run in a fresh interpreter: import the GUI, build the app and time
+# how long until its window is visible
+FIRST_WINDOW_CODE = """
+import time
+t0 = time.perf_counter()
+import json, argparse
+import scheduler
+t_import = time.perf_counter()
+args = argparse.Namespace(debug=True, ignore_check=False, fixed_clock=False)
+app = scheduler.TelescopeSchedulerApp(args)
+t_init = time.perf_counter()
+app.wait_visibility(app)
+t_window = time.perf_counter()
+app.shutdown()
+print(json.dumps({"import": t_import - t0, "init": t_init - t_import,
+    "window": t_window - t0}))
+"""
+
+
+def run_python(args, cwd=SCRIPT_DIR, env=None):
+    return subprocess.run([sys.executable] + args, capture_output=True,
+            text=True, cwd=cwd, env=env)
+
+
+def time_first_window():
+    """
+    Returns:
+    - dict: import, init and window (time to first window), in seconds
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for fname in CONFIG_FNAMES:
+            if os.path.exists(os.path.join(SCRIPT_DIR, fname)):
+                shutil.copy(os.path.join(SCRIPT_DIR, fname), tmpdir)
+
+        env = dict(os.environ, XDG_RUNTIME_DIR=tmpdir,
+                PYTHONPATH=os.pathsep.join(filter(None,
+                    [SCRIPT_DIR, os.environ.get("PYTHONPATH")])))
+        res = run_python(["-c", FIRST_WINDOW_CODE], tmpdir, env)
+    if res.returncode != 0:
+        raise RuntimeError(res.stderr.strip().splitlines()[-1])
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def time_imports(module="scheduler"):
+    """
+    Cumulative import time of every module imported by module (and not
+    imported before), from python -X importtime
+
+    Returns:
+    - dict: {module name: seconds}
+    """
+    res = run_python(["-X", "importtime", "-c", f"import {module}"])
+    if res.returncode != 0:
+        raise RuntimeError(res.stderr.strip().splitlines()[-1])
+
+    costs = {}
+    for line in res.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # every level of nesting indents the name by two more spaces,
+        # keep what module imports directly
+        name = name.rstrip()
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level != 1:
+            continue
+        costs[name.strip()] = int(cumulative) / 1e6
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Measure the startup time of the scheduler GUI')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+            help='number of runs (default: %(default)s)')
+    parser.add_argument('-t', '--top', type=int, default=15,
+            help='number of modules to list (default: %(default)s)')
+    args = parser.parse_args()
+
+    windows = [time_first_window() for _ in range(args.repeat)]
+    print(f"Time to first window over {args.repeat} runs (median):")
+    for key in ("import", "init", "window"):
+        print(f"  {key:<8}{statistics.median(w[key] for w in windows):>8.3f} s")
+
+    imports = [time_imports() for _ in range(args.repeat)]
+    modules = set().union(*imports)
+    costs = {name: statistics.median(i.get(name, 0) for i in imports)
+            for name in modules}
+
+    print(f"\nImport cost of scheduler.py per module (median):")
+    for name, cost in sorted(costs.items(), key=lambda x: -x[1])[:args.top]:
+        print(f"  {name:<32}{cost:>8.3f} s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
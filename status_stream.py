@@ -0,0 +1,242 @@
+"""
+Progress of schedule execution, published on a local Unix socket.
+
+Every subscriber that connects to the socket gets one JSON object per
+line for every event, e.g.:
+
+    {"type": "line_started", "time": 1718000000.0, "schedule_id": "...",
+     "line": 3, "cmd_type": "TRACK", "source": "3c286", "config": {...}}
+
+New subscribers first get the schedule_started and line_started of what
+is running, if anything. Subscribers that can't keep up are dropped, so
+they never slow the execution down. To follow it from a terminal:
+
+    python status_stream.py [socket]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+# the same wherever the scheduler and its subscribers are started from
+STATUS_SOCKET_FNAME = os.path.join(os.environ.get("XDG_RUNTIME_DIR")
+        or tempfile.gettempdir(), "ata_scheduler_status.sock")
+
+# a subscriber that doesn't take an event within this long is dropped [s]
+STATUS_SEND_TIMEOUT = 1
+
+EVENT_TYPES = ("schedule_started", "line_started", "line_finished",
+        "line_failed", "schedule_finished", "schedule_aborted",
+        "schedule_failed")
+
+# events that end a schedule
+END_EVENT_TYPES = ("schedule_finished", "schedule_aborted",
+        "schedule_failed")
+
+# put on the queue when someone subscribes
+SUBSCRIBED = "subscribed"
+
+
+class StatusPublisher:
+    """
+    Parameters:
+    - fname (str): path of the socket
+    - write_status (callable): to report subscribers that were dropped
+    """
+    def __init__(self, fname=STATUS_SOCKET_FNAME, write_status=print):
+        self.fname = fname
+        self.write_status = write_status
+
+        # events can come from a process forked from this one, only this
+        # process talks to the subscribers
+        self.queue = multiprocessing.Queue()
+        # the sender thread is the only one that sends, new subscribers
+        # are handed over to it
+        self.subscribers = []
+        self.new_subscribers = []
+        self.lock = threading.Lock()
+        # what is running, for new subscribers: {"schedule": event,
+        # "line": event}. Only used by the sender thread
+        self.current = {}
+        self.sock = None
+        self.sender = None
+
+    def start(self):
+        """
+        Starts listening for subscribers
+
+        Raises:
+        - OSError: if the socket can't be made, or another scheduler is
+          already publishing on it
+        """
+        if os.path.exists(self.fname):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.fname)
+            except OSError:
+                # left over from a scheduler that didn't exit cleanly
+                os.remove(self.fname)
+            else:
+                raise OSError(f"{self.fname} is in use by another scheduler")
+            finally:
+                probe.close()
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.fname)
+        self.sock.listen()
+
+        threading.Thread(target=self.accept, daemon=True).start()
+        self.sender = threading.Thread(target=self.send, daemon=True)
+        self.sender.start()
+
+    def publish(self, event_type, **fields):
+        """
+        Publishes an event, returns straight away. Can be called from any
+        thread, or from a process forked from the one that started
+        """
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown status event: {event_type}")
+        event = {"type": event_type, "time": time.time()}
+        event.update(fields)
+        self.queue.put(event)
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.queue.put(None)
+        self.sender.join(STATUS_SEND_TIMEOUT)
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.sock = None
+        with self.lock:
+            for conn in self.subscribers + self.new_subscribers:
+                conn.close()
+            self.subscribers = []
+            self.new_subscribers = []
+        if os.path.exists(self.fname):
+            os.remove(self.fname)
+
+    def accept(self):
+        sock = self.sock
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                # closed
+                return
+            conn.settimeout(STATUS_SEND_TIMEOUT)
+            with self.lock:
+                self.new_subscribers.append(conn)
+            # wake the sender up to catch it up with what is running
+            self.queue.put(SUBSCRIBED)
+
+    def send(self):
+        while True:
+            try:
+                event = self.queue.get()
+            except (EOFError, OSError, ValueError):
+                return
+            if event is None:
+                return
+
+            with self.lock:
+                subscribers = self.subscribers
+                new_subscribers, self.new_subscribers = \
+                        self.new_subscribers, []
+
+            # sent without the lock, so a slow subscriber only ever holds
+            # up this thread
+            subscribers = subscribers + [conn for conn in new_subscribers
+                    if self.send_to(conn, list(self.current.values()))]
+
+            if event != SUBSCRIBED:
+                if event["type"] == "schedule_started":
+                    self.current = {"schedule": event}
+                elif event["type"] == "line_started":
+                    self.current["line"] = event
+                elif event["type"] in END_EVENT_TYPES:
+                    self.current = {}
+
+                subscribers = [conn for conn in subscribers
+                        if self.send_to(conn, [event])]
+
+            with self.lock:
+                if self.sock is None:
+                    # closed in the meantime
+                    for conn in subscribers:
+                        conn.close()
+                    return
+                self.subscribers = subscribers
+
+    def send_to(self, conn, events):
+        """
+        Returns whether the subscriber took the events, it is closed if not
+        """
+        data = "".join(json.dumps(event, default=str) + "\n"
+                for event in events).encode()
+        try:
+            conn.sendall(data)
+            return True
+        except OSError:
+            conn.close()
+            self.write_status("Dropped a status subscriber that did not "
+                    "keep up", fg='orange')
+            return False
+
+
+def subscribe(fname=STATUS_SOCKET_FNAME):
+    """
+    Yields the events published on the socket, until it is closed
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(fname)
+        with sock.makefile("r") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def format_event(event):
+    t = time.strftime("%H:%M:%S", time.localtime(event["time"]))
+    text = f"[{t}] {event['type']:<18}"
+    if "line" in event:
+        text += f" line {event['line']} {event.get('cmd_type', '')}"
+    if event.get("source"):
+        text += f" {event['source']}"
+    if event.get("duration") is not None:
+        text += f" ({event['duration']:.1f} s)"
+    if "error" in event:
+        text += f": {event['error']}"
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Follow the execution of a schedule')
+    parser.add_argument('fname', nargs='?', default=STATUS_SOCKET_FNAME,
+            help='status socket (default: %(default)s)')
+    parser.add_argument('-j', '--json', action='store_true',
+            help='print the events as JSON')
+    args = parser.parse_args()
+
+    try:
+        for event in subscribe(args.fname):
+            print(json.dumps(event) if args.json else format_event(event),
+                    flush=True)
+    except OSError as e:
+        print(f"Could not follow {args.fname}: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
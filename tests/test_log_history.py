@@ -0,0 +1,61 @@
+"""
+LogHistory pages older messages back in from the indexed log files
+"""
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import schedule_logging
+from schedule_logging import IndexedFileHandler, JsonFormatter
+from log_history import LogHistory
+
+
+def write_log(fname, n, max_bytes=0):
+    handler = IndexedFileHandler(fname, maxBytes=max_bytes, backupCount=3)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger("test_log_history")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(n):
+            color = "red" if i % 10 == 0 else "green"
+            logger.error(f"message {i}", extra={"color": color})
+            # not a status message, never shown
+            logger.info(f"record {i}")
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def page_all(history, min_level=logging.NOTSET):
+    messages, before = [], history.first_time()
+    while before is not None:
+        entries, before = history.older(before, min_level, n=7)
+        messages = [entry["message"].split(": ", 1)[1]
+                for entry in entries] + messages
+    return messages
+
+
+def test_older_pages_everything(tmp_path, monkeypatch):
+    monkeypatch.setattr(schedule_logging, "LOG_INDEX_BLOCK", 6)
+    fname = str(tmp_path / "app.jsonl")
+    write_log(fname, 50)
+
+    history = LogHistory(fname)
+    assert page_all(history) == [f"message {i}" for i in range(50)]
+    assert page_all(history, logging.ERROR) == [f"message {i}"
+            for i in range(0, 50, 10)]
+
+
+def test_older_across_rotation(tmp_path, monkeypatch):
+    monkeypatch.setattr(schedule_logging, "LOG_INDEX_BLOCK", 6)
+    fname = str(tmp_path / "app.jsonl")
+    write_log(fname, 30, max_bytes=2000)
+    assert os.path.exists(fname + ".1.idx")
+
+    # what is still there after the oldest backups were dropped
+    messages = page_all(LogHistory(fname))
+    first = int(messages[0].split()[1])
+    assert messages == [f"message {i}" for i in range(first, 30)]
@@ -0,0 +1,23 @@
+"""
+ScheduleLine keeps the values as text, whatever the schedule file has
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from schedule_model import line_from_config
+
+
+def test_numbers_are_kept_as_text():
+    line = line_from_config("SETFREQ", {"TuningA": 0, "TuningB": "1500",
+        "RFgain": 8, "IFgain": 8, "EQlevel": 1, "Focus": "a",
+        "RA_OFF1": 0.5})
+    assert line.tuning_a == "0"
+    assert line.extra["RA_OFF1"] == "0.5"
+
+
+def test_number_and_text_are_the_same_line():
+    a = line_from_config("WAITFOR", {"twait": 600})
+    b = line_from_config("WAITFOR", {"twait": "600"})
+    assert a.key() == b.key()
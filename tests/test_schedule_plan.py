@@ -0,0 +1,98 @@
+"""
+PlanCache against a stand-in of ObsPlan that slews from the last source
+"""
+import os
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("astropy")
+from astropy.time import TimeDelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# seconds of slew per hour of ra, and overhead before every block
+SLEW_RATE = 100
+OVERHEAD = 20
+
+
+class FakeObsPlan:
+    # add_obs_block() calls of all the plans
+    n_blocks_added = 0
+
+    def __init__(self, t_start, slew_time=True, obs_overhead=True):
+        self.t = t_start
+        self.obs_plan = []
+        self.ra = None
+
+    def set_current_position(self, ant_list):
+        self.ra = 0.
+
+    def add_wait_time(self, seconds):
+        self.t = self.t + TimeDelta(seconds, format='sec')
+
+    def add_obs_block(self, source, obs_time):
+        FakeObsPlan.n_blocks_added += 1
+        ra = float(source[1:])
+        slew = 0 if self.ra is None else SLEW_RATE * abs(ra - self.ra)
+        start = self.t + TimeDelta(OVERHEAD + slew, format='sec')
+        end = start + TimeDelta(obs_time, format='sec')
+        self.obs_plan.append({"object": source, "ra": ra, "dec": 10.,
+            "start_time": start, "end_time": end})
+        self.t, self.ra = end, ra
+
+
+if "ata_obs_plan" not in sys.modules:
+    sys.modules["ata_obs_plan"] = types.SimpleNamespace(ObsPlan=FakeObsPlan)
+
+from schedule_plan import PlanCache, blocks_differ
+
+
+def add_to_obs_plan(obs, cmd_type, config):
+    if cmd_type == "TRACK":
+        obs.add_obs_block(config["Source"], int(config["ObsTime"]))
+    elif cmd_type == "WAITFOR":
+        obs.add_wait_time(int(config["twait"]))
+
+
+def new_cache():
+    return PlanCache(FakeObsPlan, add_to_obs_plan)
+
+
+def schedule(sources):
+    cmds_cfgs = []
+    for source in sources:
+        cmds_cfgs.append(["TRACK", {"Source": source, "ObsTime": "300",
+            "ant_list": ["1a", "1c"]}])
+        cmds_cfgs.append(["WAITFOR", {"twait": "30"}])
+    return cmds_cfgs
+
+
+def test_partial_plan_is_full_plan():
+    cache = new_cache()
+    cache.get_plan(schedule(["s1", "s5", "s2", "s7", "s3"]))
+
+    edited = schedule(["s1", "s5", "s9", "s7", "s3"])
+    FakeObsPlan.n_blocks_added = 0
+    cache.get_plan(edited)
+    assert cache.n_reused == 3
+    # the 3 blocks from the edit, and the TRACK before it twice
+    assert FakeObsPlan.n_blocks_added == 5
+
+    full = new_cache()
+    full.get_plan(edited)
+    assert not blocks_differ(cache.blocks, full.blocks)
+
+
+def test_unchanged_plan_keeps_visibility():
+    pytest.importorskip("numpy")
+    cmds_cfgs = schedule(["s1", "s5"])
+
+    cache = new_cache()
+    cache.get_visibility(cache.get_plan(cmds_cfgs))
+    cache.get_visibility(cache.get_plan(cmds_cfgs))
+    assert len(cache.visibility) == 2
+
+    cache.get_visibility(cache.get_plan(schedule(["s1"])))
+    assert len(cache.visibility) == 1
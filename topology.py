@@ -0,0 +1,65 @@
+"""
+Antennas and recorders that can be used, and the last known list of them.
+
+Asking the config service can be slow, so the GUI shows the topology
+saved the last time straight away, and asks for a fresh one in the
+background.
+"""
+import os
+import json
+import tempfile
+
+from schedule_model import hashpipe_targets_to_list
+
+TOPOLOGY_FNAME = "./topology.json"
+
+
+def discover_topology():
+    """
+    Asks the config service for the active antennas and the recorders
+
+    Returns:
+    - dict: antennas (sorted list) and recorders (list of node.instance)
+    """
+    from SNAPobs import snap_config
+    from SNAPobs.snap_hpguppi import snap_hpguppi_defaults as hpguppi_defaults
+
+    # get antenna list
+    ant_list = sorted(snap_config.get_rfsoc_active_antlist())
+
+    # get hashpipe recorders
+    d = hpguppi_defaults.hashpipe_targets_LoA.copy()
+    d.update(hpguppi_defaults.hashpipe_targets_LoB)
+
+    return {"antennas": ant_list, "recorders": hashpipe_targets_to_list(d)}
+
+
+def load_topology(fname=TOPOLOGY_FNAME):
+    """
+    Returns the last known topology, or None if there is none
+    """
+    try:
+        with open(fname, "r") as f:
+            topology = json.load(f)
+        return {"antennas": list(topology["antennas"]),
+                "recorders": list(topology["recorders"])}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_topology(topology, fname=TOPOLOGY_FNAME):
+    # write and rename, so that a GUI starting at the same time never
+    # reads half a file
+    fname = os.path.abspath(fname)
+    fd, tmp_fname = tempfile.mkstemp(suffix=".tmp", prefix=".topology_",
+            dir=os.path.dirname(fname))
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(topology, f, indent=4)
+        # mkstemp files are only readable by us
+        os.chmod(tmp_fname, 0o644)
+        os.replace(tmp_fname, fname)
+    except Exception:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+        raise